@@ -262,7 +262,8 @@ class AWS:
         s3_data_hash_location = '%shash' % s3_data_bucket_dir
 
         # Hashing details
-        local_data_dependency_hash = MantraHashed.get_data_dependency_hash(data_dir=data_dir, dataset_class=self.dataset_class)
+        local_data_dependency_hash = MantraHashed.get_data_dependency_hash(data_dir=data_dir, dataset_class=self.dataset_class, 
+            verify=getattr(args, 'verify', False))
 
         s3_client = boto3.client('s3')
         s3_resource = boto3.resource('s3')
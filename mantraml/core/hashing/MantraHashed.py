@@ -1,12 +1,45 @@
 import binascii
 import datetime
 import hashlib
+import json
 import os
 import shutil
 import stat
 import zlib
 
 BUF_SIZE = 65536  # read files in 64kb chunks
+UNVERSIONED_FOLDERS = ['.extract', '.cache']  # derived data folders that we never version
+HASH_MANIFEST_FILE = 'hashes.json'  # stat-keyed file hashes, stored in the raw/.cache folder of a dataset
+
+
+class HashingReader(object):
+    """
+    Wraps a binary file object, and calculates the SHA256 hash of the bytes as they are read. This lets us hash a file in the
+    same pass as we process it, e.g. when we stream a tar file into its extraction
+    """
+
+    def __init__(self, file_object):
+        self.file_object = file_object
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.file_object.read(size)
+        self.sha256.update(data)
+        return data
+
+    def hexdigest(self):
+        """
+        Reads the rest of the file, so the hash covers the whole file, and returns the SHA256 hash
+
+        Returns
+        -----------
+        str - the SHA256 hash of the file
+        """
+
+        while self.read(BUF_SIZE):
+            pass
+
+        return self.sha256.hexdigest()
 
 
 class MantraHashed(object):
@@ -40,6 +73,140 @@ class MantraHashed(object):
 
         return sha256.hexdigest()
 
+    @staticmethod
+    def get_file_stat(file_location):
+        """
+        This method returns the stat tuple we use to detect whether a file has changed since it was last hashed
+
+        Parameters
+        -----------
+        file_location - str
+            The location of the file
+
+        Returns
+        -----------
+        list - [size, mtime_ns, inode] of the file
+        """
+
+        file_stat = os.stat(file_location)
+
+        return [file_stat.st_size, file_stat.st_mtime_ns, file_stat.st_ino]
+
+    @staticmethod
+    def load_hash_manifest(manifest_location):
+        """
+        This method loads a hash manifest, which maps file locations to their stat tuple and SHA256 hash
+
+        Parameters
+        -----------
+        manifest_location - str
+            The location of the manifest
+
+        Returns
+        -----------
+        dict - absolute file location -> [size, mtime_ns, inode, SHA256 hash]; empty if there is no manifest
+        """
+
+        if not os.path.isfile(manifest_location):
+            return {}
+
+        with open(manifest_location, 'r') as manifest_file:
+            return json.load(manifest_file)
+
+    @staticmethod
+    def save_hash_manifest(manifest_location, manifest):
+        """
+        This method stores a hash manifest
+
+        Parameters
+        -----------
+        manifest_location - str
+            The location of the manifest
+
+        manifest - dict
+            The manifest, see load_hash_manifest
+        """
+
+        with open('%s.tmp' % manifest_location, 'w') as manifest_file:
+            json.dump(manifest, manifest_file)
+
+        os.replace('%s.tmp' % manifest_location, manifest_location)
+
+    @classmethod
+    def get_manifest_hash(cls, file_location, manifest):
+        """
+        This method returns the hash of a file from a hash manifest, if the file has not changed since it was hashed: that is,
+        its size, modification time and inode are the same
+
+        Parameters
+        -----------
+        file_location - str
+            The location of the file
+
+        manifest - dict
+            The manifest, see load_hash_manifest
+
+        Returns
+        -----------
+        str - the SHA256 hash of the file, or None if the file is not in the manifest or has changed
+        """
+
+        entry = manifest.get(os.path.abspath(file_location))
+
+        if entry is None or entry[:3] != cls.get_file_stat(file_location):
+            return None
+
+        return entry[3]
+
+    @classmethod
+    def record_manifest_hash(cls, file_location, manifest, file_hash):
+        """
+        This method records the hash of a file in a hash manifest, along with the current stat tuple of the file
+
+        Parameters
+        -----------
+        file_location - str
+            The location of the file
+
+        manifest - dict
+            The manifest, see load_hash_manifest
+
+        file_hash - str
+            The SHA256 hash of the file
+        """
+
+        manifest[os.path.abspath(file_location)] = cls.get_file_stat(file_location) + [file_hash]
+
+    @classmethod
+    def get_256_hash_from_file_with_manifest(cls, file_location, manifest, verify=False):
+        """
+        This method calculates the SHA256 hash of a file, unless the file is unchanged since the manifest recorded its hash
+
+        Parameters
+        -----------
+        file_location - str
+            The location of the file to be hashed
+
+        manifest - dict
+            The manifest, see load_hash_manifest; we record the hash in it
+
+        verify - bool
+            If True, we always read the file and hash it
+
+        Returns
+        -----------
+        str - the SHA256 hash of the file
+        """
+
+        file_hash = None if verify else cls.get_manifest_hash(file_location, manifest)
+
+        if file_hash is None:
+            file_hash = cls.get_256_hash_from_file(file_location)
+
+        cls.record_manifest_hash(file_location, manifest, file_hash)
+
+        return file_hash
+
     @staticmethod
     def get_256_hash_from_string(string):
         """
@@ -166,13 +333,15 @@ class MantraHashed(object):
         return tree_info
 
     @classmethod
-    def get_data_dependency_hash(cls, data_dir, dataset_class):
+    def get_data_dependency_hash(cls, data_dir, dataset_class, verify=False):
         """
         This method takes a dataset_class, with a files class variable, and works out the concatenated hash
         from the files. We use this to get an hash of the dataset dependencies, so we can compare hashes
         of these dependencies between environments (local and cloud) and know whether to transfer large
         files or not (if they have changed).
 
+        Files are only read if they changed since they were last hashed, according to the hash manifest in raw/.cache.
+
         Parameters
         -----------
         data_dir - str
@@ -181,6 +350,9 @@ class MantraHashed(object):
         dataset_class - mantraml.Dataset type class
             Containing a files class variable that we will calculate a concatenated hash for
 
+        verify - bool
+            If True, we hash every file, even if the manifest says it is unchanged
+
         Returns
         ---------
         str - SHA-256 hash of the data dependencies
@@ -188,14 +360,24 @@ class MantraHashed(object):
 
         file_hashes = []
 
+        cache_dir = '%sraw/.cache' % data_dir
+        manifest_location = '%s/%s' % (cache_dir, HASH_MANIFEST_FILE)
+
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+        manifest = cls.load_hash_manifest(manifest_location)
+
         for file in sorted(dataset_class.files):
 
             if not os.path.isfile('%sraw/%s' % (data_dir, file)):
                 raise IOError('The following file that was referenced in your Dataset class does not exist: %s' % file)
 
-            tar_hash = MantraHashed.get_256_hash_from_file('%sraw/%s' % (data_dir, file))
+            tar_hash = cls.get_256_hash_from_file_with_manifest('%sraw/%s' % (data_dir, file), manifest, verify=verify)
             file_hashes.append(tar_hash)
 
+        cls.save_hash_manifest(manifest_location, manifest)
+
         return MantraHashed.get_256_hash_from_string(''.join(file_hashes))
 
     @classmethod
@@ -219,8 +401,8 @@ class MantraHashed(object):
 
             current_dir = path.split('/')[-1]
 
-            # extracted folders are never stored
-            if '.extract/' in path or current_dir == '.extract':
+            # extracted and cached folders are never stored
+            if any(['%s/' % folder in path or current_dir == folder for folder in UNVERSIONED_FOLDERS]):
                 continue
 
             files_list = [file for file in files if file != 'hash']
@@ -229,7 +411,7 @@ class MantraHashed(object):
                 file_path = '%s/%s' % (path, file)
                 hash_dict[file_path] = cls.create_file_hash_dict(file, file_path)
 
-            filtered_dirs = [directory for directory in dirs if directory != '.extract']
+            filtered_dirs = [directory for directory in dirs if directory not in UNVERSIONED_FOLDERS]
             hash_dict[path] = cls.create_tree_hash_dict(current_dir, path, filtered_dirs, files_list, hash_dict)
 
         return hash_dict[folder_dir]['hash'], hash_dict
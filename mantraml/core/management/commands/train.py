@@ -18,6 +18,7 @@ class TrainCmd(BaseCommand):
         parser.add_argument('--dev', action="store_true", help="Trains your model on a development instance")
         parser.add_argument('--savebestonly', action="store_true", help="Only saves model weights when better evaluation score is achieved")
         parser.add_argument('--verbose', action="store_true", help="Verbose printing")
+        parser.add_argument('--verify', action="store_true", help="Rehashes all data dependencies, rather than trusting unchanged file stats")
         parser.add_argument('--cloudremote', action="store_true", help="Used on cloud instances; user should not have to use this argument")
         parser.add_argument('-n', '--name', type=str, help="Optional name for your trial group, e.g. 'Dropout Trials'")
 
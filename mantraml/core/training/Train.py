@@ -45,6 +45,7 @@ class Train:
         self.instance_ids = args.instance_ids
         self.cloud = args.cloud
         self.dev = args.dev
+        self.verify = getattr(args, 'verify', False)
 
     def begin(self):
         """
@@ -102,7 +103,7 @@ class Train:
         if not dataset_class:
             return
 
-        dataset = dataset_class(name=self.dataset_name, trial=True, **self.kwargs)
+        dataset = dataset_class(name=self.dataset_name, trial=True, verify=self.verify, **self.kwargs)
         dataset.configure_core_arguments(self.args)
         
         # Obtain the model class
@@ -146,6 +147,7 @@ class Train:
         if not self.cloudremote: 
             print(colored('\n \033[1m Training\n', 'blue'))
 
+        model.start_training()
         model.run()
 
     def setup_local_training(self, model):
@@ -201,7 +201,7 @@ class Trial:
 
         hyperparm_dict = self.arg_dict.copy()
 
-        for training_param in ['instance_ids', 'savebestonly', 'task', 'dev', 'cloudremote', 'name']:         
+        for training_param in ['instance_ids', 'savebestonly', 'task', 'dev', 'cloudremote', 'name', 'verify']:         
             if training_param in hyperparm_dict:
                 metadata_dict[training_param] =  hyperparm_dict[training_param]
                 hyperparm_dict.pop(training_param)
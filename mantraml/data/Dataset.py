@@ -1,44 +1,32 @@
+import copy
 import glob
 import inspect
+import json
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 import os
 import tarfile
 import shutil
-import scipy.misc
 
 from collections import Counter
 
-from mantraml.core.hashing.MantraHashed import MantraHashed
+from mantraml.core.hashing.MantraHashed import HASH_MANIFEST_FILE, HashingReader, MantraHashed
 
+from .cache import cachedata, get_nbytes
 from .consts import DATA_TEST_MSGS
+from .prefetch import Prefetcher
+from .storage import (attach_shared_array, can_memmap, get_shared_block_name, is_shared_array, publish_shared_array, read_memmap, 
+    unpublish_shared_array, write_memmap)
+from .utils import get_image_channels, get_shard_bounds, indices_to_slice, sample_evenly
 
 TAR_FILES_TO_CHECK = 100
+COLOR_CHANNEL_SAMPLES = 100  # number of images whose headers we read to find the number of color channels
+IMAGE_PROBE_FILE = 'image_probe.json'  # file format and color channels of the images, stored in raw/.cache
+STORAGE_TYPES = ['memory', 'memmap', 'shared']
 
-
-def cachedata(function):
-    """
-    This decorator saves the output of a @property decorated function "my_data" to a private location "_my_data".
-    When we call the function again, we simply retrieve the output from RAM instead of doing the calculation again. 
-    """
-
-    @property
-    def wrapper(*args, **kwargs):
-        try:
-            stored_data = getattr(args[0], '_%s' % function.__name__)
-        except AttributeError:
-            setattr(args[0], '_%s' % function.__name__, None)
-            stored_data = getattr(args[0], '_%s' % function.__name__)
-
-        if stored_data is not None:
-            return stored_data
-        else:
-            stored_data = function(*args, **kwargs)
-            setattr(args[0], '_%s' % function.__name__, stored_data)
-            return stored_data
-
-    return wrapper
+# attributes that change the content of X and y, and so key the memory mapped files
+STORAGE_KEY_ATTRIBUTES = ['features', 'target', 'feature_indices', 'target_index', 'image_shape', 'normalize', 'image_dtype', 'shard_spec']
 
 
 class Dataset:
@@ -60,13 +48,34 @@ class Dataset:
 
     data_type = None
 
+    # 'memory' keeps X and y in RAM; 'memmap' writes them once to raw/.cache and serves memory maps of the files; 'shared' publishes
+    # them once to shared memory, keyed by the dependency hash, so other datasets on the machine attach to them rather than loading
+    storage = 'memory'
+
+    # if True, we hash every data dependency, rather than trusting the hashes of files whose stat is unchanged
+    verify_hashes = False
+
+    # if True, we configure, hash and extract the data files on first access to the data (X, y, len) rather than in __init__
+    lazy = False
+
+    # (num_shards, index) if the dataset is a shard of the data, see Dataset.shard
+    shard_spec = None
+
     def __init__(self, **kwargs):
 
+        self.storage = kwargs.get('storage', self.storage)
+        self.verify_hashes = kwargs.get('verify', self.verify_hashes)
+        self.lazy = kwargs.get('lazy', self.lazy)
+
+        if self.storage not in STORAGE_TYPES:
+            raise ValueError('The storage type %s is unsupported; choose one of %s' % (self.storage, ', '.join(STORAGE_TYPES)))
+
         self.folder_name = inspect.getfile(self.__class__).split('/')[-2]
         self.configure_files_attribute()
 
         self.data_from_files = False
         self.data_outside_project = False
+        self.files_data_pending = False
 
         if self.files:
             self.data_from_files = True
@@ -77,7 +86,10 @@ class Dataset:
             for file in self.files:
                 self.configure_data_directory(file)
 
-        if self.data_from_files:
+        if self.data_from_files and self.lazy:
+            self.files_data_kwargs = kwargs
+            self.files_data_pending = True
+        elif self.data_from_files:
             self.configure_files_data(**kwargs)
             self.extract_file_data()
 
@@ -85,6 +97,30 @@ class Dataset:
         self._X = None
         self._y = None
 
+    def load_files_data(self):
+        """
+        This method runs the steps a lazily constructed dataset deferred from __init__: configuring the file data attributes, and
+        hashing and extracting the files. It does nothing if these steps have already run. Threads share a per instance lock, so
+        the files are configured and extracted once
+
+        Returns
+        --------
+        void - configures and extracts the file data
+        """
+
+        if not self.files_data_pending:
+            return
+
+        with cachedata.get_lock(self, 'files_data'):
+            # another thread may have loaded the file data while we waited for the lock
+            if not self.files_data_pending:
+                return
+
+            self.configure_files_data(**self.files_data_kwargs)
+            self.extract_file_data()
+
+            self.files_data_pending = False
+
     def __getitem__(self, idx):
         """
         Returs a tuple of data based on the index
@@ -112,6 +148,309 @@ class Dataset:
 
         return self.X.shape[0]
 
+    def __getstate__(self):
+        """
+        Memory mapped and shared memory data is dropped when the dataset is pickled (e.g. for prefetch worker processes); the copy
+        reopens the files, or attaches to the shared memory, when the data is accessed
+        """
+
+        state = self.__dict__.copy()
+        state.pop('_cachedata_locks', None)
+
+        for key, value in state.items():
+            if is_shared_array(value):
+                state[key] = None
+
+        return state
+
+    @classmethod
+    def get_cachedata_names(cls):
+        """
+        This method returns the names of the cachedata properties of the class, e.g. X and y
+
+        Returns
+        --------
+        list of strs - the names of the properties
+        """
+
+        names = []
+
+        for klass in cls.__mro__:
+            for name, value in vars(klass).items():
+                if isinstance(value, cachedata) and name not in names:
+                    names.append(name)
+
+        return names
+
+    def invalidate(self, name=None):
+        """
+        This method drops cached data, so it is loaded again on next access
+
+        Parameters
+        --------
+        name - str (optional)
+            The name of the cachedata property to drop, e.g. 'X'; if None, we drop all cached data
+
+        Returns
+        --------
+        void - drops the cached data
+        """
+
+        names = self.get_cachedata_names() if name is None else [name]
+
+        for cachedata_name in names:
+            getattr(type(self), cachedata_name).invalidate(self)
+
+    def shard(self, num_shards, index):
+        """
+        This method returns a shard of the dataset, for splitting the data across workers. The examples are split into num_shards
+        contiguous, disjoint shards of nearly equal size, in the same way on every worker. The shard is a copy of the dataset without
+        its loaded data and prefetch timings; it loads only its own part of the data where the dataset type allows (e.g. images,
+        tabular files), and otherwise slices the loaded data
+
+        Parameters
+        --------
+        num_shards - int
+            The number of shards, e.g. the number of workers
+
+        index - int
+            The index of the shard, from 0 to num_shards - 1
+
+        Returns
+        --------
+        Dataset - the shard
+        """
+
+        num_shards, index = int(num_shards), int(index)
+
+        if num_shards < 1 or not 0 <= index < num_shards:
+            raise ValueError('The shard index must be between 0 and %s' % (num_shards - 1))
+
+        if self.shard_spec is not None:
+            raise ValueError('The dataset is already a shard')
+
+        dataset_shard = copy.copy(self)
+        dataset_shard.__dict__.pop('_cachedata_locks', None)
+        dataset_shard.shard_spec = (num_shards, index)
+
+        # the shard keeps its own prefetch timings rather than adding to those of the dataset
+        if getattr(self, 'prefetch_stats', None) is not None:
+            dataset_shard.prefetch_stats = None
+
+        for name in self.get_cachedata_names():
+            setattr(dataset_shard, '_%s' % name, None)
+
+        return dataset_shard
+
+    def get_natively_sharded_names(self):
+        """
+        This method returns the names of the cachedata properties that load only the data of the shard themselves; the other
+        properties are sliced after they are loaded
+
+        Returns
+        --------
+        list of strs - the names of the properties
+        """
+
+        return []
+
+    def shard_data(self, name, data):
+        """
+        This method restricts a loaded data attribute, e.g. X, to the shard of the dataset, if the attribute does not load only
+        the data of the shard itself. We copy the slice, so the full data can be freed
+
+        Parameters
+        --------
+        name - str
+            The name of the data attribute, e.g. X or y
+
+        data - np.ndarray or pd.DataFrame
+            The loaded data
+
+        Returns
+        --------
+        np.ndarray or pd.DataFrame - the data of the shard
+        """
+
+        if self.shard_spec is None or data is None or name in self.get_natively_sharded_names():
+            return data
+
+        start, stop = get_shard_bounds(len(data), *self.shard_spec)
+
+        if isinstance(data, (pd.DataFrame, pd.Series)):
+            return data.iloc[start:stop].copy()
+
+        return data[start:stop].copy()
+
+    def get_cached_nbytes(self):
+        """
+        This method returns the private memory held by the cached data of the dataset. Memory mapped and shared memory data
+        counts as zero
+
+        Returns
+        --------
+        dict - name of each cachedata property -> number of bytes
+        """
+
+        return {name: get_nbytes(getattr(self, '_%s' % name, None)) for name in self.get_cachedata_names()}
+
+    def batches(self, batch_size, shuffle=False, seed=None, drop_last=False, prefetch=0, prefetch_workers=1, prefetch_mode='thread', 
+        shared_memory=False):
+        """
+        This method iterates over the data in minibatches
+
+        Parameters
+        --------
+        batch_size - int
+            The number of examples in each batch
+
+        shuffle - bool
+            If True, the examples are visited in a random order
+
+        seed - int
+            Seed for the shuffle; if None, the order is different on each call
+
+        drop_last - bool
+            If True, a final batch smaller than batch_size is dropped
+
+        prefetch - int
+            If greater than zero, the number of batches to load ahead in the background (see mantraml.data.prefetch.Prefetcher)
+
+        prefetch_workers - int
+            The number of background threads or processes that load batches
+
+        prefetch_mode - str
+            'thread' or 'process'
+
+        shared_memory - bool
+            For process mode: pass batches back through POSIX shared memory rather than pickling them
+
+        Returns
+        --------
+        generator of tuples - (X batch, y batch or None)
+        """
+
+        batch_indices = self.get_batch_indices(batch_size, shuffle=shuffle, seed=seed, drop_last=drop_last)
+
+        if prefetch:
+            for batch in Prefetcher(self, batch_indices, depth=prefetch, workers=prefetch_workers, mode=prefetch_mode, shared_memory=shared_memory):
+                yield batch
+        else:
+            for indices in batch_indices:
+                yield self.get_batch(indices)
+
+    def get_batch_indices(self, batch_size, shuffle=False, seed=None, drop_last=False):
+        """
+        This method splits the example indices into minibatches
+
+        Parameters
+        --------
+        batch_size - int
+            The number of examples in each batch
+
+        shuffle - bool
+            If True, the examples are visited in a random order
+
+        seed - int
+            Seed for the shuffle; if None, the order is different on each call
+
+        drop_last - bool
+            If True, a final batch smaller than batch_size is dropped
+
+        Returns
+        --------
+        list of np.ndarrays - containing the indices of each batch
+        """
+
+        n_examples = self.get_num_examples()
+
+        if shuffle:
+            indices = np.random.RandomState(seed).permutation(n_examples)
+        else:
+            indices = np.arange(n_examples)
+
+        if drop_last:
+            n_batches = n_examples // batch_size
+        else:
+            n_batches = int(np.ceil(n_examples / batch_size))
+
+        # indices are sorted within a batch so that reads from memory mapped data are sequential
+        return [np.sort(indices[batch_no*batch_size:(batch_no+1)*batch_size]) for batch_no in range(n_batches)]
+
+    def get_batch(self, indices):
+        """
+        This method returns a batch of data based on example indices. Contiguous indices are read as a slice, so the
+        batch is a view of the data rather than a copy.
+
+        Parameters
+        --------
+        indices - np.ndarray of ints
+            Indices of the examples in the batch
+
+        Returns
+        --------
+        tuple - (X batch, y batch or None)
+        """
+
+        self.load_files_data()
+
+        batch_slice = indices_to_slice(indices)
+
+        if batch_slice is not None:
+            indices = batch_slice
+
+        y = self.y
+
+        return self.prepare_batch(self.augment_batch(self.X[indices], indices)), (y[indices] if y is not None else None)
+
+    def augment_batch(self, X, indices):
+        """
+        This method applies random augmentations to a batch of inputs from X as it is loaded. By default the batch is unchanged;
+        subclasses can override this, e.g. ImageDataset applies its augmentation pipeline
+
+        Parameters
+        --------
+        X - np.ndarray
+            Batch of inputs from X
+
+        indices - np.ndarray of ints or slice
+            Indices of the examples in the batch
+
+        Returns
+        --------
+        np.ndarray - the batch of inputs
+        """
+
+        return X
+
+    def prepare_batch(self, X):
+        """
+        This method prepares a batch of inputs from X before it is served to a model or Task. By default the batch is unchanged;
+        subclasses can override this to convert compactly stored data, e.g. to normalize uint8 images
+
+        Parameters
+        --------
+        X - np.ndarray
+            Batch of inputs from X
+
+        Returns
+        --------
+        np.ndarray - the batch of inputs
+        """
+
+        return X
+
+    def get_num_examples(self):
+        """
+        This method returns the number of examples that batches are drawn from
+
+        Returns
+        --------
+        int - the number of examples
+        """
+
+        return len(self)
+
     @cachedata
     def X(self):
         """
@@ -138,6 +477,240 @@ class Dataset:
 
         return None
 
+    def get_memmap_path(self, name):
+        """
+        This method returns the location of the memory mapped file for a data attribute, e.g. X. The file name is keyed by the
+        dependency hash of the data and the attributes that change the data, so a change of either creates a new file.
+
+        Parameters
+        --------
+        name - str
+            The name of the data attribute, e.g. X or y
+
+        Returns
+        --------
+        str - location of the memory mapped file, or None if the data cannot be keyed
+        """
+
+        key = self.get_storage_key(name)
+
+        if key is None or not hasattr(self, 'cache_data_path'):
+            return None
+
+        return os.path.join(self.cache_data_path, '%s_%s.bin' % (name, key))
+
+    def get_storage_key(self, name):
+        """
+        This method returns the key under which a data attribute, e.g. X, is stored outside the instance - as a memory mapped
+        file or in shared memory. The key is the hash of the dependency hash of the data and the attributes that change the data
+
+        Parameters
+        --------
+        name - str
+            The name of the data attribute, e.g. X or y
+
+        Returns
+        --------
+        str - SHA-256 key, or None if the data cannot be keyed
+        """
+
+        if getattr(self, 'data_hash', None) is None:
+            return None
+
+        key_items = [self.data_hash, self.__class__.__name__, name] + [repr(getattr(self, attr, None)) for attr in STORAGE_KEY_ATTRIBUTES]
+
+        return MantraHashed.get_256_hash_from_string(' '.join(key_items))
+
+    def load_stored_data(self, name):
+        """
+        This method loads a data attribute, e.g. X, from the storage set by self.storage, if it has been stored before
+
+        Parameters
+        --------
+        name - str
+            The name of the data attribute, e.g. X or y
+
+        Returns
+        --------
+        np.ndarray - of the data, or None if it is not stored
+        """
+
+        if self.storage == 'memmap':
+            return self.load_memmap_data(name)
+        elif self.storage == 'shared':
+            return self.load_shared_data(name)
+
+        return None
+
+    def store_data(self, name, data):
+        """
+        This method stores a data attribute, e.g. X, in the storage set by self.storage
+
+        Parameters
+        --------
+        name - str
+            The name of the data attribute, e.g. X or y
+
+        data - np.ndarray
+            The data to store
+
+        Returns
+        --------
+        np.ndarray - the stored data, or the data itself if it was not stored
+        """
+
+        if self.storage == 'memmap':
+            return self.store_memmap_data(name, data)
+        elif self.storage == 'shared':
+            return self.store_shared_data(name, data)
+
+        return data
+
+    def load_shared_data(self, name):
+        """
+        This method attaches to a data attribute, e.g. X, that a dataset with the same storage key published to shared memory,
+        in this or another process. The data is not copied
+
+        Parameters
+        --------
+        name - str
+            The name of the data attribute, e.g. X or y
+
+        Returns
+        --------
+        np.ndarray - read-only view of the data in shared memory, or None if it has not been published
+        """
+
+        key = self.get_storage_key(name)
+
+        if key is None:
+            return None
+
+        return attach_shared_array(get_shared_block_name(key, name))
+
+    def store_shared_data(self, name, data):
+        """
+        This method publishes a data attribute, e.g. X, to shared memory under its storage key. If another process published it
+        first, we attach to its copy instead. Data that cannot be keyed or shared (e.g. object arrays) is returned unchanged.
+
+        The published data stays available while this process runs, or until unpublish is called; processes that have attached
+        keep their view when it is unpublished.
+
+        Parameters
+        --------
+        name - str
+            The name of the data attribute, e.g. X or y
+
+        data - np.ndarray
+            The data to publish
+
+        Returns
+        --------
+        np.ndarray - read-only view of the data in shared memory, or the data itself if it was not shared
+        """
+
+        key = self.get_storage_key(name)
+
+        if key is None or not can_memmap(data) or is_shared_array(data):
+            return data
+
+        block_name = get_shared_block_name(key, name)
+        shared_data = publish_shared_array(block_name, data)
+
+        if shared_data is None:
+            shared_data = attach_shared_array(block_name)
+
+        return data if shared_data is None else shared_data
+
+    def publish(self, names=None):
+        """
+        This method publishes loaded data attributes to shared memory, so datasets with storage = 'shared' in other processes on
+        this machine attach to them instead of loading. The attributes of this dataset are replaced by their shared memory views,
+        and its storage becomes 'shared', so copies sent to worker processes attach too
+
+        Parameters
+        --------
+        names - list of strs (optional)
+            The data attributes to publish; by default all cachedata attributes, e.g. X and y
+
+        Returns
+        --------
+        void - publishes the data
+        """
+
+        self.storage = 'shared'
+
+        for name in (self.get_cachedata_names() if names is None else names):
+            data = getattr(self, name)
+
+            if data is not None:
+                setattr(self, '_%s' % name, self.store_shared_data(name, data))
+
+    def unpublish(self, names=None):
+        """
+        This method removes data attributes that this process published to shared memory
+
+        Parameters
+        --------
+        names - list of strs (optional)
+            The data attributes to unpublish; by default all cachedata attributes
+        """
+
+        for name in (self.get_cachedata_names() if names is None else names):
+            key = self.get_storage_key(name)
+
+            if key is not None:
+                unpublish_shared_array(get_shared_block_name(key, name))
+
+    def load_memmap_data(self, name):
+        """
+        This method loads a data attribute, e.g. X, from its memory mapped file if it has been stored before
+
+        Parameters
+        --------
+        name - str
+            The name of the data attribute, e.g. X or y
+
+        Returns
+        --------
+        np.memmap - of the data, or None if there is no stored file
+        """
+
+        memmap_path = self.get_memmap_path(name)
+
+        if memmap_path is None:
+            return None
+
+        return read_memmap(memmap_path)
+
+    def store_memmap_data(self, name, data):
+        """
+        This method writes a data attribute, e.g. X, to its memory mapped file. Stale files for the attribute are removed.
+        Data that cannot be keyed or memory mapped (e.g. object arrays) is returned unchanged.
+
+        Parameters
+        --------
+        name - str
+            The name of the data attribute, e.g. X or y
+
+        data - np.ndarray
+            The data to store
+
+        Returns
+        --------
+        np.memmap - of the stored data, or the data itself if it was not stored
+        """
+
+        memmap_path = self.get_memmap_path(name)
+
+        if memmap_path is None or not can_memmap(data) or isinstance(data, np.memmap):
+            return data
+
+        for old_path in glob.glob(os.path.join(self.cache_data_path, '%s_*.bin*' % name)):
+            os.remove(old_path)
+
+        return write_memmap(memmap_path, data)
+
     @classmethod
     def denormalize_image(cls, image, normalized=True):
         """
@@ -148,14 +721,14 @@ class Dataset:
         image - np.ndarray representing the image
 
         normalized - bool
-            True if the image was originally normalized, False otherwise
+            True if the image was originally normalized, False otherwise. A uint8 image holds pixels, so it is never denormalized
 
         Returns
         -----------
         np.ndarray - applying the denormalization
         """
 
-        if normalized:
+        if normalized and np.asarray(image).dtype != np.uint8:
             return (image+1)*127.5
         else:
             return image
@@ -187,7 +760,9 @@ class Dataset:
         if args.target_index is not None:
             self.target_index = args.target_index
 
-        if args.image_dim is not None and hasattr(self, "n_color_channels"):
+        if args.image_dim is not None and self.files_data_pending:
+            self.files_data_kwargs['image_dim'] = tuple([int(el) for el in tuple(args.image_dim)])
+        elif args.image_dim is not None and hasattr(self, "n_color_channels"):
             self.image_dim = tuple([int(el) for el in tuple(args.image_dim)])
             self.image_shape = (self.image_dim[0], self.image_dim[1], self.n_color_channels)
 
@@ -267,6 +842,15 @@ class Dataset:
             self.image_shape = kwargs.get('image_shape', (self.image_dim[0], self.image_dim[1], self.n_color_channels))
             self.normalize = kwargs.get('normalize', self.normalize)
 
+            if hasattr(self, 'decode_workers'):
+                self.decode_workers = int(kwargs.get('decode_workers', self.decode_workers))
+
+            if hasattr(self, 'image_dtype'):
+                self.image_dtype = kwargs.get('image_dtype', self.image_dtype)
+
+            if hasattr(self, 'read_from_archive'):
+                self.read_from_archive = kwargs.get('read_from_archive', self.read_from_archive)
+
     def extract_file_data(self):
         """
         This method extracts data from the files list, and checks hashes based on old extractions
@@ -279,110 +863,371 @@ class Dataset:
         self.hash_location = '%s%s' % (self.data_dir, 'raw/hash')
         self.raw_data_path = '%s%s' % (self.data_dir, 'raw')
         self.extracted_data_path = '%s%s' % (self.raw_data_path, '/.extract')
+        self.cache_data_path = '%s%s' % (self.raw_data_path, '/.cache')
 
         is_hash = os.path.isfile(self.hash_location)
-        is_extract_folder = os.path.exists(self.extracted_data_path)
-        is_data_folder = os.path.exists(self.data_dir)
 
-        if not is_extract_folder:
+        if not os.path.exists(self.extracted_data_path):
             os.mkdir(self.extracted_data_path)
 
-        file_hashes = self.get_data_dependency_hashes(is_extract_folder=is_extract_folder, is_hash=is_hash)
+        if not os.path.exists(self.cache_data_path):
+            os.mkdir(self.cache_data_path)
+
+        file_hashes = self.get_data_dependency_hashes()
+        self.remove_deleted_members(self.previous_manifest)
+        self.save_manifest()
+
         final_hash = MantraHashed.get_256_hash_from_string(''.join(file_hashes))
 
-        # If there is no hash then we store the hash
+        # the dependency hash keys derived data, such as decoded image caches
+        self.data_hash = final_hash
+
+        # If there is no hash, or the hash of dependency files has changed, we store the new hash
 
-        if not is_hash:
+        old_hash = None
+
+        if is_hash:
+            hash_file = open(self.hash_location, 'r')
+            old_hash = hash_file.read()
+            hash_file.close()
+
+        if old_hash != final_hash:
             hash_file = open(self.hash_location, 'w')
             hash_file.write(final_hash)
             hash_file.close()
 
-        # If there is no extract folder then we create one and copy the files over
+        if self.data_type == 'images':
+            self.adjust_color_channels()
 
-        if not is_extract_folder:
-            for file in self.files:
-                file_path = '%s/%s' % (self.raw_data_path, file)
-                shutil.copy(file_path, self.extracted_data_path)
+    def adjust_color_channels(self):
+        """
+        This method adjusts the number of color channels based on extracted images. We read only the headers of a sample of the
+        images, spaced evenly across the extracted data, and store the result in raw/.cache with the dependency hash, so we do not
+        probe the images again until the data dependencies change
+        """
 
-            if self.data_type == 'images':
-                self.adjust_color_channels()
+        image_probe = self.load_image_probe()
 
-            return
+        if image_probe.get('data_hash') != self.data_hash or image_probe.get('file_format') != self.file_format:
+            color_channels = [get_image_channels(image) for image in self.get_color_channel_samples()]
 
-        hash_file = open(self.hash_location, 'r')
-        old_hash = hash_file.read()
-        hash_file.close()
+            if not color_channels:
+                return
 
-        # If the hash of dependency files hasn't changed, we are good to go; else we copy the new files over
+            image_probe = {'data_hash': self.data_hash, 'file_format': self.file_format, 
+                'n_color_channels': Counter(color_channels).most_common(1)[0][0],
+                'image_dataset_hash': getattr(self, 'file_hashes', {}).get(getattr(self, 'image_dataset', None))}
 
-        if old_hash == final_hash:
-            if self.data_type == 'images':
-                self.adjust_color_channels()
-            return
-        else:
-            for file in self.files:
-                file_path = '%s/%s' % (self.raw_data_path, file)
-                shutil.copy(file_path, self.extracted_data_path)
+            self.save_image_probe(image_probe)
 
-            if self.data_type == 'images':
-                self.adjust_color_channels()
+        self.n_color_channels = image_probe['n_color_channels']
+        self.image_shape = (self.image_shape[0], self.image_shape[1], self.n_color_channels)
 
-    def adjust_color_channels(self):
+    def get_color_channel_samples(self):
         """
-        This method adjusts the number of color channels based on extracted images
+        This method returns the images whose headers we read to find the number of color channels: up to COLOR_CHANNEL_SAMPLES
+        images, spaced evenly across the sorted list of extracted images
+
+        Returns
+        --------
+        list of strs - locations of the sampled images
         """
 
-        sample_images = glob.glob(os.path.join(self.extracted_data_path, '*%s' % self.file_format))[:100]
+        sample_images = sorted(glob.glob(os.path.join(self.extracted_data_path, '*%s' % self.file_format)))
 
         # try subdirectories if not images at top level
         if not sample_images:
-            sample_images = glob.glob(os.path.join(self.extracted_data_path + '/**/', '*%s' % self.file_format), recursive=True)
+            sample_images = sorted(glob.glob(os.path.join(self.extracted_data_path + '/**/', '*%s' % self.file_format), recursive=True))
 
-        color_channels = [scipy.misc.imread(image).shape[2] for image in sample_images]
-        color_count = Counter(color_channels)
-        self.n_color_channels = color_count.most_common(1)[0][0]
-        self.image_shape = (self.image_shape[0], self.image_shape[1], self.n_color_channels)
+        return sample_evenly(sample_images, COLOR_CHANNEL_SAMPLES)
 
-    def extract_tar_file(self, file):
+    def get_image_probe_path(self):
         """
-        This method extracts a tar file to a location in a raw folder
+        This method returns the location of the image probe: the file format and number of color channels found for the images
+
+        Returns
+        --------
+        str - location of the image probe
+        """
+
+        return '%sraw/.cache/%s' % (self.data_dir, IMAGE_PROBE_FILE)
+
+    def load_image_probe(self):
+        """
+        This method loads the image probe
+
+        Returns
+        --------
+        dict - with keys data_hash, file_format, n_color_channels and image_dataset_hash; empty if there is no probe
+        """
+
+        image_probe_path = self.get_image_probe_path()
+
+        if not os.path.isfile(image_probe_path):
+            return {}
+
+        with open(image_probe_path, 'r') as image_probe_file:
+            return json.load(image_probe_file)
+
+    def save_image_probe(self, image_probe):
+        """
+        This method stores the image probe
+
+        Parameters
+        --------
+        image_probe - dict
+            The image probe, see load_image_probe
+        """
+
+        image_probe_path = self.get_image_probe_path()
+
+        with open('%s.tmp' % image_probe_path, 'w') as image_probe_file:
+            json.dump(image_probe, image_probe_file)
+
+        os.replace('%s.tmp' % image_probe_path, image_probe_path)
+
+    def get_manifest_path(self):
+        """
+        This method returns the location of the dependency manifest. The manifest records the hash of each file in Dataset.files and
+        the members each file placed in the .extract folder; we keep it in raw/.cache so it is never versioned
+
+        Returns
+        --------
+        str - location of the manifest
+        """
+
+        return os.path.join(self.cache_data_path, 'manifest.json')
+
+    def load_manifest(self):
+        """
+        This method loads the dependency manifest written by the last extraction
+
+        Returns
+        --------
+        dict - with keys 'files' (file -> hash) and 'members' (file -> {member name -> [size, mtime]}); empty if there is no manifest
+        """
+
+        manifest_path = self.get_manifest_path()
+
+        if not os.path.isfile(manifest_path):
+            return {'files': {}, 'members': {}}
+
+        with open(manifest_path, 'r') as manifest_file:
+            return json.load(manifest_file)
+
+    def save_manifest(self):
+        """
+        This method stores the dependency manifest for the current extraction
+        """
+
+        manifest_path = self.get_manifest_path()
+
+        with open('%s.tmp' % manifest_path, 'w') as manifest_file:
+            json.dump({'files': self.file_hashes, 'members': self.file_members}, manifest_file)
+
+        os.replace('%s.tmp' % manifest_path, manifest_path)
+
+    def remove_deleted_members(self, old_manifest):
+        """
+        This method removes files from the .extract folder that were placed there by the last extraction, but are no longer
+        members of any file in Dataset.files - for example images deleted from a tar file, or a file removed from Dataset.files
+
+        Parameters
+        --------
+        old_manifest - dict
+            The manifest of the last extraction, see load_manifest
+        """
+
+        current_members = set()
+
+        for members in self.file_members.values():
+            current_members.update(members)
+
+        old_members = set()
+
+        for members in old_manifest['members'].values():
+            old_members.update(members)
+
+        for name in sorted(old_members - current_members):
+            member_path = os.path.join(self.extracted_data_path, name)
+
+            if not os.path.isfile(member_path):
+                continue
+
+            os.remove(member_path)
+
+            # we also remove directories left empty, up to the .extract folder
+            member_dir = os.path.dirname(member_path)
+            while os.path.abspath(member_dir) != os.path.abspath(self.extracted_data_path) and not os.listdir(member_dir):
+                os.rmdir(member_dir)
+                member_dir = os.path.dirname(member_dir)
+
+    def extract_tar_file(self, file, members=None):
+        """
+        This method extracts a tar file to the .extract folder in a single streaming pass, hashing the tar file as it is read. Members
+        that were already extracted with the same size and modification time are skipped, so extracting an unchanged tar file writes nothing.
+
+        If the files of the tar file are all in one top level directory, we extract the contents of that directory to the .extract folder.
         
         Parameters
         --------
         file - str
             Path to the tar file to open and extract to the raw/ folder within the dataset project
+
+        members - dict (optional)
+            If given, we record each regular file of the tar file in it: extracted name -> [size, mtime]
+
+        Returns
+        --------
+        str - the SHA256 hash of the tar file
         """
 
-        tar = tarfile.open(file, mode='r')
+        extract_kwargs = {'filter': 'data'} if hasattr(tarfile, 'data_filter') else {}
 
-        # check tar contains files at the top directory
-        files_at_top = False
+        with open(file, 'rb') as tar_file:
+            reader = HashingReader(tar_file)
 
-        for member in tar.getmembers():
-            if '/' not in member.name and member.isfile():
-                files_at_top = True
-                break
+            with tarfile.open(fileobj=reader, mode='r|*') as tar:
 
-        if os.path.isdir(self.extracted_data_path):
-            shutil.rmtree(self.extracted_data_path)
+                # we assume the members are in one top level directory until we find a member that is not
+                top_level_dir = None
+                extracted_names = set()
 
-        if files_at_top:
-            tar.extractall(path=self.extracted_data_path)
-        else:
-            top_level_dir = os.path.commonprefix(tar.getnames())
-            tar.extractall(path=self.raw_data_path)
-            os.rename('%sraw/%s' % (self.data_dir, top_level_dir), '%sraw/%s' % (self.data_dir, '.extract'))
+                for member in tar:
+                    parts = [part for part in member.name.split('/') if part not in ['', '.']]
+
+                    if not parts or member.name.startswith('/') or '..' in parts:
+                        continue
+
+                    if top_level_dir is None and not extracted_names:
+                        top_level_dir = parts[0] if (len(parts) > 1 or member.isdir()) else False
+
+                    if top_level_dir and (parts[0] != top_level_dir or (len(parts) == 1 and not member.isdir())):
+                        self.restore_top_level_dir(top_level_dir, extracted_names)
+
+                        if members is not None:
+                            restored_members = {'%s/%s' % (top_level_dir, name): value for name, value in members.items()}
+                            members.clear()
+                            members.update(restored_members)
+
+                        top_level_dir = False
+
+                    if top_level_dir:
+                        parts = parts[1:]
+
+                    if not parts:
+                        continue
+
+                    member.name = '/'.join(parts)
+                    extracted_names.add(parts[0])
+                    member_path = os.path.join(self.extracted_data_path, member.name)
+
+                    if member.isfile() and members is not None:
+                        members[member.name] = [member.size, int(member.mtime)]
+
+                    if member.isfile() and os.path.isfile(member_path):
+                        member_stat = os.stat(member_path)
+                        if member_stat.st_size == member.size and int(member_stat.st_mtime) == int(member.mtime):
+                            continue
+
+                    tar.extract(member, path=self.extracted_data_path, **extract_kwargs)
+
+            return reader.hexdigest()
+
+    def restore_top_level_dir(self, top_level_dir, extracted_names):
+        """
+        This method moves members extracted without their top level directory back into that directory. We use this when we find a tar file
+        does not keep all of its files in one top level directory
+
+        Parameters
+        --------
+        top_level_dir - str
+            Name of the top level directory
+
+        extracted_names - set of strs
+            Names of the top level entries extracted so far
+        """
+
+        top_level_path = os.path.join(self.extracted_data_path, top_level_dir)
+        temp_path = os.path.join(self.extracted_data_path, '.%s.mantratemp' % top_level_dir)
+
+        os.mkdir(temp_path)
+
+        for name in extracted_names:
+            if os.path.lexists(os.path.join(self.extracted_data_path, name)):
+                os.rename(os.path.join(self.extracted_data_path, name), os.path.join(temp_path, name))
+
+        if os.path.lexists(top_level_path):
+            if os.path.isdir(top_level_path) and not os.path.islink(top_level_path):
+                shutil.rmtree(top_level_path)
+            else:
+                os.remove(top_level_path)
+
+        os.rename(temp_path, top_level_path)
+
+        extracted_names.clear()
+        extracted_names.add(top_level_dir)
+
+    def link_data_file(self, file):
+        """
+        This method makes a data file that is not a tar file available in the .extract folder. We hard link the file rather than
+        copying it; if the filesystem does not support that, we copy it
+
+        Parameters
+        --------
+        file - str
+            Path to the file
+        """
+
+        link_path = os.path.join(self.extracted_data_path, os.path.basename(file))
+
+        if os.path.isfile(link_path):
+            if os.path.samefile(file, link_path):
+                return
+            os.remove(link_path)
+
+        try:
+            os.link(file, link_path)
+        except OSError:
+            shutil.copy2(file, link_path)
 
     def find_image_file_format(self):
         """
         This method finds the image file format from the data referenced in Dataset class. We take a sample
         of files in a tar.gz directory and record the most popular file type. The resulting file format is 
         stored in self.file_format - .jpg - and the number of color channels - to self.n_color_channels.
+
+        If the tar file is unchanged since we last probed its images, we use the stored image probe rather than opening the tar file.
+        Otherwise we stream the first TAR_FILES_TO_CHECK files of the tar file, rather than reading all of its members.
         """
 
-        tar = tarfile.open('%s%s/%s' % (self.data_dir, 'raw', self.image_dataset), mode='r')
-        sample_files = [mem for mem in tar.getmembers() if mem.isfile()]
-        sample_file_extensions = [mem.path.split('.')[-1] for mem in sample_files[:TAR_FILES_TO_CHECK] if '.' in mem.path]
+        tar_path = '%s%s/%s' % (self.data_dir, 'raw', self.image_dataset)
+
+        hash_manifest = MantraHashed.load_hash_manifest('%sraw/.cache/%s' % (self.data_dir, HASH_MANIFEST_FILE))
+        tar_hash = MantraHashed.get_manifest_hash(tar_path, hash_manifest) if os.path.isfile(tar_path) else None
+        image_probe = self.load_image_probe()
+
+        if tar_hash is not None and image_probe.get('image_dataset_hash') == tar_hash:
+            self.file_format = image_probe['file_format']
+            self.n_color_channels = image_probe['n_color_channels']
+            return
+
+        sample_file_extensions = []
+        n_files = 0
+
+        with tarfile.open(tar_path, mode='r|*') as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+
+                if '.' in member.path:
+                    sample_file_extensions.append(member.path.split('.')[-1])
+
+                n_files += 1
+
+                if n_files == TAR_FILES_TO_CHECK:
+                    break
+
         extension_count = Counter(sample_file_extensions)
         self.file_format = '.%s' % extension_count.most_common(1)[0][0]
 
@@ -391,18 +1236,14 @@ class Dataset:
         elif self.file_format == '.png':
             self.n_color_channels = 4
 
-    def get_data_dependency_hashes(self, is_extract_folder, is_hash):
+    def get_data_dependency_hashes(self):
         """
-        This method obtains a list of hashes of the file dependencies (Dataset.files) specified in the dataset.
-
-        Parameters
-        --------
-
-        is_extract_folder - bool
-            Whether an .extract folder currently exists within the data project folder
+        This method obtains a list of hashes of the file dependencies (Dataset.files) specified in the dataset. Each file is
+        read at most once: tar files are hashed as they are extracted, and other files are hashed and then linked into the .extract folder.
+        The members each file places in the .extract folder are recorded in self.file_members.
 
-        is_hash - bool
-            Whether a concatenated hash file exists for the raw data dependencies
+        A file whose size, modification time and inode are unchanged since it was last hashed is not read again - we take its hash from
+        the hash manifest in raw/.cache - unless self.verify_hashes is True. An unchanged tar file that is still extracted is not read at all.
 
         Returns
         --------
@@ -410,6 +1251,12 @@ class Dataset:
         """
 
         file_hashes = []
+        self.file_hashes = {}
+        self.file_members = {}
+        self.previous_manifest = self.load_manifest()
+
+        hash_manifest_location = os.path.join(self.cache_data_path, HASH_MANIFEST_FILE)
+        hash_manifest = MantraHashed.load_hash_manifest(hash_manifest_location)
 
         for file in sorted(self.files):
 
@@ -418,17 +1265,72 @@ class Dataset:
             if not os.path.isfile(file_path):
                 raise IOError('The following file does no exist:  %s' % file)
 
-            tar_hash = MantraHashed.get_256_hash_from_file(file_path)
-            file_hashes.append(tar_hash)
+            file_hash = None if self.verify_hashes else MantraHashed.get_manifest_hash(file_path, hash_manifest)
+            previous_members = self.previous_manifest['members'].get(file)
+
+            if self.is_read_from_archive(file):
+                file_hash = file_hash or MantraHashed.get_256_hash_from_file(file_path)
+            elif self.extract_file_dict[file] and file_hash is not None and self.is_extracted(previous_members):
+                self.file_members[file] = previous_members
+            elif self.extract_file_dict[file]:
+                self.file_members[file] = {}
+                file_hash = self.extract_tar_file(file_path, members=self.file_members[file])
+            else:
+                file_hash = file_hash or MantraHashed.get_256_hash_from_file(file_path)
+                self.link_data_file(file_path)
+                file_stat = os.stat(file_path)
+                self.file_members[file] = {os.path.basename(file_path): [file_stat.st_size, int(file_stat.st_mtime)]}
+
+            MantraHashed.record_manifest_hash(file_path, hash_manifest, file_hash)
 
-            if not is_extract_folder or not is_hash:
-                if self.extract_file_dict[file]:
-                    self.extract_tar_file(file_path)
-                else:
-                    shutil.copy(file_path, self.extracted_data_path)
+            self.file_hashes[file] = file_hash
+            file_hashes.append(file_hash)
+
+        MantraHashed.save_hash_manifest(hash_manifest_location, hash_manifest)
 
         return file_hashes
 
+    def is_extracted(self, members):
+        """
+        This method checks whether the members of a tar file, as recorded by the last extraction, are all in the .extract folder
+
+        Parameters
+        --------
+        members - dict or None
+            Extracted name -> [size, mtime] for each member, see extract_tar_file
+
+        Returns
+        --------
+        bool - True if every member is in the .extract folder with its recorded size
+        """
+
+        if members is None:
+            return False
+
+        for name, (size, mtime) in members.items():
+            member_path = os.path.join(self.extracted_data_path, name)
+
+            if not os.path.isfile(member_path) or os.path.getsize(member_path) != size:
+                return False
+
+        return True
+
+    def is_read_from_archive(self, file):
+        """
+        This method checks whether a tar file dependency is read directly rather than extracted; see ImageDataset.read_from_archive
+
+        Parameters
+        --------
+        file - str
+            The file in Dataset.files
+
+        Returns
+        --------
+        bool - True if the file is not extracted
+        """
+
+        return False
+
     def plot_image_sample(self, sample, n):
         """
         Plots an image sample
@@ -484,10 +1386,10 @@ class Dataset:
         elif self.data_type == 'tabular':
             df = pd.DataFrame(x_sample)
 
-            if hasattr(self, 'features'):
+            if getattr(self, 'features', None):
                 df.columns = self.features
-            if hasattr(self, 'feature_indices'):
-                df.columns = self.df.columns[self.features_index]
+            elif getattr(self, 'feature_indices', None):
+                df.columns = self.df.columns[self.get_column_positions(self.feature_indices)]
 
             return df
 
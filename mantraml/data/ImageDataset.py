@@ -1,11 +1,113 @@
+import copy
+import functools
 import glob
+import io
+import json
 import matplotlib.pyplot as plt
 import numpy as np
 import os
 import pandas as pd
-import scipy.misc
 
-from .Dataset import Dataset, cachedata
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+
+from mantraml.core.hashing.MantraHashed import MantraHashed
+
+from .archive import ArchiveMember, decompress_tar, discard_archive_map, is_uncompressed_tar, load_tar_index, read_archive_member
+from .Dataset import COLOR_CHANNEL_SAMPLES, Dataset, cachedata
+from .transforms import center_crop_images, normalize_images, resize_images
+from .utils import get_shard_bounds, sample_evenly
+
+IMAGE_DTYPES = ['float64', 'float32', 'float16', 'uint8']
+
+
+def decode_image(dataset_class, path, resize_height, resize_width, normalize):
+    """
+    Decodes and transforms a single image. This lives at module level so it can be pickled and sent to
+    the worker processes of the decode pool.
+
+    Parameters
+    ----------
+    dataset_class - ImageDataset type class
+        The class whose get_image method is used to decode the image
+
+    path - str
+        Location of the image
+
+    resize_height - int
+        Height of the image in pixels
+
+    resize_width - int
+        Width of the image in pixels
+
+    normalize - bool
+        If true, centers the image values around 0 (for learning)
+
+    Returns
+    ----------
+    tuple - (np.ndarray of the image or None, str error message or None)
+    """
+
+    try:
+        return dataset_class.get_image(path, resize_height=resize_height, resize_width=resize_width, crop=True, normalize=normalize), None
+    except Exception as e:
+        return None, 'Image could not be decoded (%s) : %s' % (e, path)
+
+
+def decode_image_chunk(dataset_class, paths, resize_height, resize_width, normalize, dtype):
+    """
+    Decodes and transforms a chunk of images. If the dataset class uses the default get_image and transform methods, we read the
+    pixels of each image and transform images of the same size together with transform_batch; otherwise we decode the images one
+    at a time with get_image. This lives at module level so it can be pickled and sent to the worker processes of the decode pool.
+
+    Parameters
+    ----------
+    dataset_class - ImageDataset type class
+        The class whose methods are used to decode the images
+
+    paths - list of strs or ArchiveMembers
+        Locations of the images
+
+    resize_height - int
+        Height of the images in pixels
+
+    resize_width - int
+        Width of the images in pixels
+
+    normalize - bool
+        If true, centers the image values around 0 (for learning)
+
+    dtype - np.dtype
+        The dtype of the transformed images
+
+    Returns
+    ----------
+    list of tuples - (np.ndarray of the image or None, str error message or None) in the order of paths
+    """
+
+    if not dataset_class.is_transformed_in_batches():
+        return [decode_image(dataset_class, path, resize_height, resize_width, normalize) for path in paths]
+
+    results = [None] * len(paths)
+    images_by_shape = {}
+
+    for path_no, path in enumerate(paths):
+        try:
+            image = dataset_class.imread(path, dtype=None)
+        except Exception as e:
+            results[path_no] = (None, 'Image could not be decoded (%s) : %s' % (e, path))
+            continue
+
+        images_by_shape.setdefault(image.shape, []).append((path_no, image))
+
+    for shape, images in images_by_shape.items():
+        batch = dataset_class.transform_batch(np.stack([image for path_no, image in images]), resize_height, resize_width, 
+            crop=True, normalize=normalize, dtype=dtype)
+
+        for (path_no, image), transformed_image in zip(images, batch):
+            results[path_no] = (transformed_image, None)
+
+    return results
 
 
 class ImageDataset(Dataset):
@@ -17,56 +119,911 @@ class ImageDataset(Dataset):
     has_labels = False
     normalize = True
 
+    # decoding options for X - with more than one worker we decode in a process pool
+    decode_workers = 1
+    decode_chunk_size = 64
+
+    # dtype of the X array - with uint8, X stores the pixels, and if normalize is True we normalize each batch to float32 as it is served
+    image_dtype = 'float64'
+
+    # whether to cache the decoded X array in raw/.cache
+    cache_images = True
+
+    # whether lazily decoded batches write the decoded images to the cache as they go (see get_batch); pickled copies, e.g. in
+    # prefetch worker processes, only decode their batches, so several processes do not write the same file
+    keeps_lazy_images = True
+
+    # whether to decode images straight from the tar file rather than extracting it; a compressed tar file is decompressed once to raw/.cache
+    read_from_archive = False
+
+    # an AugmentationPipeline applied to each batch as it is loaded (see mantraml.data.augmentation), e.g. in the prefetch workers
+    augmentation = None
+
+    def __init__(self, **kwargs):
+
+        super().__init__(**kwargs)
+
+        self.augmentation = kwargs.get('augmentation', self.augmentation)
+
+    def __getstate__(self):
+        """
+        Lazily decoded images are not pickled (e.g. for prefetch worker processes); the copy decodes the images of its own batches,
+        without writing them to the cache
+        """
+
+        state = super().__getstate__()
+
+        for key in ['_lazy_images', '_lazy_decoded', '_lazy_errors']:
+            state.pop(key, None)
+
+        state['keeps_lazy_images'] = False
+
+        return state
+
     @cachedata
     def X(self):
         """
         This method extracts inputs from the data. The output should be an np.ndarray that can be processed 
         by the model.
 
+        If the dataset has a dependency hash and self.cache_images is True, the decoded array is cached in the raw/.cache
+        folder, and later calls load it as a memory map rather than decoding the images again. When the dependencies change,
+        we copy the rows of unchanged images from the previous cache and only decode new or changed images.
+
         Returns
         --------
         np.ndarray - of data inputs (X vector)
         """
 
-        images = glob.glob(os.path.join(self.extracted_data_path, '*%s' % self.file_format))
+        cache_key = self.get_image_cache_key()
+
+        if cache_key is not None:
+            cached_data = self.load_image_cache(cache_key)
+            if cached_data is not None:
+                return cached_data
+
+        images = self.image_files
+        shape = (len(images),) + tuple(self.image_shape)
+
+        # images with the same file name and signature as in the previous cache are copied rather than decoded
+        previous_data, previous_rows, previous_errors = None, {}, {}
+        image_signatures = self.get_image_signatures(images) if cache_key is not None else [None] * len(images)
+
+        if cache_key is not None:
+            previous_data, previous_rows, previous_errors = self.load_previous_image_cache(cache_key, images, image_signatures)
+
+        # we write each image straight into its slot, so peak memory is the size of the final array
+        if cache_key is not None:
+            cache_path = self.get_image_cache_path(cache_key)
+            training_data = np.lib.format.open_memmap('%s.tmp' % cache_path, mode='w+', dtype=self.get_image_dtype(), shape=shape)
+        else:
+            training_data = np.empty(shape, dtype=self.get_image_dtype(), order='C')
+
+        n_processed = 0
 
-        training_data = []
         self.unprocessed_images = []
         self.image_file_names = []
+        self.image_signatures = {}
+
+        images_to_decode = [image for image in images if self.get_image_file_name(image) not in previous_rows 
+            and self.get_image_file_name(image) not in previous_errors]
+        decoded_images = self.decode_images(images_to_decode)
 
-        for image_name in images:
-            image_data = self.get_image(image_name, resize_height=self.image_shape[0], 
-                resize_width=self.image_shape[1], crop=True, normalize=self.normalize)
-            if image_data.shape == self.image_shape:
-                training_data.append(image_data)
-                self.image_file_names.append(image_name.split(self.extracted_data_path +'/')[-1])
+        for image_name, image_signature in zip(images, image_signatures):
+            file_name = self.get_image_file_name(image_name)
+            self.image_signatures[file_name] = image_signature
+
+            if file_name in previous_rows:
+                training_data[n_processed] = previous_data[previous_rows[file_name]]
+                n_processed += 1
+                self.image_file_names.append(file_name)
+                continue
+            elif file_name in previous_errors:
+                self.unprocessed_images.append((image_name, previous_errors[file_name]))
+                continue
+
+            image_data, error = next(decoded_images)
+
+            if error is not None:
+                self.unprocessed_images.append((image_name, error))
+            elif image_data.shape == self.image_shape:
+                training_data[n_processed] = image_data
+                n_processed += 1
+                self.image_file_names.append(file_name)
             else:
                 self.unprocessed_images.append((image_name, 'Image shape of extracted image differed from self.image_shape : %s' % image_name))
 
-        return np.array(training_data)
+        self.n_decoded_images = len(images_to_decode)
+        del previous_data
+
+        if cache_key is None:
+            return training_data[:n_processed]
+
+        return self.save_image_cache(cache_key, training_data, n_processed)
+
+    @property
+    def image_files(self):
+        """
+        This property lists the locations of the images in the extracted data folder, in a deterministic order. If we read
+        images from the archive, these are the archive members at the top level of the archive. If the dataset is a shard,
+        these are the images of the shard, so we only decode those
+
+        Returns
+        --------
+        list of strs or ArchiveMembers - locations of the images
+        """
+
+        if self.read_from_archive:
+            images = [ArchiveMember(self.archive_path, name, offset, size) for name, offset, size, mtime in self.archive_index 
+                if name.endswith(self.file_format) and '/' not in name.strip('/').split('/', 1)[-1]]
+        else:
+            images = sorted(glob.glob(os.path.join(self.extracted_data_path, '*%s' % self.file_format)))
+
+        if self.shard_spec is not None:
+            start, stop = get_shard_bounds(len(images), *self.shard_spec)
+            images = images[start:stop]
+
+        return images
+
+    def get_image_file_name(self, image):
+        """
+        This method returns the file name of an image, relative to the extracted data folder or the archive
+
+        Parameters
+        --------
+        image - str or ArchiveMember
+            Location of the image
+
+        Returns
+        --------
+        str - the file name
+        """
+
+        if isinstance(image, ArchiveMember):
+            return image.name
+
+        return image.split(self.extracted_data_path +'/')[-1]
+
+    def is_read_from_archive(self, file):
+        """
+        This method checks whether a tar file dependency is read directly rather than extracted
+
+        Parameters
+        --------
+        file - str
+            The file in Dataset.files
+
+        Returns
+        --------
+        bool - True if the file is the image archive and self.read_from_archive is True
+        """
+
+        return bool(self.read_from_archive) and file == self.image_dataset
+
+    def get_data_dependency_hashes(self):
+        """
+        This method obtains a list of hashes of the file dependencies (Dataset.files) specified in the dataset. If we read images from
+        the archive, we also load the member index of the archive
+
+        Returns
+        --------
+        list of strs - containing the hashes of the files in Dataset.files
+        """
+
+        file_hashes = super().get_data_dependency_hashes()
+
+        if self.read_from_archive:
+            self.load_archive_index()
+
+        return file_hashes
+
+    def load_archive_index(self):
+        """
+        This method prepares the image archive for reading: a compressed archive is decompressed once to a seekable tar file in raw/.cache,
+        and the member index (name, data offset, size, mtime) of the tar file is built once and stored next to it. Both are keyed by the hash of
+        the archive.
+
+        Returns
+        --------
+        void - sets self.archive_path and self.archive_index
+        """
+
+        archive_file_path = '%s/%s' % (self.raw_data_path, self.image_dataset)
+        archive_hash = self.file_hashes[self.image_dataset]
+
+        if not is_uncompressed_tar(archive_file_path):
+            self.archive_path = os.path.join(self.cache_data_path, 'archive_%s.tar' % archive_hash)
+        else:
+            self.archive_path = archive_file_path
+
+        # decompressed copies of older versions of the archive are removed, as is the copy of an archive that is now uncompressed
+        for old_archive in glob.glob(os.path.join(self.cache_data_path, 'archive_*.tar')):
+            if old_archive != self.archive_path:
+                discard_archive_map(old_archive)
+                os.remove(old_archive)
+
+        if self.archive_path != archive_file_path and not os.path.isfile(self.archive_path):
+            decompress_tar(archive_file_path, self.archive_path)
+
+        index_path = os.path.join(self.cache_data_path, 'archive_%s.index.json' % archive_hash)
+
+        for old_index in glob.glob(os.path.join(self.cache_data_path, 'archive_*.index.json')):
+            if old_index != index_path:
+                os.remove(old_index)
+
+        self.archive_index = load_tar_index(self.archive_path, index_path)
+
+    def get_color_channel_samples(self):
+        """
+        This method returns the images whose headers we read to find the number of color channels. If we read images from the
+        archive, these are file objects containing a sample of the archive members
+
+        Returns
+        --------
+        list of strs or file objects - the sampled images
+        """
+
+        if not self.read_from_archive:
+            return super().get_color_channel_samples()
+
+        return [io.BytesIO(read_archive_member(image)) for image in sample_evenly(self.image_files, COLOR_CHANNEL_SAMPLES)]
+
+    def get_batch(self, indices):
+        """
+        This method returns a batch of data based on example indices. If X has not been loaded, and there is no decoded image cache,
+        we decode only the images in the batch - so training can start without decoding the whole dataset. Images that cannot be
+        decoded are left out of the batch and recorded in self.unprocessed_images.
+
+        If the images are cached, each decoded image is written straight into a temporary memory map of the decoded image cache, so
+        later epochs reuse it rather than decoding it again; once every image has been decoded, the cache is finalised (see
+        finish_lazy_decoding), and batches of the next epoch are read from X. Otherwise we only hold the batch in memory.
+
+        Parameters
+        --------
+        indices - np.ndarray of ints
+            Indices of the examples in the batch; for lazily decoded batches these index self.image_files
+
+        Returns
+        --------
+        tuple - (X batch, y batch or None)
+        """
+
+        self.load_files_data()
+
+        if not self.is_decoded_lazily():
+            return super().get_batch(indices)
+
+        image_files = self.get_image_files_list()
+        cache_key = self.get_image_cache_key() if self.keeps_lazy_images else None
+        lock = cachedata.get_lock(self, 'X')
+
+        with lock:
+            if not hasattr(self, 'unprocessed_images'):
+                self.unprocessed_images = []
+
+            if cache_key is not None and getattr(self, '_lazy_images', None) is None:
+                self._lazy_images = np.lib.format.open_memmap(self.get_lazy_cache_path(cache_key), mode='w+', 
+                    dtype=self.get_image_dtype(), shape=(len(image_files),) + tuple(self.image_shape))
+                self._lazy_decoded = np.zeros(len(image_files), dtype=bool)
+                self._lazy_errors = {}
+                self.unprocessed_images = []
+
+            lazy_images = getattr(self, '_lazy_images', None)
+            lazy_decoded = getattr(self, '_lazy_decoded', None)
+            lazy_errors = getattr(self, '_lazy_errors', None)
+
+            if lazy_decoded is not None:
+                indices_to_decode = [index for index in indices if not lazy_decoded[index]]
+            else:
+                indices_to_decode = list(indices)
+
+        # we decode outside the lock, so prefetch threads decode their batches in parallel
+        decoded_images = decode_image_chunk(self.__class__, [image_files[index] for index in indices_to_decode], 
+            resize_height=self.image_shape[0], resize_width=self.image_shape[1], normalize=self.is_stored_normalized(), 
+            dtype=self.get_image_dtype())
+
+        # without a cache, the batch is the only place the decoded images are held
+        batch = np.empty((len(indices_to_decode),) + tuple(self.image_shape), dtype=self.get_image_dtype()) if lazy_images is None else None
+        errors = lazy_errors if lazy_errors is not None else {}
+
+        with lock:
+            for position, (index, (image_data, error)) in enumerate(zip(indices_to_decode, decoded_images)):
+                if lazy_decoded is not None and lazy_decoded[index]:
+                    continue
+
+                if error is None and image_data.shape != self.image_shape:
+                    error = 'Image shape of extracted image differed from self.image_shape : %s' % image_files[index]
+
+                if error is not None:
+                    errors[index] = error
+
+                    # without a cache, images are decoded again each epoch, so we record each error once
+                    if (image_files[index], error) not in self.unprocessed_images:
+                        self.unprocessed_images.append((image_files[index], error))
+                elif lazy_images is not None:
+                    lazy_images[index] = image_data
+                else:
+                    batch[position] = image_data
+
+                if lazy_decoded is not None:
+                    lazy_decoded[index] = True
+
+            decoded_indices = [index for index in indices if index not in errors]
+
+            if lazy_images is not None:
+                batch = lazy_images[decoded_indices]
+
+                if lazy_decoded.all() and not getattr(self, 'lazy_images_cached', False):
+                    self.finish_lazy_decoding(cache_key)
+            else:
+                batch = batch[[position for position, index in enumerate(indices_to_decode) if index not in errors]]
+
+        X = self.augment_batch(batch, np.array(decoded_indices, dtype=int))
+
+        return self.prepare_batch(X), None
+
+    def get_lazy_cache_path(self, cache_key):
+        """
+        This method returns the location of the temporary memory map that lazily decoded images are written to, one row per image
+        file. It is separate from the temporary file of X, so loading X meanwhile does not overwrite it
+
+        Parameters
+        ----------
+        cache_key - str
+            The key of the decoded image cache
+
+        Returns
+        ----------
+        str - location of the temporary memory map
+        """
+
+        return '%s.lazy.tmp' % self.get_image_cache_path(cache_key)
+
+    def finish_lazy_decoding(self, cache_key):
+        """
+        This method is called once lazily decoded batches have decoded every image: it finalises the decoded image cache from the
+        temporary memory map of the decoded images, and the next call to batches reads from X. The current epoch keeps the lazy
+        batches, as its batch indices index self.image_files. If some images could not be decoded, the decoded rows are copied to
+        the cache in chunks, so we never hold the whole dataset in memory
+
+        Parameters
+        ----------
+        cache_key - str
+            The key of the decoded image cache
+
+        Returns
+        --------
+        void - writes the decoded image cache
+        """
+
+        image_files = self.get_image_files_list()
+        decoded_indices = [index for index in range(len(image_files)) if index not in self._lazy_errors]
+        lazy_cache_path = self.get_lazy_cache_path(cache_key)
+
+        self.image_file_names = [self.get_image_file_name(image_files[index]) for index in decoded_indices]
+        self.image_signatures = dict(zip([self.get_image_file_name(image) for image in image_files], self.get_image_signatures(image_files)))
+        self.n_decoded_images = len(image_files)
+
+        if len(decoded_indices) == len(image_files):
+            self._lazy_images.flush()
+            self.save_image_cache(cache_key, self._lazy_images, len(decoded_indices), temporary_path=lazy_cache_path)
+        else:
+            cache_path = self.get_image_cache_path(cache_key)
+            training_data = np.lib.format.open_memmap('%s.tmp' % cache_path, mode='w+', dtype=self.get_image_dtype(), 
+                shape=(len(decoded_indices),) + tuple(self.image_shape))
+
+            for start in range(0, len(decoded_indices), self.decode_chunk_size):
+                chunk_indices = decoded_indices[start:start + self.decode_chunk_size]
+                training_data[start:start + len(chunk_indices)] = self._lazy_images[chunk_indices]
+
+            self.save_image_cache(cache_key, training_data, len(decoded_indices))
+
+            # the epoch reads on from our map of the file, which stays valid after the file is removed
+            os.remove(lazy_cache_path)
+
+        self.lazy_images_cached = True
+
+    def batches(self, batch_size, *args, **kwargs):
+        """
+        This method iterates over the data in minibatches (see Dataset.batches). Each call starts a new epoch of the augmentation
+        pipeline, so a seeded pipeline augments the batches of each epoch differently
+
+        Parameters
+        --------
+        batch_size - int
+            The number of examples in each batch
+
+        Returns
+        --------
+        generator of tuples - (X batch, y batch or None)
+        """
+
+        if self.augmentation is not None:
+            self.augmentation.epoch += 1
+
+        # once the lazily decoded images are in the decoded image cache, we read the new epoch from X
+        if getattr(self, 'lazy_images_cached', False):
+            self._lazy_images, self._lazy_decoded, self._lazy_errors = None, None, None
+            self.lazy_images_cached = False
+
+        return super().batches(batch_size, *args, **kwargs)
+
+    def augment_batch(self, X, indices):
+        """
+        This method applies the augmentation pipeline to a batch of images, before they are normalized (see prepare_batch), so
+        uint8 images are augmented as pixels. We augment in place, copying the batch first if it is a view of X
+
+        Parameters
+        --------
+        X - np.ndarray
+            Batch of images
+
+        indices - np.ndarray of ints or slice
+            Indices of the examples in the batch
+
+        Returns
+        --------
+        np.ndarray - the augmented images
+        """
+
+        if self.augmentation is None or not len(X):
+            return X
+
+        stored_X = getattr(self, '_X', None)
+
+        if not X.flags.writeable or (stored_X is not None and np.may_share_memory(X, stored_X)):
+            X = X.copy()
+
+        value_range = (-1, 1) if self.is_stored_normalized() else (0, 255)
+
+        return self.augmentation(X, indices, value_range=value_range)
+
+    def get_num_examples(self):
+        """
+        This method returns the number of examples that batches are drawn from
+
+        Returns
+        --------
+        int - the number of examples
+        """
+
+        self.load_files_data()
+
+        if not self.is_decoded_lazily():
+            return len(self)
+
+        return len(self.get_image_files_list())
+
+    def get_image_files_list(self):
+        """
+        This method returns the image file list used for lazily decoded batches; we list the folder once
+
+        Returns
+        --------
+        list of strs - locations of the images
+        """
+
+        if getattr(self, '_image_files_list', None) is None:
+            self._image_files_list = self.image_files
+
+        return self._image_files_list
+
+    def shard(self, num_shards, index):
+        """
+        This method returns a shard of the dataset (see Dataset.shard); the shard lists only its own images, so it decodes only those,
+        and has its own copy of the augmentation pipeline, so advancing its epoch does not change the augmentations of the dataset
+
+        Parameters
+        --------
+        num_shards - int
+            The number of shards, e.g. the number of workers
+
+        index - int
+            The index of the shard, from 0 to num_shards - 1
+
+        Returns
+        --------
+        ImageDataset - the shard
+        """
+
+        dataset_shard = super().shard(num_shards, index)
+        dataset_shard._image_files_list = None
+        dataset_shard._lazy_images, dataset_shard._lazy_decoded, dataset_shard._lazy_errors = None, None, None
+        dataset_shard.lazy_images_cached = False
+
+        if self.augmentation is not None:
+            dataset_shard.augmentation = copy.deepcopy(self.augmentation)
+
+        return dataset_shard
+
+    def get_natively_sharded_names(self):
+        """
+        This method returns the names of the cachedata properties that load only the data of the shard themselves. The default
+        X decodes only the images of the shard (see image_files); X methods of subclasses are sliced after they are loaded
+
+        Returns
+        --------
+        list of strs - the names of the properties
+        """
+
+        if type(self).X is ImageDataset.X:
+            return ['X']
+
+        return []
+
+    def is_decoded_lazily(self):
+        """
+        This method checks whether batches are decoded from the image files, rather than read from X
+
+        Returns
+        --------
+        bool - True if the dataset has no labels, X is not loaded and there is no decoded image cache, or lazily decoded images
+            are being served
+        """
+
+        # a subclass with its own X method defines its own inputs, so we always read from X
+        if type(self).X is not ImageDataset.X or getattr(self, '_X', None) is not None:
+            return False
+
+        # labels are aligned with the decoded images (the rows of X), so the labels of a lazily decoded batch are not known until
+        # every image before it has been decoded; labelled datasets read their batches from X
+        if self.has_labels:
+            return False
+
+        # an epoch that started decoding lazily carries on, even once the decoded image cache is written
+        if getattr(self, '_lazy_images', None) is not None:
+            return True
+
+        cache_key = self.get_image_cache_key()
+
+        if cache_key is not None and os.path.isfile('%s.npy' % self.get_image_cache_path(cache_key)):
+            return False
+
+        return True
+
+    def get_image_cache_key(self):
+        """
+        This method returns the key of the decoded image cache. The key changes if the data dependencies change, or if
+        the image shape, normalization or dtype change.
+
+        Returns
+        ----------
+        str - SHA-256 key of the cache, or None if the images should not be cached
+        """
+
+        if not self.cache_images or getattr(self, 'data_hash', None) is None or not hasattr(self, 'cache_data_path'):
+            return None
+
+        key_string = '%s %s' % (self.data_hash, self.get_image_cache_config())
+
+        return MantraHashed.get_256_hash_from_string(key_string)
+
+    def get_image_cache_config(self):
+        """
+        This method returns the decoding options of the image cache. Rows of a previous cache can only be reused if it was
+        decoded with the same options
+
+        Returns
+        ----------
+        str - the image shape, normalization and dtype
+        """
+
+        return '%s %s %s' % (tuple(self.image_shape), self.is_stored_normalized(), self.get_image_dtype().name)
+
+    def get_image_signatures(self, images):
+        """
+        This method returns a signature for each image - its size and modification time - which tells us whether an image
+        changed between two versions of the data dependencies
+
+        Parameters
+        ----------
+        images - list of strs or ArchiveMembers
+            Locations of the images
+
+        Returns
+        ----------
+        list of lists - [size, mtime] of each image
+        """
+
+        if self.read_from_archive:
+            member_signatures = {name: [size, mtime] for name, offset, size, mtime in self.archive_index}
+            return [member_signatures[image.name] for image in images]
+
+        signatures = []
+
+        for image in images:
+            image_stat = os.stat(image)
+            signatures.append([image_stat.st_size, int(image_stat.st_mtime)])
+
+        return signatures
+
+    def load_previous_image_cache(self, cache_key, images, image_signatures):
+        """
+        This method finds a decoded image cache with other data dependencies but the same decoding options, and matches its
+        rows to the current images. An image matches if its file name and signature are unchanged.
+
+        Parameters
+        ----------
+        cache_key - str
+            The key of the current cache
+
+        images - list of strs or ArchiveMembers
+            Locations of the current images
+
+        image_signatures - list of lists
+            Signatures of the current images, see get_image_signatures
+
+        Returns
+        ----------
+        tuple - (np.memmap of the previous cache or None, dict of file name -> row, dict of file name -> error for images that
+            could not be decoded)
+        """
+
+        cache_path = self.get_image_cache_path(cache_key)
+        cache_config = self.get_image_cache_config()
+
+        for info_path in glob.glob(os.path.join(self.cache_data_path, '%s*.json' % self.get_image_cache_prefix())):
+            previous_path = info_path[:-len('.json')]
+
+            if previous_path == cache_path or not os.path.isfile('%s.npy' % previous_path):
+                continue
+
+            with open(info_path, 'r') as cache_file:
+                cache_info = json.load(cache_file)
+
+            if cache_info.get('config') != cache_config:
+                continue
+
+            previous_signatures = cache_info['image_signatures']
+            current_signatures = {self.get_image_file_name(image): signature for image, signature in zip(images, image_signatures)}
+
+            def is_unchanged(file_name):
+                return file_name in current_signatures and previous_signatures.get(file_name) == current_signatures[file_name]
+
+            previous_rows = {file_name: row for row, file_name in enumerate(cache_info['image_file_names']) if is_unchanged(file_name)}
+            previous_errors = {file_name: error for file_name, (image, error) in zip(cache_info['unprocessed_file_names'], 
+                cache_info['unprocessed_images']) if is_unchanged(file_name)}
+
+            return np.load('%s.npy' % previous_path, mmap_mode='r'), previous_rows, previous_errors
+
+        return None, {}, {}
+
+    def get_image_cache_path(self, cache_key):
+        """
+        This method returns the location of the decoded image cache for a cache key (without the file extension)
+
+        Parameters
+        ----------
+        cache_key - str
+            The key of the cache
+
+        Returns
+        ----------
+        str - location of the cache
+        """
+
+        return os.path.join(self.cache_data_path, '%s%s' % (self.get_image_cache_prefix(), cache_key))
+
+    def get_image_cache_prefix(self):
+        """
+        This method returns the prefix of the decoded image cache files. Each shard of the dataset has its own prefix, so the
+        shards, and the full dataset, keep separate caches and do not remove each other's
+
+        Returns
+        ----------
+        str - the prefix
+        """
+
+        if self.shard_spec is None:
+            return 'images_'
+
+        return 'shard-%s-of-%s_images_' % (self.shard_spec[1], self.shard_spec[0])
+
+    def load_image_cache(self, cache_key):
+        """
+        This method loads the decoded image cache as a read-only memory map, if a cache exists for the key
+
+        Parameters
+        ----------
+        cache_key - str
+            The key of the cache
+
+        Returns
+        ----------
+        np.memmap - of data inputs (X vector), or None if there is no cache for the key
+        """
+
+        cache_path = self.get_image_cache_path(cache_key)
+
+        if not os.path.isfile('%s.npy' % cache_path) or not os.path.isfile('%s.json' % cache_path):
+            return None
+
+        with open('%s.json' % cache_path, 'r') as cache_file:
+            cache_info = json.load(cache_file)
+
+        self.image_file_names = cache_info['image_file_names']
+        self.unprocessed_images = [tuple(image) for image in cache_info['unprocessed_images']]
+
+        return np.load('%s.npy' % cache_path, mmap_mode='r')
+
+    def save_image_cache(self, cache_key, training_data, n_processed, temporary_path=None):
+        """
+        This method finalises a decoded image cache that was written to a temporary memory map, and removes caches
+        with other keys
+
+        Parameters
+        ----------
+        cache_key - str
+            The key of the cache
+
+        training_data - np.memmap
+            The temporary memory map containing the decoded images
+
+        n_processed - int
+            The number of images that were decoded successfully
+
+        temporary_path - str
+            Location of the temporary memory map; by default the cache path with a .tmp extension
+
+        Returns
+        ----------
+        np.memmap - of data inputs (X vector)
+        """
+
+        cache_path = self.get_image_cache_path(cache_key)
+        temporary_path = temporary_path or '%s.tmp' % cache_path
+
+        for old_cache in glob.glob(os.path.join(self.cache_data_path, '%s*' % self.get_image_cache_prefix())):
+            if not old_cache.startswith('%s.' % cache_path):
+                os.remove(old_cache)
+
+        if n_processed < training_data.shape[0]:
+            np.save('%s.npy' % cache_path, training_data[:n_processed])
+            del training_data
+            os.remove(temporary_path)
+        else:
+            training_data.flush()
+            del training_data
+            os.replace(temporary_path, '%s.npy' % cache_path)
+
+        cache_info = {'image_file_names': self.image_file_names, 'unprocessed_images': self.unprocessed_images, 
+            'unprocessed_file_names': [self.get_image_file_name(image) for image, error in self.unprocessed_images],
+            'image_signatures': self.image_signatures, 'config': self.get_image_cache_config()}
+
+        with open('%s.json.tmp' % cache_path, 'w') as cache_file:
+            json.dump(cache_info, cache_file)
+
+        os.replace('%s.json.tmp' % cache_path, '%s.json' % cache_path)
+
+        return np.load('%s.npy' % cache_path, mmap_mode='r')
+
+    def get_image_dtype(self):
+        """
+        This method returns the dtype to store the images in X, based on self.image_dtype
+
+        Returns
+        ----------
+        np.dtype - the dtype of the X array
+        """
+
+        dtype = np.dtype(self.image_dtype)
+
+        if dtype.name not in IMAGE_DTYPES:
+            raise ValueError('The image dtype %s is unsupported; choose one of %s' % (dtype.name, ', '.join(IMAGE_DTYPES)))
+
+        return dtype
+
+    def is_stored_normalized(self):
+        """
+        This method checks whether the images in X are stored normalized. With the uint8 dtype we store the pixels, and normalize
+        each batch as it is served (see prepare_batch)
+
+        Returns
+        ----------
+        bool - True if the images in X are normalized
+        """
+
+        return bool(self.normalize) and self.get_image_dtype() != np.uint8
+
+    def prepare_batch(self, X):
+        """
+        This method prepares a batch of inputs for the model. If the images are normalized but stored as uint8 pixels,
+        we normalize the batch to float32 values in [-1, 1]
+
+        Parameters
+        ----------
+        X - np.ndarray
+            Batch of images from X
+
+        Returns
+        ----------
+        np.ndarray - the batch of images for the model
+        """
+
+        if self.normalize and X.dtype == np.uint8:
+            return normalize_images(X.astype(np.float32))
+
+        return X
+
+    def decode_images(self, images):
+        """
+        This method decodes and transforms a list of images, in order, in chunks of self.decode_chunk_size; images of the same size
+        in a chunk are transformed together with transform_batch. If self.decode_workers is greater than one, the chunks are decoded
+        in a pool of worker processes
+
+        Parameters
+        ----------
+        images - list of strs
+            Locations of the images to decode
+
+        Returns
+        ----------
+        generator of tuples - (np.ndarray of the image or None, str error message or None) in the order of images
+        """
+
+        decode = functools.partial(decode_image_chunk, self.__class__, resize_height=self.image_shape[0], 
+            resize_width=self.image_shape[1], normalize=self.is_stored_normalized(), dtype=self.get_image_dtype())
+
+        chunks = [images[start:start + self.decode_chunk_size] for start in range(0, len(images), self.decode_chunk_size)]
+
+        if self.decode_workers > 1 and len(images) > 1:
+            with ProcessPoolExecutor(max_workers=self.decode_workers) as executor:
+                for results in executor.map(decode, chunks):
+                    for result in results:
+                        yield result
+        else:
+            for chunk in chunks:
+                for result in decode(chunk):
+                    yield result
 
     @classmethod
-    def imread(cls, path, grayscale = False):
+    def imread(cls, path, grayscale = False, dtype = np.float64):
         """
         This method reads an image from path
 
         Parameters
         ----------
-        path - str
+        path - str or ArchiveMember
             Location of the image
 
         grayscale - bool
             Whether the image is greyscale or not
 
+        dtype - np.dtype
+            The dtype of the returned array; if None, we return the pixels in the dtype of the image (uint8 for most images)
+
         Returns
         ----------
         np.ndarray - representation of the image
         """
 
-        if grayscale:
-            return scipy.misc.imread(path, flatten = True).astype(np.float)
-        else:
-            return scipy.misc.imread(path).astype(np.float)
+        if isinstance(path, ArchiveMember):
+            path = io.BytesIO(read_archive_member(path))
+
+        with Image.open(path) as image_file:
+            if grayscale:
+                image_file = image_file.convert('F')
+            elif image_file.mode == 'P':
+                image_file = image_file.convert('RGBA' if 'transparency' in image_file.info else 'RGB')
+            elif image_file.mode == '1':
+                image_file = image_file.convert('L')
+
+            image = np.asarray(image_file)
+
+        return image if dtype is None else image.astype(dtype)
+
+    @classmethod
+    def is_transformed_in_batches(cls):
+        """
+        This method checks whether images can be decoded in batches with transform_batch: that is, whether the class uses the
+        default get_image and transform methods
+
+        Returns
+        ----------
+        bool - True if the images can be decoded in batches
+        """
+
+        return cls.get_image.__func__ is ImageDataset.get_image.__func__ and cls.transform.__func__ is ImageDataset.transform.__func__
 
     @classmethod
     def center_crop(cls, image, resize_height=64, resize_width=64):
@@ -86,18 +1043,7 @@ class ImageDataset(Dataset):
         np.ndarray - resized image
         """
 
-        h, w = image.shape[:2]
-
-        if h > w:
-            divisor = int((h - w) / 2)
-            if divisor:
-                image = image[divisor:-divisor,:,:]
-        elif w > h:
-            divisor = int((w - h) / 2)
-            if divisor:
-                image = image[:,divisor:-divisor,:]
-
-        return scipy.misc.imresize(image, [resize_height, resize_width])
+        return cls.transform_batch(image[np.newaxis], resize_height, resize_width, crop=True, normalize=False, dtype=np.uint8)[0]
 
     @classmethod
     def get_image(cls, path, resize_height=64, resize_width=64, crop=True, grayscale=False, normalize=True):
@@ -157,12 +1103,73 @@ class ImageDataset(Dataset):
         np.ndarray - resized image
         """
 
+        dtype = np.float64 if normalize else np.uint8
+
+        return cls.transform_batch(np.asarray(image)[np.newaxis], resize_height, resize_width, crop, normalize=normalize, dtype=dtype)[0]
+
+    @classmethod
+    def transform_batch(cls, images, resize_height=64, resize_width=64, crop=True, normalize=True, dtype=np.float32, out=None):
+        """
+        This method applies the transformation of transform to a batch of images at once: it center crops, resizes with bilinear
+        interpolation and normalizes the whole batch, writing straight into the output array. Normalization is in place.
+
+        Parameters
+        ----------
+        images - np.ndarray
+            Batch of images of the same size, with shape (N, H, W, C) or (N, H, W) - typically uint8 pixels
+
+        resize_height - int
+            Height of the image in pixels
+
+        resize_width - int
+            Width of the image in pixels
+
+        crop - bool
+            If true, applies a crop to the images
+
+        normalize - bool
+            If true, centers the image values around 0 (for learning)
+
+        dtype - np.dtype
+            The dtype of the transformed images; uint8 is only available if normalize is False
+
+        out - np.ndarray (optional)
+            Array with shape (N, resize_height, resize_width) + images.shape[3:] to write the transformed images to
+
+        Returns
+        ----------
+        np.ndarray - the transformed images
+        """
+
+        dtype = np.dtype(dtype)
+
+        if dtype == np.uint8 and normalize:
+            raise ValueError('Normalized images cannot be stored as uint8; set normalize to False or use a float dtype')
+
+        images = np.asarray(images)
+        shape = (images.shape[0], resize_height, resize_width) + images.shape[3:]
+
+        if out is None:
+            out = np.empty(shape, dtype=dtype)
+
         if crop:
-            cropped_image = cls.center_crop(image, resize_height, resize_width)
+            images = center_crop_images(images)
+
+        # we resize in float32 or float64; for other dtypes we resize into a float32 array and convert it at the end
+        if out.dtype in [np.float32, np.float64]:
+            resized = out
         else:
-            cropped_image = scipy.misc.imresize(image, [resize_height, resize_width])
+            resized = np.empty(shape, dtype=np.float32)
+
+        resize_images(images, resize_height, resize_width, out=resized)
 
         if normalize:
-            return np.array(cropped_image)/127.5 - 1.
-        else:
-            return np.array(cropped_image)
\ No newline at end of file
+            normalize_images(resized)
+        elif out.dtype.kind in 'iu':
+            np.rint(resized, out=resized)
+            np.clip(resized, 0, 255, out=resized)
+
+        if resized is not out:
+            out[...] = resized
+
+        return out
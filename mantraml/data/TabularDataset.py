@@ -1,35 +1,94 @@
+import glob
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 import os
 
+from mantraml.core.hashing.MantraHashed import MantraHashed
+
 from .Dataset import Dataset, cachedata
+from .utils import get_shard_bounds
+
+DTYPE_INFERENCE_ROWS = 10000 # rows sampled to infer a compact dtype map
+TABULAR_FILE_TYPES = ['csv', 'parquet', 'feather', 'arrow', 'npz']
 
 
 class TabularDataset(Dataset):
     """
     This class implements dataset processing methods for a tabular dataset
+
+    Only the feature and target columns are read from the data file, using a compact dtype map: either the dtypes class variable
+    (column name -> dtype), or one inferred from the data. If chunk_size is set, the file is read in chunks of that many rows, which
+    are written straight into preallocated float32 X and y arrays; X and y are read in the same pass, so loading one stores both.
+
+    Data files can be csv, parquet, feather/arrow or npz (one 1-D array per column) files. Reading parquet and feather files needs pyarrow.
+    If pyarrow is installed and convert_csv is True (opt-in), a csv data file is converted once to a parquet file in raw/.extract, keyed by the
+    SHA-256 hash of the csv file, and later reads use the parquet file.
     """
 
     data_type = 'tabular'
     has_labels = True
 
-    def __init__(self, **kwargs):       
-        # Potential parameters to come through kwargs: target, features, target_index, features_index 
+    features = None
+    target = None
+    feature_indices = None
+    target_index = None
+
+    dtypes = None
+    chunk_size = None
+    convert_csv = False
+
+    def __init__(self, **kwargs):
+        # Potential parameters to come through kwargs: target, features, target_index, features_index
         # Or they can be hardcoded as class variables
 
         super().__init__(**kwargs)
 
-        file_type = self.data_file.split('.')[-1] 
-        if file_type == 'csv':
-            self.df = pd.read_csv('%s/%s' % ('%s%s' % (self.data_dir, 'raw/.extract'), self.data_file))
-        else:
+        self.chunk_size = kwargs.get('chunk_size', self.chunk_size)
+
+        if self.chunk_size is not None:
+            self.chunk_size = int(self.chunk_size)
+
+        file_type = self.data_file.split('.')[-1]
+        if file_type not in TABULAR_FILE_TYPES:
             raise TypeError('The file type .%s is unsupported' % file_type)
 
+        self.data_file_path = '%s/%s' % ('%s%s' % (self.data_dir, 'raw/.extract'), self.data_file)
+
+    @cachedata
+    def df(self):
+        """
+        This method reads the data file into a pd.DataFrame. We read the feature and target columns only, if they are set. If the
+        dataset is a shard, we read only the rows of the shard where the file type allows (csv and parquet files)
+
+        Returns
+        --------
+        pd.DataFrame - of the data file
+        """
+
+        data_file_path, file_type = self.get_read_location()
+        usecols = self.get_usecols()
+        shard_rows = self.get_shard_rows()
+
+        if file_type != 'csv':
+            return self.compact_dtypes(self.read_columnar_file(data_file_path, file_type, usecols, shard_rows))
+
+        read_kwargs = self.get_csv_shard_kwargs(data_file_path, shard_rows)
+
+        try:
+            df = pd.read_csv(data_file_path, usecols=usecols, dtype=self.get_dtypes(usecols), **read_kwargs)
+        except (ValueError, TypeError, OverflowError):
+            # an inferred dtype did not hold for the whole file, so we read at full width and compact afterwards
+            if self.dtypes is not None:
+                raise
+            df = pd.read_csv(data_file_path, usecols=usecols, **read_kwargs)
+
+        return self.compact_dtypes(df)
+
     @cachedata
     def X(self):
         """
-        This method extracts inputs from the data. The output should be an np.ndarray that can be processed 
+        This method extracts inputs from the data. The output should be an np.ndarray that can be processed
         by the model.
 
         Returns
@@ -37,16 +96,21 @@ class TabularDataset(Dataset):
         np.ndarray - of data inputs (X vector)
         """
 
+        if self.chunk_size:
+            X, y = self.read_chunked_data()
+            type(self).y.prime(self, y)
+            return X
+
         if self.features:
             return self.df[self.features].values
 
-        if self.features_index:
-            return self.df[:, self.features_index].values
+        if self.feature_indices:
+            return self.df.iloc[:, self.get_column_positions(self.feature_indices)].values
 
     @cachedata
     def y(self):
         """
-        This method extracts outputs from the data. The output should be an np.ndarray that can be processed 
+        This method extracts outputs from the data. The output should be an np.ndarray that can be processed
         by the model.
 
         Returns
@@ -54,8 +118,488 @@ class TabularDataset(Dataset):
         np.ndarray - of data inputs (y vector)
         """
 
+        if self.chunk_size:
+            X, y = self.read_chunked_data()
+            type(self).X.prime(self, X)
+            return y
+
         if self.features:
             return self.df[self.target].values
 
-        if self.features_index:
-            return self.df.iloc[:, self.target_index].values
\ No newline at end of file
+        if self.feature_indices:
+            return self.df.iloc[:, self.get_column_positions(self.target_index)].values
+
+    def get_usecols(self):
+        """
+        This method returns the columns to read from the data file: the feature and target columns
+
+        Returns
+        --------
+        list - of column names, or column indices if we are using feature_indices; None to read all columns
+        """
+
+        if self.features:
+            targets = self.target if isinstance(self.target, (list, tuple)) else [self.target]
+            return list(dict.fromkeys(list(self.features) + [target for target in targets if target is not None]))
+
+        if self.feature_indices:
+            targets = self.target_index if isinstance(self.target_index, (list, tuple)) else [self.target_index]
+            return sorted(set([int(index) for index in list(self.feature_indices) + [target for target in targets if target is not None]]))
+
+        return None
+
+    def get_natively_sharded_names(self):
+        """
+        This method returns the names of the cachedata properties that load only the data of the shard themselves: the data file is
+        read by row range, and X and y are taken from the rows read
+
+        Returns
+        --------
+        list of strs - the names of the properties
+        """
+
+        return ['df', 'X', 'y']
+
+    def get_shard_rows(self):
+        """
+        This method returns the range of data file rows in the shard of the dataset, if it is a shard. The rows are split across
+        the shards as in Dataset.shard, from the number of rows in the file (see get_num_rows)
+
+        Returns
+        --------
+        tuple - (start, stop) rows of the shard, or None if the dataset is not a shard
+        """
+
+        if self.shard_spec is None:
+            return None
+
+        n_rows = self.get_num_rows()
+
+        if n_rows is None and self.data_file.split('.')[-1] == 'npz':
+            with np.load(self.data_file_path) as data:
+                n_rows = len(data[data.files[0]]) if data.files else 0
+        elif n_rows is None:
+            import pyarrow
+            import pyarrow.ipc
+
+            with pyarrow.memory_map(self.data_file_path) as source:
+                reader = pyarrow.ipc.open_file(source)
+                n_rows = sum([reader.get_batch(batch).num_rows for batch in range(reader.num_record_batches)])
+
+        return get_shard_bounds(n_rows, *self.shard_spec)
+
+    def get_csv_shard_kwargs(self, data_file_path, shard_rows):
+        """
+        This method returns the pd.read_csv arguments that read only the rows of the shard: we skip the header and the rows before
+        the shard, so we pass the column names of the file
+
+        Parameters
+        --------
+        data_file_path - str
+            Location of the csv file
+
+        shard_rows - tuple
+            (start, stop) rows of the shard, or None to read all rows
+
+        Returns
+        --------
+        dict - of pd.read_csv arguments
+        """
+
+        if shard_rows is None:
+            return {}
+
+        start, stop = shard_rows
+
+        return {'header': None, 'names': self.get_file_columns(data_file_path, 'csv'), 'skiprows': start + 1, 'nrows': stop - start}
+
+    def get_column_positions(self, indices):
+        """
+        This method maps column indices of the data file to positions in self.df, which only contains the columns in usecols
+
+        Parameters
+        --------
+        indices - int or list of ints
+            Column indices in the data file
+
+        Returns
+        --------
+        int or list of ints - positions in self.df
+        """
+
+        usecols = self.get_usecols()
+
+        if isinstance(indices, (list, tuple)):
+            return [usecols.index(int(index)) for index in indices]
+
+        return usecols.index(int(indices))
+
+    def get_dtypes(self, usecols):
+        """
+        This method returns the dtype map used to read the data file: the dtypes class variable if it is set (with integer columns
+        at full width), otherwise a map inferred from the first rows of the file, in which float columns are read as float32. Integer columns are read at full width, as later
+        rows may hold larger values than the sampled rows; compact_dtypes downcasts them from the values of the whole column
+
+        Parameters
+        --------
+        usecols - list
+            The columns that will be read
+
+        Returns
+        --------
+        dict - column -> dtype
+        """
+
+        if self.dtypes is not None:
+            # integer columns are read at full width, so compact_dtypes can check that their values fit the narrower dtype
+            full_width = {'i': np.int64, 'u': np.uint64}
+            return {column: full_width.get(np.dtype(dtype).kind, dtype) for column, dtype in self.dtypes.items()}
+
+        sample = pd.read_csv(self.data_file_path, usecols=usecols, nrows=DTYPE_INFERENCE_ROWS)
+        dtypes = {}
+
+        for column in sample.columns:
+            if pd.api.types.is_float_dtype(sample[column]):
+                dtypes[column] = np.float32
+
+        return dtypes
+
+    def compact_dtypes(self, df):
+        """
+        This method converts the columns of a pd.DataFrame to a compact dtype map: the dtypes class variable if it is set, otherwise
+        float columns are converted to float32, and integer columns to the smallest integer type that holds their values. We check
+        that integer columns fit a dtype of the dtypes class variable, rather than letting their values wrap around
+
+        Parameters
+        --------
+        df - pd.DataFrame
+            The data to convert
+
+        Returns
+        --------
+        pd.DataFrame - with the compact dtypes
+        """
+
+        if self.dtypes is not None:
+            dtypes = {column: np.dtype(dtype) for column, dtype in self.dtypes.items() if column in df.columns}
+
+            for column, dtype in dtypes.items():
+                if dtype.kind in 'iu' and pd.api.types.is_integer_dtype(df[column]) and len(df[column]):
+                    if df[column].min() < np.iinfo(dtype).min or df[column].max() > np.iinfo(dtype).max:
+                        raise OverflowError('The values of column %s do not fit the dtype %s' % (column, dtype.name))
+
+            return df.astype(dtypes)
+
+        for column in df.columns:
+            if pd.api.types.is_float_dtype(df[column]):
+                df[column] = df[column].astype(np.float32)
+            elif pd.api.types.is_integer_dtype(df[column]):
+                df[column] = pd.to_numeric(df[column], downcast='integer')
+
+        return df
+
+    def get_read_location(self):
+        """
+        This method returns the file to read the data from, and its type. For a csv data file, this is the parquet conversion of the
+        file if one can be made (see convert_csv_file)
+
+        Returns
+        --------
+        tuple - (str location of the file, str file type)
+        """
+
+        file_type = self.data_file.split('.')[-1]
+
+        if file_type == 'csv' and self.convert_csv:
+            converted_file_path = self.convert_csv_file()
+            if converted_file_path is not None:
+                return converted_file_path, 'parquet'
+
+        return self.data_file_path, file_type
+
+    def convert_csv_file(self):
+        """
+        This method converts the csv data file to a parquet file in raw/.extract, once; the name of the parquet file contains the SHA-256 hash
+        of the csv file, so a changed csv file is converted again. Conversions of older versions of the file are removed.
+
+        Returns
+        --------
+        str - location of the parquet file, or None if pyarrow is not installed or the csv file cannot be converted
+        """
+
+        try:
+            import pyarrow
+            import pyarrow.csv
+            import pyarrow.parquet
+        except ImportError:
+            return None
+
+        # the data file was hashed when we extracted the data dependencies, so we only hash it here if it was not
+        file_hash = getattr(self, 'file_hashes', {}).get(self.data_file) or MantraHashed.get_256_hash_from_file(self.data_file_path)
+        converted_file_path = '%s.%s.parquet' % (self.data_file_path, file_hash)
+
+        if os.path.isfile(converted_file_path):
+            return converted_file_path
+
+        for old_file_path in glob.glob('%s.*.parquet' % self.data_file_path):
+            os.remove(old_file_path)
+
+        # we stream the csv file in record batches, so the conversion does not hold the whole table in memory. The streaming reader
+        # fixes the column types from the first block; if a later block does not fit them, we read the csv file with pandas instead
+        writer = None
+
+        try:
+            reader = pyarrow.csv.open_csv(self.data_file_path)
+            writer = pyarrow.parquet.ParquetWriter('%s.tmp' % converted_file_path, reader.schema)
+
+            for batch in reader:
+                writer.write_table(pyarrow.Table.from_batches([batch], schema=reader.schema))
+        except pyarrow.ArrowInvalid:
+            if writer is not None:
+                writer.close()
+                os.remove('%s.tmp' % converted_file_path)
+            return None
+
+        writer.close()
+        os.replace('%s.tmp' % converted_file_path, converted_file_path)
+
+        return converted_file_path
+
+    def get_file_columns(self, data_file_path, file_type):
+        """
+        This method returns the column names of a data file without reading its data
+
+        Parameters
+        --------
+        data_file_path - str
+            Location of the data file
+
+        file_type - str
+            The type of the data file
+
+        Returns
+        --------
+        list of strs - the column names
+        """
+
+        if file_type == 'csv':
+            return list(pd.read_csv(data_file_path, nrows=0).columns)
+        elif file_type == 'parquet':
+            import pyarrow.parquet
+            return list(pyarrow.parquet.read_schema(data_file_path).names)
+        elif file_type in ['feather', 'arrow']:
+            import pyarrow.ipc
+            return list(pyarrow.ipc.open_file(data_file_path).schema.names)
+        else:
+            with np.load(data_file_path) as data:
+                return list(data.files)
+
+    def read_columnar_file(self, data_file_path, file_type, usecols, shard_rows=None):
+        """
+        This method reads a parquet, feather/arrow or npz data file into a pd.DataFrame. For a range of rows, we read only the row
+        groups of a parquet file that contain them; feather/arrow and npz files are read whole and sliced
+
+        Parameters
+        --------
+        data_file_path - str
+            Location of the data file
+
+        file_type - str
+            The type of the data file
+
+        usecols - list
+            The columns to read, as names or indices; None to read all columns
+
+        shard_rows - tuple
+            (start, stop) rows to read, or None to read all rows
+
+        Returns
+        --------
+        pd.DataFrame - of the data file
+        """
+
+        columns = usecols
+
+        if usecols is not None and all([isinstance(column, int) for column in usecols]):
+            file_columns = self.get_file_columns(data_file_path, file_type)
+            columns = [file_columns[column] for column in usecols]
+
+        if file_type == 'parquet' and shard_rows is not None:
+            return self.read_parquet_rows(data_file_path, columns, *shard_rows)
+
+        if file_type == 'parquet':
+            df = pd.read_parquet(data_file_path, columns=columns)
+        elif file_type in ['feather', 'arrow']:
+            df = pd.read_feather(data_file_path, columns=columns)
+        else:
+            with np.load(data_file_path) as data:
+                df = pd.DataFrame({column: data[column] for column in (columns if columns is not None else data.files)})
+
+        if shard_rows is not None:
+            df = df.iloc[shard_rows[0]:shard_rows[1]].reset_index(drop=True)
+
+        return df
+
+    def read_parquet_rows(self, data_file_path, columns, start, stop):
+        """
+        This method reads a range of rows of a parquet file, reading only the row groups that contain them
+
+        Parameters
+        --------
+        data_file_path - str
+            Location of the parquet file
+
+        columns - list of strs
+            The columns to read; None to read all columns
+
+        start - int
+            The first row to read
+
+        stop - int
+            The row to stop reading at (exclusive)
+
+        Returns
+        --------
+        pd.DataFrame - of the rows
+        """
+
+        import pyarrow.parquet
+
+        parquet_file = pyarrow.parquet.ParquetFile(data_file_path)
+        row_groups, first_row, group_start = [], None, 0
+
+        for row_group in range(parquet_file.num_row_groups):
+            group_stop = group_start + parquet_file.metadata.row_group(row_group).num_rows
+
+            if group_start < stop and group_stop > start:
+                row_groups.append(row_group)
+                first_row = group_start if first_row is None else first_row
+
+            group_start = group_stop
+
+        if not row_groups:
+            return parquet_file.schema_arrow.empty_table().select(columns or parquet_file.schema_arrow.names).to_pandas()
+
+        table = parquet_file.read_row_groups(row_groups, columns=columns)
+
+        return table.slice(start - first_row, stop - start).to_pandas()
+
+    def iter_chunks(self, usecols):
+        """
+        This method reads the data file in pd.DataFrame chunks of up to self.chunk_size rows. Parquet files are read by record batch;
+        feather/arrow and npz files are read whole. If the dataset is a shard, we read only the rows of the shard
+
+        Parameters
+        --------
+        usecols - list
+            The columns to read, as names or indices; None to read all columns
+
+        Returns
+        --------
+        generator of pd.DataFrames - the chunks
+        """
+
+        data_file_path, file_type = self.get_read_location()
+        shard_rows = self.get_shard_rows()
+
+        if file_type == 'csv':
+            read_kwargs = self.get_csv_shard_kwargs(data_file_path, shard_rows)
+
+            for chunk in pd.read_csv(data_file_path, usecols=usecols, dtype=self.get_dtypes(usecols) if self.dtypes is not None else None, 
+                chunksize=self.chunk_size, **read_kwargs):
+                yield chunk
+
+        elif file_type == 'parquet' and shard_rows is not None:
+            for chunk_start in range(shard_rows[0], shard_rows[1], self.chunk_size):
+                yield self.read_columnar_file(data_file_path, file_type, usecols, (chunk_start, min(chunk_start + self.chunk_size, shard_rows[1])))
+
+        elif file_type == 'parquet':
+            import pyarrow.parquet
+
+            columns = usecols
+
+            if usecols is not None and all([isinstance(column, int) for column in usecols]):
+                file_columns = self.get_file_columns(data_file_path, file_type)
+                columns = [file_columns[column] for column in usecols]
+
+            for batch in pyarrow.parquet.ParquetFile(data_file_path).iter_batches(batch_size=self.chunk_size, columns=columns):
+                yield batch.to_pandas()
+
+        else:
+            yield self.read_columnar_file(data_file_path, file_type, usecols, shard_rows)
+
+    def get_num_rows(self):
+        """
+        This method counts the data rows in the data file: from the file metadata for parquet files, and from the line count for csv files
+
+        Returns
+        --------
+        int - the number of rows, or None if it cannot be counted without reading the file
+        """
+
+        data_file_path, file_type = self.get_read_location()
+
+        if file_type == 'parquet':
+            import pyarrow.parquet
+            return pyarrow.parquet.ParquetFile(data_file_path).metadata.num_rows
+        elif file_type != 'csv':
+            return None
+
+        n_lines = 0
+        last_byte = b'\n'
+
+        with open(data_file_path, 'rb') as data_file:
+            for block in iter(lambda: data_file.read(1 << 20), b''):
+                n_lines += block.count(b'\n')
+                last_byte = block[-1:]
+
+        if last_byte != b'\n':
+            n_lines += 1
+
+        return max(n_lines - 1, 0)
+
+    def read_chunked_data(self):
+        """
+        This method reads the data file in chunks of self.chunk_size rows, writing each chunk straight into preallocated float32 X and y arrays.
+        For csv files the arrays are sized from the line count of the file; quoted line breaks can make that an overestimate, so we trim to
+        the rows read.
+
+        Returns
+        --------
+        tuple - (np.ndarray of data inputs X, np.ndarray of data outputs y)
+        """
+
+        usecols = self.get_usecols()
+
+        if self.features:
+            feature_columns = list(self.features)
+            target_columns = self.target
+        else:
+            feature_columns = self.get_column_positions(self.feature_indices)
+            target_columns = self.get_column_positions(self.target_index)
+
+        chunks = self.iter_chunks(usecols)
+        shard_rows = self.get_shard_rows()
+        n_rows = self.get_num_rows() if shard_rows is None else shard_rows[1] - shard_rows[0]
+
+        if n_rows is None:
+            chunks = list(chunks)
+            n_rows = sum([len(chunk) for chunk in chunks])
+
+        y_shape = (len(target_columns),) if isinstance(target_columns, (list, tuple)) else ()
+
+        X = np.empty((n_rows, len(feature_columns)), dtype=np.float32)
+        y = np.empty((n_rows,) + y_shape, dtype=np.float32)
+        n_read = 0
+
+        for chunk in chunks:
+            if self.features:
+                chunk_X, chunk_y = chunk[feature_columns], chunk[target_columns]
+            else:
+                chunk_X, chunk_y = chunk.iloc[:, feature_columns], chunk.iloc[:, target_columns]
+
+            X[n_read:n_read + len(chunk)] = chunk_X.values
+            y[n_read:n_read + len(chunk)] = chunk_y.values
+            n_read += len(chunk)
+
+        return X[:n_read], y[:n_read]
@@ -1,3 +1,5 @@
 from .Dataset import Dataset, cachedata
 from .ImageDataset import ImageDataset
-from .TabularDataset import TabularDataset
\ No newline at end of file
+from .TabularDataset import TabularDataset
+from .augmentation import AugmentationPipeline, ColorJitter, RandomCrop, RandomFlip
+from .cache import set_cache_budget
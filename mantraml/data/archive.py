@@ -0,0 +1,160 @@
+import bz2
+import collections
+import gzip
+import json
+import lzma
+import mmap
+import os
+import shutil
+import tarfile
+
+ArchiveMember = collections.namedtuple('ArchiveMember', ['archive_path', 'name', 'offset', 'size'])
+
+_archive_maps = {}  # memory maps of the archives read by this process: archive path -> ((mtime, size), memory map)
+
+
+def build_tar_index(tar_path):
+    """
+    Builds an index of the regular files in an uncompressed tar file: the name of each file, the offset and size of its data
+    within the tar file, and its modification time. We only read the member headers, so this is fast even for large tar files.
+
+    Parameters
+    -----------
+    tar_path - str
+        Location of the uncompressed tar file
+
+    Returns
+    -----------
+    list of lists - [name, offset, size, mtime] for each regular file, sorted by name
+    """
+
+    with tarfile.open(tar_path, mode='r:') as tar:
+        index = [[member.name, member.offset_data, member.size, int(member.mtime)] for member in tar if member.isfile()]
+
+    return sorted(index)
+
+
+def load_tar_index(tar_path, index_path):
+    """
+    Loads the member index of an uncompressed tar file from index_path, building and storing it if it does not exist
+
+    Parameters
+    -----------
+    tar_path - str
+        Location of the uncompressed tar file
+
+    index_path - str
+        Location of the stored index (json)
+
+    Returns
+    -----------
+    list of lists - [name, offset, size, mtime] for each regular file, sorted by name
+    """
+
+    if os.path.isfile(index_path):
+        with open(index_path, 'r') as index_file:
+            return json.load(index_file)
+
+    index = build_tar_index(tar_path)
+
+    with open('%s.tmp' % index_path, 'w') as index_file:
+        json.dump(index, index_file)
+
+    os.replace('%s.tmp' % index_path, index_path)
+
+    return index
+
+
+def is_uncompressed_tar(tar_path):
+    """
+    Checks whether a file is an uncompressed tar file, which can be read at member offsets
+
+    Parameters
+    -----------
+    tar_path - str
+        Location of the file
+
+    Returns
+    -----------
+    bool - True if the file is an uncompressed tar file
+    """
+
+    try:
+        with tarfile.open(tar_path, mode='r:'):
+            return True
+    except tarfile.ReadError:
+        return False
+
+
+def decompress_tar(tar_path, output_path):
+    """
+    Writes an uncompressed (and so seekable) copy of a compressed tar file
+
+    Parameters
+    -----------
+    tar_path - str
+        Location of the compressed tar file, e.g. a .tar.gz file
+
+    output_path - str
+        Location of the uncompressed copy
+    """
+
+    with open(tar_path, 'rb') as tar_file:
+        magic = tar_file.read(6)
+
+    if magic.startswith(b'\x1f\x8b'):
+        open_compressed = gzip.open
+    elif magic.startswith(b'BZh'):
+        open_compressed = bz2.open
+    elif magic.startswith(b'\xfd7zXZ'):
+        open_compressed = lzma.open
+    else:
+        raise TypeError('The archive %s is not a gzip, bz2 or xz compressed tar file' % tar_path)
+
+    with open_compressed(tar_path, 'rb') as tar_file:
+        with open('%s.tmp' % output_path, 'wb') as output_file:
+            shutil.copyfileobj(tar_file, output_file)
+
+    os.replace('%s.tmp' % output_path, output_path)
+
+
+def read_archive_member(member):
+    """
+    Returns the bytes of an archive member as a zero-copy view of a memory map of the archive. Each process maps an archive once,
+    and maps it again if the file changes (its modification time or size)
+
+    Parameters
+    -----------
+    member - ArchiveMember
+        The member to read
+
+    Returns
+    -----------
+    memoryview - of the member data
+    """
+
+    archive_stat = os.stat(member.archive_path)
+    archive_signature = (archive_stat.st_mtime_ns, archive_stat.st_size)
+    archive_signature_and_map = _archive_maps.get(member.archive_path)
+
+    if archive_signature_and_map is None or archive_signature_and_map[0] != archive_signature:
+        with open(member.archive_path, 'rb') as archive_file:
+            archive_map = mmap.mmap(archive_file.fileno(), 0, access=mmap.ACCESS_READ)
+        _archive_maps[member.archive_path] = (archive_signature, archive_map)
+    else:
+        archive_map = archive_signature_and_map[1]
+
+    return memoryview(archive_map)[member.offset:member.offset + member.size]
+
+
+def discard_archive_map(archive_path):
+    """
+    Drops the memory map of an archive, e.g. before the archive is removed. The map is closed once no member views use it
+
+    Parameters
+    -----------
+    archive_path - str
+        Location of the archive
+    """
+
+    _archive_maps.pop(archive_path, None)
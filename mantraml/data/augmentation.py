@@ -0,0 +1,200 @@
+import zlib
+
+import numpy as np
+
+
+class Augmentation(object):
+    """
+    Base class of a random image augmentation. An augmentation transforms a batch of images with shape (N, H, W) or (N, H, W, C),
+    in place where possible, and keeps the shape and dtype of the batch
+    """
+
+    def __call__(self, images, random_state, value_range):
+        """
+        Parameters
+        -----------
+        images - np.ndarray
+            Writeable batch of images
+
+        random_state - np.random.RandomState
+            Source of randomness for the batch
+
+        value_range - tuple
+            (low, high) pixel values of the images, e.g. (0, 255) for pixels or (-1, 1) for normalized images
+
+        Returns
+        -----------
+        np.ndarray - the augmented images
+        """
+
+        raise NotImplementedError
+
+
+class RandomCrop(Augmentation):
+    """
+    Crops each image at a random position after padding its borders, so the images are randomly translated by up to padding pixels
+    and keep their shape. The padding repeats the edge pixels
+    """
+
+    def __init__(self, padding=4):
+        self.padding = int(padding)
+
+    def __call__(self, images, random_state, value_range):
+        if not self.padding:
+            return images
+
+        height, width = images.shape[1:3]
+        pad_width = [(0, 0), (self.padding, self.padding), (self.padding, self.padding)] + [(0, 0)] * (images.ndim - 3)
+        padded = np.pad(images, pad_width, mode='edge')
+
+        tops = random_state.randint(0, 2 * self.padding + 1, size=len(images))
+        lefts = random_state.randint(0, 2 * self.padding + 1, size=len(images))
+
+        for image_no, (top, left) in enumerate(zip(tops, lefts)):
+            images[image_no] = padded[image_no, top:top + height, left:left + width]
+
+        return images
+
+
+class RandomFlip(Augmentation):
+    """
+    Flips each image horizontally and/or vertically with probability p
+    """
+
+    def __init__(self, horizontal=True, vertical=False, p=0.5):
+        self.horizontal = horizontal
+        self.vertical = vertical
+        self.p = p
+
+    def __call__(self, images, random_state, value_range):
+        for axis, enabled in [(2, self.horizontal), (1, self.vertical)]:
+            if not enabled:
+                continue
+
+            flipped = np.flatnonzero(random_state.random_sample(len(images)) < self.p)
+
+            if len(flipped):
+                images[flipped] = np.flip(images[flipped], axis=axis)
+
+        return images
+
+
+class ColorJitter(Augmentation):
+    """
+    Randomly changes the brightness, contrast and saturation of each image. Each factor is drawn uniformly from
+    [1 - amount, 1 + amount]; brightness scales the pixel values, contrast scales their distance from the mean of the image,
+    and saturation their distance from the grayscale image. The results are clipped to the value range of the images
+    """
+
+    def __init__(self, brightness=0., contrast=0., saturation=0.):
+        self.brightness = brightness
+        self.contrast = contrast
+        self.saturation = saturation
+
+    def get_factors(self, amount, random_state, n_images, n_dims):
+        """
+        Draws a factor per image, shaped to broadcast over a batch of n_dims dimensions
+        """
+
+        factors = random_state.uniform(max(1 - amount, 0), 1 + amount, size=n_images).astype(np.float32)
+
+        return factors.reshape((-1,) + (1,) * (n_dims - 1))
+
+    def __call__(self, images, random_state, value_range):
+        if not (self.brightness or self.contrast or self.saturation):
+            return images
+
+        low, high = value_range
+        jittered = images.astype(np.float32)
+        jittered -= low
+
+        if self.brightness:
+            jittered *= self.get_factors(self.brightness, random_state, len(images), images.ndim)
+
+        if self.contrast:
+            means = jittered.mean(axis=tuple(range(1, images.ndim)), keepdims=True)
+            jittered -= means
+            jittered *= self.get_factors(self.contrast, random_state, len(images), images.ndim)
+            jittered += means
+
+        if self.saturation and images.ndim == 4 and images.shape[3] >= 3:
+            grays = jittered[..., :3].mean(axis=3, keepdims=True)
+            jittered[..., :3] -= grays
+            jittered[..., :3] *= self.get_factors(self.saturation, random_state, len(images), images.ndim)
+            jittered[..., :3] += grays
+
+        jittered += low
+        np.clip(jittered, low, high, out=jittered)
+
+        if images.dtype == np.uint8:
+            np.rint(jittered, out=jittered)
+
+        images[...] = jittered
+
+        return images
+
+
+class AugmentationPipeline(object):
+    """
+    Applies a list of augmentations to batches of images. If a seed is set, the randomness of each batch is drawn from the seed,
+    the epoch and the indices of the examples in the batch, so a batch is augmented the same way whichever worker loads it, and
+    runs with the same seed are reproducible
+
+    Example: AugmentationPipeline([RandomCrop(padding=4), RandomFlip(), ColorJitter(brightness=0.2)], seed=0)
+    """
+
+    def __init__(self, augmentations, seed=None):
+        self.augmentations = list(augmentations)
+        self.seed = seed
+        self.epoch = 0
+
+    def get_random_state(self, indices):
+        """
+        Returns the source of randomness for a batch
+
+        Parameters
+        -----------
+        indices - np.ndarray of ints or slice
+            Indices of the examples in the batch
+
+        Returns
+        -----------
+        np.random.RandomState - seeded from the seed, epoch and indices if a seed is set
+        """
+
+        if self.seed is None:
+            return np.random.RandomState()
+
+        if isinstance(indices, slice):
+            indices = np.arange(*indices.indices(indices.stop))
+
+        indices_key = zlib.crc32(np.ascontiguousarray(indices, dtype=np.int64).tobytes())
+
+        return np.random.RandomState([int(self.seed), self.epoch, indices_key])
+
+    def __call__(self, images, indices, value_range=(0, 255)):
+        """
+        Augments a batch of images in place
+
+        Parameters
+        -----------
+        images - np.ndarray
+            Writeable batch of images
+
+        indices - np.ndarray of ints or slice
+            Indices of the examples in the batch
+
+        value_range - tuple
+            (low, high) pixel values of the images
+
+        Returns
+        -----------
+        np.ndarray - the augmented images
+        """
+
+        random_state = self.get_random_state(indices)
+
+        for augmentation in self.augmentations:
+            images = augmentation(images, random_state, value_range)
+
+        return images
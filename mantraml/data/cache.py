@@ -0,0 +1,339 @@
+import collections
+import threading
+import weakref
+
+import numpy as np
+import pandas as pd
+
+from .storage import is_shared_array
+
+
+def get_nbytes(data):
+    """
+    Returns the number of bytes of private memory that cached data holds. Memory mapped and shared memory arrays are not private
+    to the dataset, so we count them as zero
+
+    Parameters
+    -----------
+    data - np.ndarray, pd.DataFrame, pd.Series or other object
+        The cached data
+
+    Returns
+    -----------
+    int - the number of bytes
+    """
+
+    if isinstance(data, np.ndarray):
+        return 0 if is_shared_array(data) else data.nbytes
+    elif isinstance(data, pd.DataFrame):
+        return int(data.memory_usage(index=True).sum())
+    elif isinstance(data, pd.Series):
+        return int(data.memory_usage(index=True))
+
+    return 0
+
+
+class CacheBudget(object):
+    """
+    Keeps track of the data cached by cachedata properties across all datasets in the process, in least recently used order. If
+    max_bytes is set, we evict the least recently used data when the total exceeds it; evicted data is loaded again on next access
+    """
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()  # (id of instance, name) -> (weak reference to instance, name, nbytes)
+        self.lock = threading.RLock()  # reentrant, as weak reference callbacks can run while we hold it
+
+    @property
+    def nbytes(self):
+        """
+        Returns the total number of bytes of cached data
+        """
+
+        with self.lock:
+            return sum(nbytes for instance_ref, name, nbytes in self.entries.values())
+
+    def add(self, instance, name, nbytes):
+        """
+        Records cached data, and evicts least recently used data if we are over budget
+
+        Parameters
+        -----------
+        instance - object
+            The instance that cached the data
+
+        name - str
+            The name of the cachedata property
+
+        nbytes - int
+            The number of bytes of the data
+        """
+
+        key = (id(instance), name)
+
+        with self.lock:
+            self.entries[key] = (weakref.ref(instance, lambda ref, key=key: self.discard_key(key)), name, nbytes)
+            self.entries.move_to_end(key)
+            evictions = self.get_evictions(key)
+
+        for evicted_key, evicted_entry, evicted_instance in evictions:
+            if not cachedata.evict(evicted_instance, evicted_entry[1]):
+                # the data is in use, so we keep it, as the least recently used
+                with self.lock:
+                    self.entries[evicted_key] = evicted_entry
+                    self.entries.move_to_end(evicted_key, last=False)
+
+    def touch(self, instance, name):
+        """
+        Marks cached data as the most recently used
+        """
+
+        with self.lock:
+            if (id(instance), name) in self.entries:
+                self.entries.move_to_end((id(instance), name))
+
+    def discard(self, instance, name):
+        """
+        Removes cached data from the accounting, e.g. when it is invalidated
+        """
+
+        self.discard_key((id(instance), name))
+
+    def discard_key(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def get_evictions(self, keep_key):
+        """
+        Finds the least recently used data to evict to get within budget; must be called holding self.lock
+
+        Parameters
+        -----------
+        keep_key - tuple
+            The key of the data just cached, which we never evict
+
+        Returns
+        -----------
+        list of tuples - (key, entry, instance) of the data to evict
+        """
+
+        if self.max_bytes is None:
+            return []
+
+        total = sum(nbytes for instance_ref, name, nbytes in self.entries.values())
+        evictions = []
+
+        for key, (instance_ref, name, nbytes) in list(self.entries.items()):
+            if total <= self.max_bytes:
+                break
+
+            if key == keep_key or not nbytes:
+                continue
+
+            instance = instance_ref()
+
+            if instance is not None:
+                evictions.append((key, self.entries[key], instance))
+
+            del self.entries[key]
+            total -= nbytes
+
+        return evictions
+
+
+cache_budget = CacheBudget()
+
+
+def set_cache_budget(max_bytes):
+    """
+    Sets the process-wide memory budget for data cached by cachedata properties
+
+    Parameters
+    -----------
+    max_bytes - int or None
+        The maximum number of bytes of cached data; None for no limit
+    """
+
+    cache_budget.max_bytes = max_bytes
+
+
+class cachedata(object):
+    """
+    This decorator saves the output of a function "my_data" to a private location "_my_data", and exposes it as a property.
+    When we call the function again, we simply retrieve the output from RAM instead of doing the calculation again.
+
+    Loading is single flight: each instance has a lock per property, so if several threads access the property at once, the
+    function runs once and the other threads wait for its output. Cached data can be dropped with invalidate, and counts towards
+    the process-wide cache budget (see set_cache_budget), which evicts least recently used data when it is exceeded.
+
+    If the instance has storage = 'memmap', the output is written once to a binary file, and we return a memory map of the file;
+    with storage = 'shared', the output is published once to shared memory, and we return a view of it (see Dataset.store_data).
+    """
+
+    locks_lock = threading.Lock()  # guards the creation of the per instance locks
+
+    def __init__(self, function):
+        self.function = function
+        self.name = function.__name__
+        self.__doc__ = function.__doc__
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+
+        attribute_name = '_%s' % self.name
+        stored_data = getattr(instance, attribute_name, None)
+
+        if stored_data is not None:
+            cache_budget.touch(instance, self.name)
+            return stored_data
+
+        with self.get_lock(instance, self.name):
+            stored_data = getattr(instance, attribute_name, None)
+
+            if stored_data is not None:
+                return stored_data
+
+            # a lazily constructed dataset extracts its files on first access to the data
+            if getattr(instance, 'files_data_pending', False):
+                instance.load_files_data()
+
+            # with memmap or shared storage, the data may have been stored by an earlier instance or another process
+            external_storage = getattr(instance, 'storage', 'memory') != 'memory'
+
+            if external_storage:
+                stored_data = instance.load_stored_data(self.name)
+
+            if stored_data is None:
+                stored_data = self.function(instance)
+
+                if getattr(instance, 'shard_spec', None) is not None:
+                    stored_data = instance.shard_data(self.name, stored_data)
+
+                if external_storage:
+                    stored_data = instance.store_data(self.name, stored_data)
+
+            setattr(instance, attribute_name, stored_data)
+
+        if stored_data is not None:
+            cache_budget.add(instance, self.name, get_nbytes(stored_data))
+
+        return stored_data
+
+    def __set__(self, instance, value):
+        raise AttributeError("can't set attribute")
+
+    def prime(self, instance, data):
+        """
+        Stores data of an instance that was loaded alongside another property, e.g. y read in the same pass over a file as X, as
+        if the function had returned it: it goes to the storage of the instance, and counts towards the cache budget. If another
+        thread holds the lock of the property, it is loading the data itself, so we leave it
+
+        Parameters
+        -----------
+        instance - object
+            The instance whose data we store
+
+        data - np.ndarray or other object
+            The data
+
+        Returns
+        -----------
+        bool - True if the data was stored
+        """
+
+        lock = self.get_lock(instance, self.name)
+
+        if not lock.acquire(blocking=False):
+            return False
+
+        try:
+            if getattr(instance, '_%s' % self.name, None) is not None:
+                return False
+
+            if getattr(instance, 'shard_spec', None) is not None:
+                data = instance.shard_data(self.name, data)
+
+            if getattr(instance, 'storage', 'memory') != 'memory':
+                data = instance.store_data(self.name, data)
+
+            setattr(instance, '_%s' % self.name, data)
+        finally:
+            lock.release()
+
+        if data is not None:
+            cache_budget.add(instance, self.name, get_nbytes(data))
+
+        return True
+
+    def invalidate(self, instance):
+        """
+        Drops the cached data of an instance, so the function runs again on next access
+
+        Parameters
+        -----------
+        instance - object
+            The instance whose cached data we drop
+        """
+
+        with self.get_lock(instance, self.name):
+            setattr(instance, '_%s' % self.name, None)
+
+        cache_budget.discard(instance, self.name)
+
+    @classmethod
+    def evict(cls, instance, name):
+        """
+        Drops cached data to free memory for the cache budget. If another thread holds the lock of the property, it is using the
+        data, so we leave it
+
+        Parameters
+        -----------
+        instance - object
+            The instance whose cached data we drop
+
+        name - str
+            The name of the cachedata property
+
+        Returns
+        -----------
+        bool - True if the data was dropped
+        """
+
+        lock = cls.get_lock(instance, name)
+
+        if not lock.acquire(blocking=False):
+            return False
+
+        try:
+            setattr(instance, '_%s' % name, None)
+        finally:
+            lock.release()
+
+        return True
+
+    @classmethod
+    def get_lock(cls, instance, name):
+        """
+        Returns the lock of a cachedata property of an instance, creating it if needed
+
+        Parameters
+        -----------
+        instance - object
+            The instance
+
+        name - str
+            The name of the cachedata property
+
+        Returns
+        -----------
+        threading.RLock - the lock
+        """
+
+        with cls.locks_lock:
+            locks = instance.__dict__.setdefault('_cachedata_locks', {})
+
+            if name not in locks:
+                locks[name] = threading.RLock()
+
+            return locks[name]
@@ -0,0 +1,207 @@
+import collections
+import numpy as np
+import time
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+PREFETCH_MODES = ['thread', 'process']
+
+_worker_dataset = None  # the dataset copy held by each prefetch worker process
+
+
+def init_prefetch_worker(dataset):
+    """
+    Initialises a prefetch worker process with its copy of the dataset
+
+    Parameters
+    -----------
+    dataset - mantraml.Dataset object
+        The dataset to draw batches from
+    """
+
+    global _worker_dataset
+    _worker_dataset = dataset
+
+
+def load_batch(dataset, indices, shared_memory=False):
+    """
+    Loads a batch from a dataset and times it. With shared_memory, the arrays of the batch are written to POSIX shared memory
+    blocks and we return descriptors of the blocks instead of the arrays, so the batch is not pickled between processes.
+
+    Parameters
+    -----------
+    dataset - mantraml.Dataset object
+        The dataset to draw the batch from; if None, we use the dataset of the worker process
+
+    indices - np.ndarray of ints
+        Indices of the examples in the batch
+
+    shared_memory - bool
+        If True, return shared memory descriptors of the batch arrays
+
+    Returns
+    -----------
+    tuple - (batch, producer time in seconds)
+    """
+
+    start_time = time.time()
+    batch = (dataset if dataset is not None else _worker_dataset).get_batch(indices)
+
+    if shared_memory:
+        batch = tuple(to_shared_memory(data) for data in batch)
+
+    return batch, time.time() - start_time
+
+
+def to_shared_memory(data):
+    """
+    Copies an array into a new shared memory block
+
+    Parameters
+    -----------
+    data - np.ndarray or None
+        The array to copy
+
+    Returns
+    -----------
+    tuple - (block name, shape, dtype str), or None if data is None
+    """
+
+    from multiprocessing import shared_memory
+
+    if data is None:
+        return None
+
+    data = np.asarray(data)
+    block = shared_memory.SharedMemory(create=True, size=max(data.nbytes, 1))
+    np.ndarray(data.shape, dtype=data.dtype, buffer=block.buf)[...] = data
+    block.close()
+
+    return block.name, data.shape, data.dtype.str
+
+
+def from_shared_memory(descriptor):
+    """
+    Copies an array out of a shared memory block made by to_shared_memory, and frees the block
+
+    Parameters
+    -----------
+    descriptor - tuple
+        (block name, shape, dtype str), or None
+
+    Returns
+    -----------
+    np.ndarray - the array, or None if the descriptor is None
+    """
+
+    from multiprocessing import shared_memory
+
+    if descriptor is None:
+        return None
+
+    name, shape, dtype = descriptor
+    block = shared_memory.SharedMemory(name=name)
+    data = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf).copy()
+    block.close()
+    block.unlink()
+
+    return data
+
+
+class Prefetcher:
+    """
+    This class loads the batches of a Dataset ahead of the training loop. Up to depth batches are in flight at once (a bounded queue),
+    and they are produced by a pool of worker threads or processes; batches come out in the order of batch_indices.
+
+    Timing counters are accumulated in dataset.prefetch_stats, which is written to the trial metadata:
+
+    - queue_wait_time - seconds the training loop waited for a batch
+    - producer_time - seconds the workers spent loading batches
+    """
+
+    def __init__(self, dataset, batch_indices, depth=2, workers=1, mode='thread', shared_memory=False):
+        """
+        Parameters
+        -----------
+        dataset - mantraml.Dataset object
+            The dataset to draw batches from
+
+        batch_indices - list of np.ndarrays
+            Indices of the examples in each batch, e.g. from Dataset.get_batch_indices
+
+        depth - int
+            The number of batches to load ahead
+
+        workers - int
+            The number of producer threads or processes
+
+        mode - str
+            'thread' or 'process'
+
+        shared_memory - bool
+            For process mode: pass batches back through POSIX shared memory rather than pickling them
+        """
+
+        if mode not in PREFETCH_MODES:
+            raise ValueError('The prefetch mode %s is unsupported; choose one of %s' % (mode, ', '.join(PREFETCH_MODES)))
+
+        self.dataset = dataset
+        self.batch_indices = batch_indices
+        self.depth = max(int(depth), 1)
+        self.workers = max(int(workers), 1)
+        self.mode = mode
+        self.shared_memory = shared_memory and mode == 'process'
+
+        if getattr(dataset, 'prefetch_stats', None) is None:
+            dataset.prefetch_stats = {'batches': 0, 'queue_wait_time': 0.0, 'producer_time': 0.0}
+
+    def __len__(self):
+        return len(self.batch_indices)
+
+    def __iter__(self):
+        if self.shared_memory:
+            # the workers must share our resource tracker, since blocks they create are freed here
+            from multiprocessing import resource_tracker
+            resource_tracker.ensure_running()
+
+        if self.mode == 'process':
+            executor = ProcessPoolExecutor(max_workers=self.workers, initializer=init_prefetch_worker, initargs=(self.dataset,))
+            dataset = None
+        else:
+            executor = ThreadPoolExecutor(max_workers=self.workers)
+            dataset = self.dataset
+
+        pending = collections.deque()
+        batch_indices = iter(self.batch_indices)
+        stats = self.dataset.prefetch_stats
+
+        try:
+            for indices in batch_indices:
+                pending.append(executor.submit(load_batch, dataset, indices, self.shared_memory))
+                if len(pending) >= self.depth:
+                    break
+
+            while pending:
+                start_time = time.time()
+                batch, producer_time = pending.popleft().result()
+                stats['queue_wait_time'] += time.time() - start_time
+                stats['producer_time'] += producer_time
+                stats['batches'] += 1
+
+                next_indices = next(batch_indices, None)
+
+                if next_indices is not None:
+                    pending.append(executor.submit(load_batch, dataset, next_indices, self.shared_memory))
+
+                if self.shared_memory:
+                    batch = tuple(from_shared_memory(descriptor) for descriptor in batch)
+
+                yield batch
+
+        finally:
+            for future in pending:
+                if not future.cancel() and self.shared_memory and future.exception() is None:
+                    for descriptor in future.result()[0]:
+                        from_shared_memory(descriptor)
+
+            executor.shutdown(wait=True)
@@ -0,0 +1,265 @@
+import hashlib
+import json
+import mmap
+import numpy as np
+import os
+
+
+def write_memmap(file_path, data):
+    """
+    This function writes an array to a raw binary file, with a sidecar header file (file_path + '.json') that records
+    the dtype and shape of the array. We write the header last, so a file without a header is an incomplete write.
+
+    Parameters
+    -----------
+    file_path - str
+        Location of the binary file
+
+    data - np.ndarray
+        The array to write
+
+    Returns
+    -----------
+    np.memmap - read-only memory map of the written file
+    """
+
+    data = np.asarray(data)
+    header = {'dtype': data.dtype.str, 'shape': list(data.shape)}
+
+    memmap = np.memmap('%s.tmp' % file_path, mode='w+', dtype=data.dtype, shape=data.shape)
+    memmap[:] = data
+    memmap.flush()
+    del memmap
+
+    os.replace('%s.tmp' % file_path, file_path)
+
+    with open('%s.json.tmp' % file_path, 'w') as header_file:
+        json.dump(header, header_file)
+
+    os.replace('%s.json.tmp' % file_path, '%s.json' % file_path)
+
+    return read_memmap(file_path)
+
+
+def read_memmap(file_path):
+    """
+    This function opens a binary file written by write_memmap as a read-only memory map
+
+    Parameters
+    -----------
+    file_path - str
+        Location of the binary file
+
+    Returns
+    -----------
+    np.memmap - read-only memory map of the file, or None if the file or its header does not exist
+    """
+
+    if not os.path.isfile(file_path) or not os.path.isfile('%s.json' % file_path):
+        return None
+
+    with open('%s.json' % file_path, 'r') as header_file:
+        header = json.load(header_file)
+
+    return np.memmap(file_path, mode='r', dtype=np.dtype(header['dtype']), shape=tuple(header['shape']))
+
+
+def can_memmap(data):
+    """
+    This function checks whether an array can be stored as a memory map - object arrays and empty arrays cannot
+
+    Parameters
+    -----------
+    data - object
+        The data to check
+
+    Returns
+    -----------
+    bool - True if the data can be stored as a memory map
+    """
+
+    return isinstance(data, np.ndarray) and not data.dtype.hasobject and data.size > 0
+
+
+SHARED_HEADER_SIZE = 1024  # bytes at the start of a shared memory block that hold the json header of the array
+_published_blocks = set()  # names of the shared memory blocks published by this process
+
+
+def get_shared_block_name(key, name):
+    """
+    This function returns the name of the shared memory block for a data attribute. POSIX shared memory names are short on some
+    platforms, so we use a prefix of the hash of the key and the attribute name
+
+    Parameters
+    -----------
+    key - str
+        The storage key of the data, e.g. derived from the dependency hash
+
+    name - str
+        The name of the data attribute, e.g. X or y
+
+    Returns
+    -----------
+    str - name of the shared memory block
+    """
+
+    return 'mantra_%s' % hashlib.sha256(('%s %s' % (key, name)).encode('utf-8')).hexdigest()[:20]
+
+
+def map_shared_block(block):
+    """
+    This function maps a shared memory block with a memory map of our own, and closes the block. Arrays built on the memory map
+    keep it open for as long as they exist, so we never close a block while arrays still view it
+
+    Parameters
+    -----------
+    block - multiprocessing.shared_memory.SharedMemory
+        The shared memory block
+
+    Returns
+    -----------
+    mmap.mmap - memory map of the block
+    """
+
+    block_map = mmap.mmap(block._fd, block.size)
+    block.close()
+
+    return block_map
+
+
+def publish_shared_array(block_name, data):
+    """
+    This function copies an array once into a new POSIX shared memory block, after a json header recording its dtype and shape. The
+    block stays available while this process runs, or until unpublish_shared_array is called
+
+    Parameters
+    -----------
+    block_name - str
+        Name of the shared memory block
+
+    data - np.ndarray
+        The array to publish
+
+    Returns
+    -----------
+    np.ndarray - read-only view of the array in shared memory, or None if a block with the name already exists
+    """
+
+    from multiprocessing import shared_memory
+
+    data = np.asarray(data)
+    header = json.dumps({'dtype': data.dtype.str, 'shape': list(data.shape)}).encode('utf-8')
+
+    try:
+        block = shared_memory.SharedMemory(name=block_name, create=True, size=SHARED_HEADER_SIZE + data.nbytes)
+    except FileExistsError:
+        return None
+
+    block_map = map_shared_block(block)
+    _published_blocks.add(block_name)
+
+    array = np.ndarray(data.shape, dtype=data.dtype, buffer=block_map, offset=SHARED_HEADER_SIZE)
+    array[...] = data
+
+    # we write the header last, so a block without a header is an incomplete publish
+    block_map[:len(header)] = header
+    array.flags.writeable = False
+
+    return array
+
+
+def attach_shared_array(block_name):
+    """
+    This function attaches to an array published by publish_shared_array, in this or another process, without copying it
+
+    Parameters
+    -----------
+    block_name - str
+        Name of the shared memory block
+
+    Returns
+    -----------
+    np.ndarray - read-only view of the array in shared memory, or None if there is no complete block with the name
+    """
+
+    from multiprocessing import shared_memory
+
+    try:
+        block = shared_memory.SharedMemory(name=block_name, track=False)
+    except TypeError:
+        # before Python 3.13, the resource tracker would unlink the block when this process exits, so we unregister it
+        from multiprocessing import resource_tracker
+
+        try:
+            block = shared_memory.SharedMemory(name=block_name)
+        except FileNotFoundError:
+            return None
+
+        if block_name not in _published_blocks:
+            resource_tracker.unregister(block._name, 'shared_memory')
+    except FileNotFoundError:
+        return None
+
+    block_map = map_shared_block(block)
+    header = block_map[:SHARED_HEADER_SIZE].rstrip(b'\x00')
+
+    if not header:
+        return None
+
+    header = json.loads(header.decode('utf-8'))
+
+    array = np.ndarray(tuple(header['shape']), dtype=np.dtype(header['dtype']), buffer=block_map, offset=SHARED_HEADER_SIZE)
+    array.flags.writeable = False
+
+    return array
+
+
+def unpublish_shared_array(block_name):
+    """
+    This function removes a shared memory block published by this process. Processes that attached to it keep their mapping
+
+    Parameters
+    -----------
+    block_name - str
+        Name of the shared memory block
+    """
+
+    from multiprocessing import shared_memory
+
+    if block_name not in _published_blocks:
+        return
+
+    _published_blocks.discard(block_name)
+
+    try:
+        block = shared_memory.SharedMemory(name=block_name)
+    except FileNotFoundError:
+        return
+
+    block.close()
+    block.unlink()
+
+
+def is_shared_array(data):
+    """
+    This function checks whether an array is a view of shared memory or a memory mapped file, rather than private memory
+
+    Parameters
+    -----------
+    data - object
+        The data to check
+
+    Returns
+    -----------
+    bool - True if the array is backed by shared memory or a file
+    """
+
+    if isinstance(data, np.memmap):
+        return True
+
+    base = getattr(data, 'base', None)
+
+    while isinstance(base, np.ndarray):
+        base = base.base
+
+    return isinstance(base, (memoryview, mmap.mmap))
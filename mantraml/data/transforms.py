@@ -0,0 +1,114 @@
+import numpy as np
+
+
+def center_crop_images(images):
+    """
+    Center crops a batch of images to a square, by cutting the longer side. The crop is a view of the batch, so no pixels are copied.
+
+    Parameters
+    -----------
+    images - np.ndarray
+        Batch of images with shape (N, H, W) or (N, H, W, C)
+
+    Returns
+    -----------
+    np.ndarray - view of the cropped images
+    """
+
+    height, width = images.shape[1:3]
+
+    if height > width:
+        divisor = int((height - width) / 2)
+        if divisor:
+            images = images[:, divisor:-divisor]
+    elif width > height:
+        divisor = int((width - height) / 2)
+        if divisor:
+            images = images[:, :, divisor:-divisor]
+
+    return images
+
+
+def resize_images(images, resize_height, resize_width, out):
+    """
+    Resizes a batch of images with bilinear interpolation, writing the result to out. When we shrink an image by a factor of two or
+    more, we first average blocks of pixels, so the result is not aliased.
+
+    Parameters
+    -----------
+    images - np.ndarray
+        Batch of images with shape (N, H, W) or (N, H, W, C)
+
+    resize_height - int
+        Height of the resized images in pixels
+
+    resize_width - int
+        Width of the resized images in pixels
+
+    out - np.ndarray
+        Float array with shape (N, resize_height, resize_width) + images.shape[3:] to write the resized images to
+
+    Returns
+    -----------
+    np.ndarray - out
+    """
+
+    height, width = images.shape[1:3]
+    block_height, block_width = max(height // resize_height, 1), max(width // resize_width, 1)
+
+    if block_height > 1 or block_width > 1:
+        height, width = (height // block_height) * block_height, (width // block_width) * block_width
+        blocks = images[:, :height, :width].reshape((images.shape[0], height // block_height, block_height,
+            width // block_width, block_width) + images.shape[3:])
+        images = blocks.mean(axis=(2, 4), dtype=out.dtype)
+        height, width = images.shape[1:3]
+
+    if (height, width) == (resize_height, resize_width):
+        out[...] = images
+        return out
+
+    # source coordinates of the pixel centres of the resized images
+    rows = np.clip((np.arange(resize_height) + 0.5) * height / resize_height - 0.5, 0, height - 1)
+    columns = np.clip((np.arange(resize_width) + 0.5) * width / resize_width - 0.5, 0, width - 1)
+
+    top, left = rows.astype(int), columns.astype(int)
+    bottom, right = np.minimum(top + 1, height - 1), np.minimum(left + 1, width - 1)
+
+    extra_dims = (1,) * (images.ndim - 3)
+    row_weights = (rows - top).astype(out.dtype).reshape((1, -1, 1) + extra_dims)
+    column_weights = (columns - left).astype(out.dtype).reshape((1, 1, -1) + extra_dims)
+
+    top_rows, bottom_rows = images[:, top], images[:, bottom]
+
+    # interpolate along the columns of the top rows into out, and of the bottom rows into a temporary, then between them
+    np.multiply(top_rows[:, :, left], 1 - column_weights, out=out)
+    out += top_rows[:, :, right] * column_weights
+
+    bottom_values = bottom_rows[:, :, left] * (1 - column_weights)
+    bottom_values += bottom_rows[:, :, right] * column_weights
+
+    bottom_values -= out
+    bottom_values *= row_weights
+    out += bottom_values
+
+    return out
+
+
+def normalize_images(images):
+    """
+    Normalizes a batch of float images from [0, 255] to [-1, 1], in place
+
+    Parameters
+    -----------
+    images - np.ndarray
+        Float array of images
+
+    Returns
+    -----------
+    np.ndarray - images
+    """
+
+    images *= 1 / 127.5
+    images -= 1.
+
+    return images
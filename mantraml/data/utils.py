@@ -1,3 +1,113 @@
 import hashlib
+import numpy as np
 
-BUF_SIZE = 65536  # read files in 64kb chunks
\ No newline at end of file
+from PIL import Image
+
+BUF_SIZE = 65536  # read files in 64kb chunks
+
+
+def indices_to_slice(indices):
+    """
+    Converts an array of indices to an equivalent slice if the indices are an increasing range with a constant step, e.g. a
+    contiguous range. Indexing an np.ndarray with a slice returns a view rather than a copy.
+
+    Parameters
+    -----------
+    indices - list or np.ndarray of ints
+        The indices to convert
+
+    Returns
+    -----------
+    slice - equivalent to the indices, or None if the indices are not an increasing range with a constant step
+    """
+
+    indices = np.asarray(indices)
+
+    if indices.ndim != 1 or indices.dtype.kind not in 'iu':
+        return None
+
+    if indices.size == 0:
+        return slice(0, 0)
+
+    start = int(indices[0])
+    step = int(indices[1]) - start if indices.size > 1 else 1
+
+    if start < 0 or step < 1 or not np.array_equal(indices, np.arange(start, start + step * indices.size, step)):
+        return None
+
+    if step == 1:
+        return slice(start, start + indices.size)
+
+    return slice(start, int(indices[-1]) + 1, step)
+
+
+def get_image_channels(image):
+    """
+    Finds the number of color channels of an image from its header, without decoding the pixel data. Palette images count as
+    RGB, or RGBA if they have transparency, as they are converted to these when decoded.
+
+    Parameters
+    -----------
+    image - str or file object
+        Location of the image, or a binary file object containing it
+
+    Returns
+    -----------
+    int - the number of color channels
+    """
+
+    with Image.open(image) as image_file:
+        if image_file.mode == 'P':
+            return 4 if 'transparency' in image_file.info else 3
+
+        return len(image_file.getbands())
+
+
+def sample_evenly(items, n_samples):
+    """
+    Takes a sample of up to n_samples items, evenly spaced through a list
+
+    Parameters
+    -----------
+    items - list
+        The items to sample
+
+    n_samples - int
+        The maximum number of items in the sample
+
+    Returns
+    -----------
+    list - the sampled items, in their order in items
+    """
+
+    if len(items) <= n_samples:
+        return list(items)
+
+    return [items[index] for index in np.unique(np.linspace(0, len(items) - 1, n_samples).astype(int))]
+
+
+def get_shard_bounds(n_items, num_shards, index):
+    """
+    Finds the range of items in a shard: the items are split into num_shards contiguous shards whose sizes differ by at most
+    one, as np.array_split would split them
+
+    Parameters
+    -----------
+    n_items - int
+        The number of items to split
+
+    num_shards - int
+        The number of shards
+
+    index - int
+        The index of the shard
+
+    Returns
+    -----------
+    tuple - (start, stop) of the shard
+    """
+
+    shard_size, remainder = divmod(n_items, num_shards)
+    start = index * shard_size + min(index, remainder)
+
+    return start, start + shard_size + (1 if index < remainder else 0)
@@ -1,4 +1,5 @@
 import datetime
+import itertools
 import os
 from termcolor import colored
 
@@ -22,6 +23,10 @@ class MantraModel:
     batch_size = 64
     epochs = 200
 
+    # the version of the weights being trained: a new version for each training, unique across models
+    model_version = None
+    training_versions = itertools.count(1)
+
     def configure_core_arguments(self, args):
         """
         This method adds core training attributes from an argument parser namespace (args) such as the number of epochs, the batch size, and more
@@ -51,6 +56,19 @@ class MantraModel:
         else:
             self.save_best_only = False
 
+    def start_training(self):
+        """
+        This method marks the start of a training: the model gets a new version, so evaluations cached for an earlier training
+        (see mantraml.tasks.get_evaluation_key) are not reused for the new weights
+
+        Returns
+        -----------
+        int - the new model version
+        """
+
+        self.model_version = next(MantraModel.training_versions)
+        return self.model_version
+
     def end_of_epoch_message(self, epoch, message):
         """
         A cute method for printing a message at the end of an epoch
@@ -151,20 +169,36 @@ class MantraModel:
             yaml_content['validation_loss_history'] = []
 
         if self.task:
-            if self.save_best_only:
+            latest_loss_subsampled = bool(getattr(self.task, 'latest_loss_subsampled', False))
+
+            # the best loss is only set by full evaluations, so until the first one we report the latest loss
+            if self.save_best_only and getattr(self.task, 'best_loss', None) is not None:
                 yaml_content['validation_loss'] = float(self.task.best_loss)
+                yaml_content['validation_loss_subsampled'] = False
 
-                if hasattr(self.task, 'secondary_metrics'):
+                if getattr(self.task, 'best_secondary_metrics_values', None) is not None:
                     yaml_content['secondary_metrics'] = self.task.best_secondary_metrics_values
 
             else:
                 yaml_content['validation_loss'] = float(self.task.latest_loss)
+                yaml_content['validation_loss_subsampled'] = latest_loss_subsampled
         
-                if hasattr(self.task, 'secondary_metrics'):
+                if getattr(self.task, 'secondary_metrics_values', None) is not None:
                     yaml_content['secondary_metrics'] = self.task.secondary_metrics_values
 
             yaml_content['validation_loss_history'].append(float(self.task.latest_loss))
 
+            # whether each loss in the history was evaluated on the validation subsample rather than the full validation data
+            if 'validation_loss_subsampled_history' not in yaml_content:
+                yaml_content['validation_loss_subsampled_history'] = [False] * (len(yaml_content['validation_loss_history']) - 1)
+
+            yaml_content['validation_loss_subsampled_history'].append(latest_loss_subsampled)
+
+        prefetch_stats = getattr(getattr(self, 'data', None), 'prefetch_stats', None)
+
+        if prefetch_stats:
+            yaml_content['data_prefetch'] = {stat: float(value) for stat, value in prefetch_stats.items()}
+
         return yaml.dump(yaml_content, default_flow_style=False)
 
 
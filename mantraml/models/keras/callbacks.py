@@ -1,6 +1,8 @@
 import os
 import tensorflow as tf
 
+from mantraml.tasks.evaluation import run_evaluation
+
 
 class EvaluateTask(tf.keras.callbacks.Callback):
     """
@@ -14,18 +16,7 @@ class EvaluateTask(tf.keras.callbacks.Callback):
     def on_epoch_end(self, epoch, logs={}):
 
         if self.mantra_model.task:
-            self.mantra_model.task.latest_loss = self.mantra_model.task.evaluate(self.mantra_model)
-
-            print('%s: %s' % (self.mantra_model.task.evaluation_name, self.mantra_model.task.latest_loss))
-
-            if hasattr(self.mantra_model.task, 'secondary_metrics'):
-
-                self.mantra_model.task.secondary_metrics_values = {}
-
-                for metric in self.mantra_model.task.secondary_metrics:
-                    metric_result = getattr(self.mantra_model.task, metric)(self.mantra_model)
-                    self.mantra_model.task.secondary_metrics_values[metric] = float(metric_result)
-                    print('%s: %s' % (metric.capitalize(), metric_result))
+            run_evaluation(self.mantra_model, epoch)
 
 
 class ModelCheckpoint(tf.keras.callbacks.Callback):
@@ -44,15 +35,14 @@ class ModelCheckpoint(tf.keras.callbacks.Callback):
             os.makedirs(checkpoint_dir)
 
         if self.mantra_model.task:
-            self.mantra_model.task.latest_loss = self.mantra_model.task.evaluate(self.mantra_model)
+            run_evaluation(self.mantra_model, epoch)
 
             if not hasattr(self.mantra_model.task, 'best_loss'):
                 self.mantra_model.task.best_loss = None
-                self.mantra_model.task.best_loss = self.mantra_model.task.latest_loss
-                self.mantra_model.task.best_secondary_metrics_values = self.mantra_model.task.secondary_metrics_values.copy()
 
+            # losses evaluated on the validation subsample are not compared with the best loss, which is always a full evaluation
             if self.mantra_model.save_best_only:
-                if self.mantra_model.task.latest_loss < self.mantra_model.task.best_loss:
+                if not self.mantra_model.task.latest_loss_subsampled and (self.mantra_model.task.best_loss is None or self.mantra_model.task.latest_loss < self.mantra_model.task.best_loss):
                     self.mantra_model.model.save('%smodel_weights.h5' % checkpoint_dir)
                     self.mantra_model.task.best_loss = self.mantra_model.task.latest_loss
                     self.mantra_model.task.best_secondary_metrics_values = self.mantra_model.task.secondary_metrics_values.copy()
@@ -0,0 +1,71 @@
+import numpy as np
+import tensorflow as tf
+
+
+class DatasetSequence(tf.keras.utils.Sequence):
+    """
+    Wraps the minibatches of a Mantra Dataset as a Keras Sequence, e.g. for model.fit_generator. Batches are read (or decoded)
+    from the Dataset when Keras asks for them
+    """
+
+    def __init__(self, dataset, batch_size, shuffle=False, seed=None, drop_last=False):
+        """
+        Parameters
+        -----------
+        dataset - mantraml.Dataset object
+            The dataset to draw batches from
+
+        batch_size - int
+            The number of examples in each batch
+
+        shuffle - bool
+            If True, the examples are reshuffled at the end of each epoch
+
+        seed - int
+            Seed for the shuffle; the seed for each epoch is seed + epoch
+
+        drop_last - bool
+            If True, a final batch smaller than batch_size is dropped
+        """
+
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.drop_last = drop_last
+        self.epoch = 0
+
+        self.set_augmentation_epoch()
+        self.batch_indices = self.get_batch_indices()
+
+    def __len__(self):
+        return len(self.batch_indices)
+
+    def __getitem__(self, index):
+        X, y = self.dataset.get_batch(self.batch_indices[index])
+
+        if y is None:
+            return np.asarray(X)
+
+        return np.asarray(X), np.asarray(y)
+
+    def get_batch_indices(self):
+        seed = None if self.seed is None else self.seed + self.epoch
+        return self.dataset.get_batch_indices(self.batch_size, shuffle=self.shuffle, seed=seed, drop_last=self.drop_last)
+
+    def set_augmentation_epoch(self):
+        """
+        Sets the epoch of the dataset's augmentation pipeline, if it has one, so a seeded pipeline augments each epoch differently
+        """
+
+        augmentation = getattr(self.dataset, 'augmentation', None)
+
+        if augmentation is not None:
+            augmentation.epoch = self.epoch
+
+    def on_epoch_end(self):
+        self.epoch += 1
+        self.set_augmentation_epoch()
+
+        if self.shuffle:
+            self.batch_indices = self.get_batch_indices()
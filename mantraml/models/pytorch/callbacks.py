@@ -2,31 +2,20 @@ import matplotlib.pyplot as plt
 import os
 import torch
 
+from mantraml.tasks.evaluation import run_evaluation
 
-class EvaluateTask:
-
-    def __init__(self, mantra_model):
-
-        task = mantra_model.task
-
-        if task:
-            task.latest_loss = task.evaluate(mantra_model)
 
-            print('%s: %s' % (task.evaluation_name, task.latest_loss))
-
-            if hasattr(mantra_model.task, 'secondary_metrics'):
+class EvaluateTask:
 
-                task.secondary_metrics_values = {}
+    def __init__(self, mantra_model, epoch=None):
 
-                for met in task.secondary_metrics:
-                    metric_result = getattr(task, met)(mantra_model)
-                    task.secondary_metrics_values[met] = float(metric_result)
-                    print('%s: %s' % (met.capitalize(), metric_result))
+        if mantra_model.task:
+            run_evaluation(mantra_model, epoch)
 
 
 class ModelCheckpoint:
 
-    def __init__(self, mantra_model, torch_model):
+    def __init__(self, mantra_model, torch_model, epoch=None):
 
         checkpoint_dir = '%s/trials/%s/checkpoint/' % (os.getcwd(), mantra_model.trial.trial_folder_name)
 
@@ -34,14 +23,14 @@ class ModelCheckpoint:
             os.makedirs(checkpoint_dir)
 
         if mantra_model.task:
-            mantra_model.task.latest_loss = mantra_model.task.evaluate(self)
+            run_evaluation(mantra_model, epoch)
 
             if not hasattr(mantra_model.task, 'best_loss'):
                 mantra_model.task.best_loss = None
-                mantra_model.task.best_loss = mantra_model.task.latest_loss
 
+            # losses evaluated on the validation subsample are not compared with the best loss, which is always a full evaluation
             if mantra_model.save_best_only:
-                if mantra_model.task.latest_loss < mantra_model.task.best_loss:
+                if not mantra_model.task.latest_loss_subsampled and (mantra_model.task.best_loss is None or mantra_model.task.latest_loss < mantra_model.task.best_loss):
                     torch.save(torch_model.state_dict(), '%s/trials/%s/checkpoint/model_weights.pt' % (os.getcwd(), mantra_model.trial.trial_folder_name))
                     mantra_model.task.best_loss = mantra_model.task.latest_loss
             else:
@@ -0,0 +1,106 @@
+import numpy as np
+import torch
+
+from mantraml.data.prefetch import Prefetcher
+
+
+class DatasetIterable(torch.utils.data.IterableDataset):
+    """
+    Wraps the minibatches of a Mantra Dataset as a PyTorch IterableDataset. Each item is a full batch, so use it with
+    torch.utils.data.DataLoader(batch_size=None). With several DataLoader workers, the batches are split between the workers
+    """
+
+    def __init__(self, dataset, batch_size, shuffle=False, seed=None, drop_last=False, prefetch=0, prefetch_workers=1, pin_memory=False):
+        """
+        Parameters
+        -----------
+        dataset - mantraml.Dataset object
+            The dataset to draw batches from
+
+        batch_size - int
+            The number of examples in each batch
+
+        shuffle - bool
+            If True, the examples are visited in a random order
+
+        seed - int
+            Seed for the shuffle; the seed for each epoch is seed + epoch. Each full pass over the iterable advances the epoch, and
+            set_epoch sets it, e.g. with DataLoader workers, whose copies of the iterable do not advance the epoch
+
+        drop_last - bool
+            If True, a final batch smaller than batch_size is dropped
+
+        prefetch - int
+            If greater than zero, the number of batches to load ahead in background threads
+
+        prefetch_workers - int
+            The number of background threads that load batches
+
+        pin_memory - bool
+            If True, the batch tensors are copied into page-locked memory for faster transfer to the GPU
+        """
+
+        super(DatasetIterable, self).__init__()
+
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.drop_last = drop_last
+        self.prefetch = prefetch
+        self.prefetch_workers = prefetch_workers
+        self.pin_memory = pin_memory
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        """
+        Sets the epoch number, which changes the shuffle order when a seed is given, and the augmentations of a seeded augmentation
+        pipeline
+        """
+
+        self.epoch = epoch
+        self.set_augmentation_epoch()
+
+    def set_augmentation_epoch(self):
+        """
+        Sets the epoch of the dataset's augmentation pipeline, if it has one, so a seeded pipeline augments each epoch differently
+        """
+
+        augmentation = getattr(self.dataset, 'augmentation', None)
+
+        if augmentation is not None:
+            augmentation.epoch = self.epoch
+
+    def __iter__(self):
+        # DataLoader workers iterate over copies of the dataset, so we set the epoch of the augmentation in each of them
+        self.set_augmentation_epoch()
+
+        seed = None if self.seed is None else self.seed + self.epoch
+        batch_indices = self.dataset.get_batch_indices(self.batch_size, shuffle=self.shuffle, seed=seed, drop_last=self.drop_last)
+
+        worker_info = torch.utils.data.get_worker_info()
+
+        if worker_info is not None:
+            batch_indices = batch_indices[worker_info.id::worker_info.num_workers]
+
+        if self.prefetch:
+            batches = Prefetcher(self.dataset, batch_indices, depth=self.prefetch, workers=self.prefetch_workers)
+        else:
+            batches = (self.dataset.get_batch(indices) for indices in batch_indices)
+
+        for X, y in batches:
+            if y is None:
+                yield self.to_tensor(X)
+            else:
+                yield self.to_tensor(X), self.to_tensor(y)
+
+        self.epoch += 1
+
+    def to_tensor(self, data):
+        # memory mapped data is read-only, so we copy it into a writeable array first
+        tensor = torch.from_numpy(np.require(data, requirements=['C', 'W']))
+
+        if self.pin_memory:
+            return tensor.pin_memory()
+
+        return tensor
@@ -2,29 +2,20 @@ import matplotlib.pyplot as plt
 import os
 import tensorflow as tf
 
+from mantraml.tasks.evaluation import run_evaluation
+
 
 class EvaluateTask:
 
-    def __init__(self, mantra_model):
+    def __init__(self, mantra_model, epoch=None):
 
         if mantra_model.task:
-            mantra_model.task.latest_loss = mantra_model.task.evaluate(mantra_model)
-
-            print('%s: %s' % (mantra_model.task.evaluation_name, mantra_model.task.latest_loss))
-
-            if hasattr(mantra_model.task, 'secondary_metrics'):
-
-                mantra_model.task.secondary_metrics_values = {}
-
-                for metric in mantra_model.task.secondary_metrics:
-                    metric_result = getattr(mantra_model.task, metric)(mantra_model)
-                    mantra_model.task.secondary_metrics_values[metric] = float(metric_result)
-                    print('%s: %s' % (metric.capitalize(), metric_result))
+            run_evaluation(mantra_model, epoch)
 
 
 class ModelCheckpoint:
 
-    def __init__(self, mantra_model, session):
+    def __init__(self, mantra_model, session, epoch=None):
 
         checkpoint_dir = '%s/trials/%s/checkpoint/' % (os.getcwd(), mantra_model.trial.trial_folder_name)
 
@@ -34,14 +25,14 @@ class ModelCheckpoint:
         saver = tf.train.Saver()  
 
         if mantra_model.task:
-            mantra_model.task.latest_loss = mantra_model.task.evaluate(self)
+            run_evaluation(mantra_model, epoch)
 
             if not hasattr(mantra_model.task, 'best_loss'):
                 mantra_model.task.best_loss = None
-                mantra_model.task.best_loss = mantra_model.task.latest_loss
 
+            # losses evaluated on the validation subsample are not compared with the best loss, which is always a full evaluation
             if mantra_model.save_best_only:
-                if mantra_model.task.latest_loss < mantra_model.task.best_loss:
+                if not mantra_model.task.latest_loss_subsampled and (mantra_model.task.best_loss is None or mantra_model.task.latest_loss < mantra_model.task.best_loss):
                     saver.save(session, '%s/trials/%s/checkpoint/' % (os.getcwd(), mantra_model.trial.trial_folder_name))
                     mantra_model.task.best_loss = mantra_model.task.latest_loss
             else:
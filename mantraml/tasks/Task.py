@@ -1,3 +1,18 @@
+import glob
+import numpy as np
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+
+from mantraml.core.hashing.MantraHashed import MantraHashed
+from mantraml.data.Dataset import Dataset
+from mantraml.data.utils import indices_to_slice
+
+from .evaluation import get_evaluation_metric
+from .splits import SPLIT_METHODS, IndexedSplit, assign_grouped_splits, assign_random_splits, assign_stratified_splits
+
+EVALUATION_BATCH_SIZE = 256
+
 
 class Task:
     """
@@ -32,6 +47,50 @@ class Task:
         if not hasattr(self, 'test_indices'):
             self.test_indices = None
 
+        # if True, splits from indices that are not a range are IndexedSplit objects, which gather rows per batch rather than copying the subset
+        if not hasattr(self, 'lazy_splits'):
+            self.lazy_splits = False
+
+        # name -> mantraml.tasks.metrics.Metric evaluated in batches over the validation data; the first is the evaluation metric
+        if not hasattr(self, 'metrics'):
+            self.metrics = None
+
+        if not hasattr(self, 'evaluation_batch_size'):
+            self.evaluation_batch_size = EVALUATION_BATCH_SIZE
+
+        # validation_subsample - fraction (float) or number (int) of validation examples to evaluate on at most epochs, chosen with
+        # validation_seed; the full validation data is evaluated every full_validation_every epochs, and at the last epoch
+        if not hasattr(self, 'validation_subsample'):
+            self.validation_subsample = None
+
+        if not hasattr(self, 'validation_seed'):
+            self.validation_seed = 0
+
+        if not hasattr(self, 'full_validation_every'):
+            self.full_validation_every = None
+
+        self.subsample_validation = False
+        self._validation_subsample = None
+
+        # split_method - 'random', 'stratified' (by data.y) or 'grouped' (by the group_column of the data) splits by the fractions
+        # in training_split, or into n_folds folds, with fold as the validation data; the splits are cached in the data's raw/.cache
+        if not hasattr(self, 'split_method'):
+            self.split_method = None
+
+        if not hasattr(self, 'split_seed'):
+            self.split_seed = 0
+
+        if not hasattr(self, 'n_folds'):
+            self.n_folds = None
+
+        if not hasattr(self, 'fold'):
+            self.fold = 0
+
+        if not hasattr(self, 'group_column'):
+            self.group_column = None
+
+        self.split_configured = False
+
         self._X_train = None
         self._y_train = None
         self._X_val = None
@@ -39,6 +98,12 @@ class Task:
         self._X_test = None
         self._y_test = None
 
+        # predictions on the validation data are cached by key during an evaluation (see mantraml.tasks.evaluation.run_evaluation)
+        self.prediction_key = None
+        self.evaluation_key = None
+        self._predictions = None
+        self._predictions_key = None
+
     @property
     def X_train(self):
         """
@@ -76,13 +141,16 @@ class Task:
     @property
     def X_val(self):
         """
-        Obtains the validation data features X
+        Obtains the validation data features X; during a subsampled evaluation, the features of the validation subsample
 
         Returns
         --------
         np.ndarray of feature data        
         """
 
+        if self.subsample_validation:
+            return self.get_validation_subsample()[0]
+
         if self._X_val is not None:
             return self._X_val
 
@@ -93,13 +161,16 @@ class Task:
     @property
     def y_val(self):
         """
-        Obtains the validation data labels y
+        Obtains the validation data labels y; during a subsampled evaluation, the labels of the validation subsample
 
         Returns
         --------
         np.ndarray of label data        
         """
 
+        if self.subsample_validation:
+            return self.get_validation_subsample()[1]
+
         if self._y_val is not None:
             return self._y_val
 
@@ -141,6 +212,451 @@ class Task:
 
         return self._y_test
 
+    def prepare_inputs(self, X):
+        """
+        Prepares inputs from the Dataset for the task, e.g. normalizes images that the Dataset stores as uint8 pixels. The splits
+        apply this to their rows as they are indexed (see get_split_inputs)
+
+        Parameters
+        -----------
+        X - np.ndarray
+            Inputs from the Dataset
+
+        Returns
+        --------
+        np.ndarray of feature data
+        """
+
+        if hasattr(self.data, 'prepare_batch'):
+            return self.data.prepare_batch(X)
+
+        return X
+
+    def prepares_inputs(self):
+        """
+        Checks whether the Dataset prepares its inputs, i.e. overrides prepare_batch, e.g. an ImageDataset that stores uint8 pixels
+
+        Returns
+        --------
+        bool - True if inputs from the Dataset need preparing
+        """
+
+        if not hasattr(self.data, 'prepare_batch'):
+            return False
+
+        return getattr(self.data.prepare_batch, '__func__', None) is not Dataset.prepare_batch
+
+    def get_split_inputs(self, rows):
+        """
+        Gets the inputs of a split from the Dataset. If the Dataset prepares its inputs, the split is an IndexedSplit that prepares
+        its rows as they are indexed, so the split is always served prepared without being copied whole; otherwise a slice of rows
+        is a view of the data, and other rows are copied
+
+        Parameters
+        -----------
+        rows - slice or np.ndarray of ints
+            The rows of the split
+
+        Returns
+        --------
+        np.ndarray or IndexedSplit of feature data
+        """
+
+        if not self.prepares_inputs():
+            return self.data.X[rows]
+
+        X = self.data.X
+        indices = np.arange(*rows.indices(len(X))) if isinstance(rows, slice) else rows
+
+        return IndexedSplit(X, indices, prepare=self.prepare_inputs)
+
+    def predict_inputs(self, model, X):
+        """
+        Predicts with a model on inputs of a split. If the split prepares its rows as they are indexed, the model predicts on one
+        prepared batch of evaluation_batch_size examples at a time, so the split is not prepared whole
+
+        Parameters
+        -----------
+        model - MantraModel object
+            The model to predict with
+
+        X - np.ndarray or IndexedSplit
+            Inputs of a split
+
+        Returns
+        --------
+        np.ndarray of predictions
+        """
+
+        if not isinstance(X, IndexedSplit) or X.prepare is None or not self.prepares_inputs() or not len(X):
+            return model.predict(X)
+
+        batch_size = self.evaluation_batch_size
+
+        return np.concatenate([model.predict(X[start:start + batch_size]) for start in range(0, len(X), batch_size)])
+
+    def evaluate(self, model):
+        """
+        Evaluates a model on the validation data. Tasks either override this method, or set self.metrics, in which case this
+        returns the first of the metrics evaluated in batches (see evaluate_batches)
+
+        Parameters
+        -----------
+        model - MantraModel object
+            The model to evaluate
+
+        Returns
+        --------
+        float - the evaluation metric
+        """
+
+        if not self.metrics:
+            raise NotImplementedError('A task must implement evaluate, or set metrics')
+
+        return get_evaluation_metric(self.evaluate_batches(model))
+
+    def evaluate_batches(self, model, metrics=None, batch_size=None):
+        """
+        Evaluates metrics on the validation data in batches, so the model predicts on one batch at a time rather than on the whole
+        of X_val. Each batch is loaded in a background thread while the model predicts on the previous batch, and each metric
+        accumulates its state batch by batch (see mantraml.tasks.metrics.Metric)
+
+        Parameters
+        -----------
+        model - MantraModel object
+            The model to evaluate
+
+        metrics - dict
+            name -> Metric to evaluate; if None, self.metrics
+
+        batch_size - int
+            The number of examples in each batch; if None, self.evaluation_batch_size
+
+        Returns
+        --------
+        dict - name -> result of each metric
+        """
+
+        metrics = metrics if metrics is not None else self.metrics
+        batch_size = batch_size or self.evaluation_batch_size
+        X, y = self.X_val, self.y_val
+
+        if X is None or not len(X):
+            raise ValueError('The task has no validation data to evaluate on; set training_split, validation_indices or split_method')
+
+        for metric in metrics.values():
+            metric.reset()
+
+        def load_batch(start):
+            batch_X = X[start:start + batch_size]
+            batch_X = np.array(batch_X) if isinstance(batch_X, np.memmap) else batch_X
+            return batch_X, (y[start:start + batch_size] if y is not None else None)
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            starts = range(0, len(X), batch_size)
+            next_batch = executor.submit(load_batch, starts[0]) if len(starts) else None
+
+            for start_no in range(len(starts)):
+                batch_X, batch_y = next_batch.result()
+
+                if start_no + 1 < len(starts):
+                    next_batch = executor.submit(load_batch, starts[start_no + 1])
+
+                predictions = model.predict(batch_X)
+
+                for metric in metrics.values():
+                    metric.update(batch_y, predictions)
+
+        return {name: metric.result() for name, metric in metrics.items()}
+
+    def is_subsampled_evaluation(self, epoch=None, epochs=None):
+        """
+        Checks whether an evaluation should use the validation subsample rather than the full validation data
+
+        Parameters
+        -----------
+        epoch - int
+            The epoch number (zero indexed); None if it is unknown, in which case we evaluate the full data
+
+        epochs - int
+            The number of epochs of training; the last epoch evaluates the full data
+
+        Returns
+        --------
+        bool - True if the evaluation should use the subsample
+        """
+
+        if self.validation_subsample is None or epoch is None:
+            return False
+
+        if epochs is not None and epoch + 1 >= epochs:
+            return False
+
+        if self.full_validation_every and (epoch + 1) % self.full_validation_every == 0:
+            return False
+
+        return True
+
+    def get_validation_subsample_indices(self, n_examples):
+        """
+        Chooses the positions of the validation subsample in the validation data. The choice only depends on validation_seed, so
+        every subsampled evaluation uses the same examples
+
+        Parameters
+        -----------
+        n_examples - int
+            The number of validation examples
+
+        Returns
+        --------
+        np.ndarray of ints - sorted positions of the subsample
+        """
+
+        if isinstance(self.validation_subsample, float):
+            n_subsample = int(round(self.validation_subsample * n_examples))
+        else:
+            n_subsample = int(self.validation_subsample)
+
+        n_subsample = min(max(n_subsample, 1), n_examples)
+
+        return np.sort(np.random.RandomState(self.validation_seed).choice(n_examples, n_subsample, replace=False))
+
+    def get_validation_subsample(self):
+        """
+        Gets the validation subsample; it is a copy of the subsampled rows, unless they are a range of the validation data
+
+        Returns
+        --------
+        tuple - (X subsample, y subsample or None)
+        """
+
+        if self._validation_subsample is not None:
+            return self._validation_subsample
+
+        X, y = self.get_validation_data()
+        positions = self.get_validation_subsample_indices(len(X))
+        positions_slice = indices_to_slice(positions)
+
+        if positions_slice is not None:
+            positions = positions_slice
+
+        self._validation_subsample = X[positions], (y[positions] if y is not None else None)
+
+        return self._validation_subsample
+
+    def predict(self, model):
+        """
+        Gets the predictions of a model on the validation data. During an evaluation, the predictions are made once and shared by
+        evaluate and the secondary metrics; callers must not modify them in place
+
+        Parameters
+        -----------
+        model - MantraModel object
+            The model to predict with
+
+        Returns
+        --------
+        np.ndarray of predictions
+        """
+
+        if self.prediction_key is None:
+            return self.predict_inputs(model, self.X_val)
+
+        if self._predictions is None or self._predictions_key != self.prediction_key:
+            self._predictions = self.predict_inputs(model, self.X_val)
+            self._predictions_key = self.prediction_key
+
+        return self._predictions
+
+    def clear_predictions(self):
+        """
+        Frees the cached predictions
+        """
+
+        self._predictions = None
+        self._predictions_key = None
+
+    def uses_sequential_split(self):
+        """
+        Checks whether the data is split sequentially by the fractions in training_split
+
+        Returns
+        --------
+        bool - True if the data is split sequentially
+        """
+
+        return self.training_split is not None and self.split_method is None
+
+    def configure_split(self):
+        """
+        Sets the training, validation and test indices from the split method, once. The split of each example is loaded from
+        the split cache if it exists, and otherwise generated and cached
+
+        Returns
+        --------
+        void - sets self.training_indices, self.validation_indices and self.test_indices
+        """
+
+        if self.split_method is None or self.split_configured:
+            return
+
+        splits = self.load_split_assignments()
+
+        if splits is None:
+            splits = self.get_split_assignments()
+            self.save_split_assignments(splits)
+
+        if self.n_folds:
+            self.training_indices = np.flatnonzero(splits != self.fold)
+            self.validation_indices = np.flatnonzero(splits == self.fold)
+            self.test_indices = np.array([], dtype=np.int64)
+        else:
+            self.training_indices, self.validation_indices, self.test_indices = [np.flatnonzero(splits == split) for split in range(3)]
+
+        self.split_configured = True
+
+    def get_split_assignments(self):
+        """
+        Assigns each example of the data to a split (training 0, validation 1, test 2) or, for k-fold splits, to a fold
+
+        Returns
+        --------
+        np.ndarray of ints - the split or fold of each example
+        """
+
+        if self.split_method not in SPLIT_METHODS:
+            raise ValueError('The split method %s is unsupported; choose one of %s' % (self.split_method, ', '.join(SPLIT_METHODS)))
+
+        if not self.n_folds and self.training_split is None:
+            raise ValueError('A split method needs training_split fractions, or n_folds')
+
+        split_kwargs = {'fractions': self.training_split, 'n_folds': self.n_folds, 'seed': self.split_seed}
+
+        if self.split_method == 'stratified':
+            if self.data.y is None:
+                raise ValueError('A stratified split needs labels y in the data')
+
+            return assign_stratified_splits(self.data.y, **split_kwargs)
+
+        elif self.split_method == 'grouped':
+            if self.group_column is None:
+                raise ValueError('A grouped split needs a group_column')
+
+            return assign_grouped_splits(self.get_groups(), **split_kwargs)
+
+        return assign_random_splits(len(self.data), **split_kwargs)
+
+    def get_groups(self):
+        """
+        Gets the group of each example for a grouped split: the group_column of the data's DataFrame (df), or the data attribute
+        of that name
+
+        Returns
+        --------
+        np.ndarray - the group of each example
+        """
+
+        df = getattr(self.data, 'df', None)
+
+        if df is not None and self.group_column in df.columns:
+            return df[self.group_column].values
+
+        return np.asarray(getattr(self.data, self.group_column))
+
+    def get_split_cache_path(self):
+        """
+        Gets the location of the split cache: a .npy file of the split of each example in the data's raw/.cache folder. The file
+        is keyed by the dependency hash of the data and the split specification (the fold is not part of the key, as all folds
+        are assigned at once)
+
+        Returns
+        --------
+        str - location of the cache, or None if the data has no dependency hash
+        """
+
+        data_hash = getattr(self.data, 'data_hash', None)
+        cache_data_path = getattr(self.data, 'cache_data_path', None)
+
+        if data_hash is None or cache_data_path is None:
+            return None
+
+        # the number of examples is taken from y, so we do not load X just to key the cache; the data hash covers datasets without y
+        y = self.data.y
+        split_spec = [self.split_method, self.training_split if not self.n_folds else None, self.n_folds, self.group_column, 
+            self.split_seed, len(y) if y is not None else None]
+        split_key = MantraHashed.get_256_hash_from_string('%s %s' % (data_hash, repr(split_spec)))
+
+        return os.path.join(cache_data_path, 'splits_%s_%s.npy' % (data_hash[:12], split_key[:20]))
+
+    def load_split_assignments(self):
+        """
+        Loads the split of each example from the split cache
+
+        Returns
+        --------
+        np.ndarray of ints - the split or fold of each example, or None if there is no cache
+        """
+
+        cache_path = self.get_split_cache_path()
+
+        if cache_path is None or not os.path.isfile(cache_path):
+            return None
+
+        return np.load(cache_path)
+
+    def save_split_assignments(self, splits):
+        """
+        Saves the split of each example to the split cache, and removes split caches of older versions of the data
+
+        Parameters
+        -----------
+        splits - np.ndarray of ints
+            The split or fold of each example
+        """
+
+        cache_path = self.get_split_cache_path()
+
+        if cache_path is None:
+            return
+
+        cache_prefix = os.path.basename(cache_path).rsplit('_', 1)[0]
+
+        for old_cache in glob.glob(os.path.join(os.path.dirname(cache_path), 'splits_*.npy')):
+            if not os.path.basename(old_cache).startswith(cache_prefix):
+                os.remove(old_cache)
+
+        with open('%s.tmp' % cache_path, 'wb') as cache_file:
+            np.save(cache_file, splits.astype(np.int16))
+
+        os.replace('%s.tmp' % cache_path, cache_path)
+
+    def get_subset(self, indices):
+        """
+        Gets the subset of the data at some indices. If the indices are an increasing range with a constant step, e.g. sorted
+        contiguous indices, the subset is a view of the data rather than a copy. Otherwise we copy the rows, unless self.lazy_splits
+        is True, in which case X is an IndexedSplit that gathers and prepares its rows only when they are indexed. If the Dataset
+        prepares its inputs, X is always an IndexedSplit (see get_split_inputs)
+
+        Parameters
+        -----------
+        indices - list or np.ndarray of ints
+            Indices of the examples in the subset
+
+        Returns
+        --------
+        tuple - (X subset, y subset or None)
+        """
+
+        y = self.data.y
+        indices_slice = indices_to_slice(indices)
+
+        if indices_slice is not None:
+            indices = indices_slice
+        elif self.lazy_splits:
+            return IndexedSplit(self.data.X, indices, prepare=self.prepare_inputs), (y[indices] if y is not None else None)
+
+        return self.get_split_inputs(indices), (y[indices] if y is not None else None)
+
     def get_training_data(self):
         """ 
         Get the training data for the task 
@@ -149,20 +665,21 @@ class Task:
         if self.training_data is not None:
             return self.training_data
 
+        self.configure_split()
         self.training_data = None, None
 
         if self.data.y is not None:
-            if self.training_split is not None:
+            if self.uses_sequential_split():
                 end_index = int(self.training_split[0]*len(self.data))
-                self.training_data = self.data.X[:end_index], self.data.y[:end_index]
+                self.training_data = self.get_split_inputs(slice(0, end_index)), self.data.y[:end_index]
             elif self.training_indices is not None:
-                self.training_data = self.data.X[self.training_indices], self.data.y[self.training_indices]                
+                self.training_data = self.get_subset(self.training_indices)
         else:
-            if self.training_split is not None:
+            if self.uses_sequential_split():
                 end_index = int(self.training_split[0]*len(self.data))
-                self.training_data = self.data.X[:end_index], None
+                self.training_data = self.get_split_inputs(slice(0, end_index)), None
             elif self.training_indices is not None:
-                self.training_data = self.data.X[self.training_indices], None
+                self.training_data = self.get_subset(self.training_indices)
 
         return self.training_data
 
@@ -174,21 +691,22 @@ class Task:
         if self.test_data is not None:
             return self.test_data
 
+        self.configure_split()
         self.test_data = None, None
 
         if self.data.y is not None:
-            if self.training_split is not None:
+            if self.uses_sequential_split():
                 start_index = int(sum(self.training_split[:2])*len(self.data))
-                self.test_data = self.data.X[start_index:], self.data.y[start_index:]
+                self.test_data = self.get_split_inputs(slice(start_index, None)), self.data.y[start_index:]
             elif self.test_indices is not None:
-                self.test_data = self.data.X[self.test_indices], self.data.y[self.test_indices]  
+                self.test_data = self.get_subset(self.test_indices)
 
         else:
-            if self.training_split is not None:
+            if self.uses_sequential_split():
                 start_index = int(sum(self.training_split[:2])*len(self.data))
-                self.test_data = self.data.X[start_index:], None
+                self.test_data = self.get_split_inputs(slice(start_index, None)), None
             elif self.test_indices is not None:
-                self.test_data = self.data.X[self.test_indices], None
+                self.test_data = self.get_subset(self.test_indices)
         
         return self.test_data
 
@@ -200,21 +718,22 @@ class Task:
         if self.validation_data is not None:
             return self.validation_data
 
+        self.configure_split()
         self.validation_data = None, None
 
         if self.data.y is not None:
-            if self.training_split is not None:
+            if self.uses_sequential_split():
                 start_index = int(self.training_split[0]*len(self.data))
                 end_index = int(sum(self.training_split[:2])*len(self.data))
-                self.validation_data = self.data.X[start_index:end_index], self.data.y[start_index:end_index]
+                self.validation_data = self.get_split_inputs(slice(start_index, end_index)), self.data.y[start_index:end_index]
             elif self.validation_indices is not None:
-                self.validation_data = self.data.X[self.validation_indices], self.data.y[self.validation_indices]                
+                self.validation_data = self.get_subset(self.validation_indices)
         else:
-            if self.training_split is not None:
+            if self.uses_sequential_split():
                 start_index = int(self.training_split[0]*len(self.data))
                 end_index = int(sum(self.training_split[:2])*len(self.data))
-                self.validation_data = self.data.X[start_index:end_index], None
+                self.validation_data = self.get_split_inputs(slice(start_index, end_index)), None
             elif self.validation_indices is not None:
-                self.validation_data = self.data.X[self.validation_indices], None
+                self.validation_data = self.get_subset(self.validation_indices)
 
         return self.validation_data
\ No newline at end of file
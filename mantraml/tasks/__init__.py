@@ -1 +1,4 @@
-from .Task import Task
\ No newline at end of file
+from .Task import Task
+from .evaluation import run_evaluation
+from .metrics import Accuracy, BinaryCrossEntropy, ConfusionMatrix, Mean, Metric, merge_metrics
+from .splits import IndexedSplit
@@ -0,0 +1,159 @@
+import numpy as np
+
+
+def get_evaluation_key(mantra_model, epoch=None):
+    """
+    Returns the key of an evaluation of a model: the epoch, the model itself, and the model version if the model keeps one
+    (model_version, which MantraModel.start_training bumps for each training). Two evaluations with the same key evaluate the
+    same weights
+
+    Parameters
+    -----------
+    mantra_model - MantraModel object
+        The model being evaluated
+
+    epoch - int
+        The epoch number (zero indexed); None if it is unknown
+
+    Returns
+    -----------
+    tuple - (epoch, model id, model version), or None if the epoch is unknown
+    """
+
+    if epoch is None:
+        return None
+
+    return epoch, id(mantra_model), getattr(mantra_model, 'model_version', None)
+
+
+def to_metric_value(metric_result):
+    """
+    Converts the result of a metric to a value we can store in the trial metadata: a float, or a list for array results such as
+    confusion counts
+
+    Parameters
+    -----------
+    metric_result - float or np.ndarray
+        The result of the metric
+
+    Returns
+    -----------
+    float or list - the value
+    """
+
+    if np.ndim(metric_result) == 0:
+        return float(metric_result)
+
+    return np.asarray(metric_result).tolist()
+
+
+def get_evaluation_metric(metric_results):
+    """
+    Returns the evaluation metric from the results of metrics evaluated in batches: the first metric, which must be a scalar as it
+    is compared between epochs (e.g. for the best loss)
+
+    Parameters
+    -----------
+    metric_results - dict
+        name -> result of each metric, in the order of the task's metrics
+
+    Returns
+    -----------
+    float - the evaluation metric
+    """
+
+    name, metric_result = next(iter(metric_results.items()))
+
+    if np.ndim(metric_result) != 0:
+        raise ValueError('The evaluation metric %s must be a scalar; put metrics such as ConfusionMatrix after it' % name)
+
+    return metric_result
+
+
+def run_evaluation(mantra_model, epoch=None, verbose=True):
+    """
+    Evaluates a model on its task: the evaluation metric (task.evaluate) and each of the task's secondary metrics. The results are
+    stored on the task as latest_loss and secondary_metrics_values.
+
+    If the task sets metrics (name -> mantraml.tasks.metrics.Metric), they are evaluated in batches (see Task.evaluate_batches):
+    the first is the evaluation metric, which must be a scalar, and the others are secondary metrics.
+
+    An evaluation is run once per epoch and model version: the end of epoch callbacks (e.g. EvaluateTask, ModelCheckpoint) all
+    call this, and later calls with the same key reuse the results. During an evaluation, Task.predict caches the predictions
+    of the model, so the evaluation metric and the secondary metrics share one prediction pass. If the task has a validation
+    subsample (see Task.is_subsampled_evaluation), the evaluation may use it, and task.latest_loss_subsampled records whether it did
+
+    Parameters
+    -----------
+    mantra_model - MantraModel object
+        The model to evaluate; mantra_model.task is the task
+
+    epoch - int
+        The epoch number (zero indexed); if None, we always evaluate
+
+    verbose - bool
+        If True, print the metrics when they are evaluated
+
+    Returns
+    -----------
+    float - the evaluation metric
+    """
+
+    task = mantra_model.task
+    evaluation_key = get_evaluation_key(mantra_model, epoch)
+
+    if evaluation_key is not None and getattr(task, 'evaluation_key', None) == evaluation_key:
+        return task.latest_loss
+
+    task.prediction_key = evaluation_key if evaluation_key is not None else object()
+
+    # tasks with a validation subsample evaluate on it at most epochs, and on the full validation data on schedule
+    subsampled = hasattr(task, 'is_subsampled_evaluation') and task.is_subsampled_evaluation(epoch, getattr(mantra_model, 'epochs', None))
+
+    if subsampled:
+        task.subsample_validation = True
+
+    try:
+        # metrics evaluated in batches share one pass over the validation data: the first is the evaluation metric
+        if getattr(task, 'metrics', None):
+            metric_results = task.evaluate_batches(mantra_model)
+            task.latest_loss = get_evaluation_metric(metric_results)
+            streamed_values = list(metric_results.items())[1:]
+        else:
+            task.latest_loss = task.evaluate(mantra_model)
+            streamed_values = []
+
+        if verbose:
+            print('%s: %s%s' % (task.evaluation_name, task.latest_loss, ' (subsample)' if subsampled else ''))
+
+        if hasattr(task, 'secondary_metrics') or streamed_values:
+
+            task.secondary_metrics_values = {}
+
+            for metric, metric_result in streamed_values:
+                task.secondary_metrics_values[metric] = to_metric_value(metric_result)
+
+                if verbose:
+                    print('%s: %s' % (metric.capitalize(), metric_result))
+
+            for metric in getattr(task, 'secondary_metrics', []):
+                metric_result = getattr(task, metric)(mantra_model)
+                task.secondary_metrics_values[metric] = float(metric_result)
+
+                if verbose:
+                    print('%s: %s' % (metric.capitalize(), metric_result))
+
+    finally:
+        # the predictions are only reused within the evaluation, so we free them
+        task.prediction_key = None
+
+        if subsampled:
+            task.subsample_validation = False
+
+        if hasattr(task, 'clear_predictions'):
+            task.clear_predictions()
+
+    task.evaluation_key = evaluation_key
+    task.latest_loss_subsampled = subsampled
+
+    return task.latest_loss
@@ -0,0 +1,199 @@
+import copy
+
+import numpy as np
+
+
+class Metric:
+    """
+    This class is the reducer protocol for metrics that are evaluated in batches (see Task.evaluate_batches). A metric keeps
+    running state rather than the predictions:
+
+    - reset() - clears the state
+    - update(y_true, y_pred) - adds a batch of labels and predictions to the state
+    - result() - returns the metric from the state
+    - merge(other) - adds the state of another instance of the metric, e.g. one evaluated on another shard of the data
+
+    Metrics whose state cannot be combined set mergeable = False, and merge raises a ValueError
+    """
+
+    mergeable = True
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        raise NotImplementedError
+
+    def update(self, y_true, y_pred):
+        raise NotImplementedError
+
+    def result(self):
+        raise NotImplementedError
+
+    def merge(self, other):
+        """
+        Adds the state of another instance of the metric
+
+        Parameters
+        -----------
+        other - Metric
+            An instance of the same metric
+
+        Returns
+        -----------
+        Metric - self
+        """
+
+        if not self.mergeable:
+            raise ValueError('The metric %s is not mergeable' % type(self).__name__)
+
+        if type(other) is not type(self):
+            raise ValueError('Cannot merge a %s metric into a %s metric' % (type(other).__name__, type(self).__name__))
+
+        self.merge_state(other)
+
+        return self
+
+    def merge_state(self, other):
+        raise NotImplementedError
+
+
+class Mean(Metric):
+    """
+    The mean of a function of each example, e.g. a loss. The function maps a batch of labels and predictions to a value per
+    example; NaN values count towards the number of examples but not the total, as in np.nansum
+    """
+
+    def __init__(self, function=None):
+        self.function = function
+        super().__init__()
+
+    def reset(self):
+        self.total = 0.
+        self.count = 0
+
+    def get_values(self, y_true, y_pred):
+        return self.function(y_true, y_pred)
+
+    def update(self, y_true, y_pred):
+        values = np.asarray(self.get_values(y_true, y_pred), dtype=np.float64)
+        self.total += float(np.nansum(values))
+        self.count += len(values)
+
+    def result(self):
+        return self.total / self.count if self.count else np.nan
+
+    def merge_state(self, other):
+        self.total += other.total
+        self.count += other.count
+
+
+class BinaryCrossEntropy(Mean):
+    """
+    The mean binary cross entropy of predicted probabilities
+    """
+
+    def get_values(self, y_true, y_pred):
+        y_true, y_pred = np.asarray(y_true, dtype=np.float64), np.asarray(y_pred, dtype=np.float64).reshape(np.shape(y_true))
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            values = -(y_true*np.log(y_pred) + (1 - y_true)*np.log(1 - y_pred))
+
+        return values.reshape(len(values), -1).sum(axis=1) if values.ndim > 1 else values
+
+
+class Accuracy(Metric):
+    """
+    The fraction of correct predictions. Predictions with one column per class are compared by their highest scoring class;
+    other predictions are probabilities of the positive class, and are thresholded
+    """
+
+    def __init__(self, threshold=0.5):
+        self.threshold = threshold
+        super().__init__()
+
+    def reset(self):
+        self.correct = 0
+        self.count = 0
+
+    def update(self, y_true, y_pred):
+        y_pred = np.asarray(y_pred)
+        y_true = np.asarray(y_true)
+
+        if y_pred.ndim > 1 and y_pred.shape[-1] > 1:
+            y_pred = y_pred.argmax(axis=-1)
+            y_true = y_true.argmax(axis=-1) if y_true.ndim == y_pred.ndim + 1 else y_true
+        else:
+            y_pred = (y_pred > self.threshold).astype(int).reshape(y_true.shape)
+
+        self.correct += int(np.sum(y_pred == y_true))
+        self.count += len(y_true)
+
+    def result(self):
+        return self.correct / self.count if self.count else np.nan
+
+    def merge_state(self, other):
+        self.correct += other.correct
+        self.count += other.count
+
+
+class ConfusionMatrix(Metric):
+    """
+    The confusion counts of a classifier: result()[i, j] is the number of examples of class i predicted as class j. Predictions
+    are classes, or are converted to classes as in Accuracy: predictions with one column per class by their highest scoring
+    class, and probabilities of the positive class by the threshold. Labels with one column per class are compared by their class
+    """
+
+    def __init__(self, n_classes=2, threshold=0.5):
+        self.n_classes = n_classes
+        self.threshold = threshold
+        super().__init__()
+
+    def reset(self):
+        self.counts = np.zeros((self.n_classes, self.n_classes), dtype=np.int64)
+
+    def update(self, y_true, y_pred):
+        y_pred = np.asarray(y_pred)
+        y_true = np.asarray(y_true)
+
+        if y_pred.ndim > 1 and y_pred.shape[-1] > 1:
+            y_pred = y_pred.argmax(axis=-1)
+        elif y_pred.dtype.kind not in 'iu':
+            y_pred = (y_pred > self.threshold).astype(int)
+
+        if y_true.ndim > 1 and y_true.shape[-1] > 1:
+            y_true = y_true.argmax(axis=-1)
+
+        y_true = y_true.astype(int).ravel()
+        y_pred = y_pred.astype(int).ravel()
+
+        self.counts += np.bincount(y_true*self.n_classes + y_pred, minlength=self.n_classes**2).reshape(self.n_classes, self.n_classes)
+
+    def result(self):
+        return self.counts
+
+    def merge_state(self, other):
+        self.counts += other.counts
+
+
+def merge_metrics(metrics_list):
+    """
+    Merges the states of metrics evaluated separately, e.g. on the shards of the validation data
+
+    Parameters
+    -----------
+    metrics_list - list of dicts
+        name -> Metric, one dict per evaluation
+
+    Returns
+    -----------
+    dict - name -> merged Metric; the metrics in metrics_list are not changed
+    """
+
+    merged_metrics = {name: copy.deepcopy(metric) for name, metric in metrics_list[0].items()}
+
+    for metrics in metrics_list[1:]:
+        for name, metric in metrics.items():
+            merged_metrics[name].merge(metric)
+
+    return merged_metrics
@@ -0,0 +1,264 @@
+import numpy as np
+
+from mantraml.data.utils import indices_to_slice
+
+
+class IndexedSplit:
+    """
+    This class is a lazy subset of an array, e.g. the training inputs of a Task: it holds the indices of the subset rather than
+    a copy of its rows, and gathers rows only when they are indexed - e.g. one batch at a time. Converting it with np.asarray
+    gathers the whole subset.
+    """
+
+    def __init__(self, data, indices, prepare=None):
+        """
+        Parameters
+        -----------
+        data - np.ndarray
+            The full array, e.g. Dataset.X
+
+        indices - list or np.ndarray of ints
+            Indices of the rows in the subset
+
+        prepare - function
+            Applied to each gathered batch of rows, e.g. Task.prepare_inputs; None to return the rows as they are
+        """
+
+        self.data = data
+        self.indices = np.asarray(indices, dtype=int)
+        self.prepare = prepare
+
+    def __len__(self):
+        return len(self.indices)
+
+    @property
+    def shape(self):
+        return (len(self.indices),) + tuple(self.data.shape[1:])
+
+    @property
+    def ndim(self):
+        return self.data.ndim
+
+    @property
+    def dtype(self):
+        if self.prepare is not None:
+            return self.prepare(self.data[:0]).dtype
+
+        return self.data.dtype
+
+    def __getitem__(self, key):
+        """
+        Gathers rows of the subset. Keys that map to an increasing range of rows with a constant step are read as a slice of the
+        full array
+
+        Parameters
+        -----------
+        key - int, slice, list or np.ndarray of ints
+            Positions in the subset
+
+        Returns
+        -----------
+        np.ndarray - the rows
+        """
+
+        if isinstance(key, tuple):
+            rows = self[key[0]]
+            return rows[key[1:]] if np.ndim(self.indices[key[0]]) == 0 else rows[(slice(None),) + key[1:]]
+
+        indices = self.indices[key]
+
+        if np.ndim(indices) == 0:
+            return self.gather(np.array([indices]))[0]
+
+        return self.gather(indices)
+
+    def gather(self, indices):
+        """
+        Gathers rows of the full array and prepares them
+
+        Parameters
+        -----------
+        indices - np.ndarray of ints
+            Indices of the rows in the full array
+
+        Returns
+        -----------
+        np.ndarray - the rows
+        """
+
+        rows_slice = indices_to_slice(indices)
+        rows = self.data[rows_slice if rows_slice is not None else indices]
+
+        return self.prepare(rows) if self.prepare is not None else rows
+
+    def __array__(self, dtype=None, copy=None):
+        rows = self.gather(self.indices)
+        return np.asarray(rows, dtype=dtype) if dtype is not None else np.asarray(rows)
+
+    def batches(self, batch_size):
+        """
+        Iterates over the subset in batches of rows, in order
+
+        Parameters
+        -----------
+        batch_size - int
+            The number of rows in each batch
+
+        Returns
+        -----------
+        generator of np.ndarrays - the batches
+        """
+
+        for start in range(0, len(self.indices), batch_size):
+            yield self.gather(self.indices[start:start + batch_size])
+
+
+SPLIT_METHODS = ['random', 'stratified', 'grouped']
+
+
+def get_split_positions(n_items, fractions):
+    """
+    Assigns items at evenly spaced positions in [0, 1) to splits with the given fractions, e.g. (0.6, 0.2, 0.2)
+
+    Parameters
+    -----------
+    n_items - int or np.ndarray of floats
+        The number of items, spaced evenly; or the position of each item in [0, 1)
+
+    fractions - tuple of floats
+        The fraction of items in each split
+
+    Returns
+    -----------
+    np.ndarray of ints - the split of each item
+    """
+
+    positions = (np.arange(n_items) + 0.5) / max(n_items, 1) if np.isscalar(n_items) else n_items
+    boundaries = np.cumsum(fractions)[:-1] / np.sum(fractions)
+
+    return np.searchsorted(boundaries, positions, side='right')
+
+
+def assign_random_splits(n_examples, fractions=None, n_folds=None, seed=0):
+    """
+    Assigns examples to splits at random
+
+    Parameters
+    -----------
+    n_examples - int
+        The number of examples
+
+    fractions - tuple of floats
+        The fraction of examples in each split; ignored if n_folds is set
+
+    n_folds - int
+        The number of folds, for k-fold splits
+
+    seed - int
+        Seed for the assignment
+
+    Returns
+    -----------
+    np.ndarray of ints - the split (or fold) of each example
+    """
+
+    order = np.random.RandomState(seed).permutation(n_examples)
+    splits = np.empty(n_examples, dtype=np.int64)
+
+    if n_folds:
+        splits[order] = np.arange(n_examples) % n_folds
+    else:
+        splits[order] = get_split_positions(n_examples, fractions)
+
+    return splits
+
+
+def assign_stratified_splits(labels, fractions=None, n_folds=None, seed=0):
+    """
+    Assigns examples to splits at random, so that each split has the same proportion of each label as the whole data (to
+    within one example per label)
+
+    Parameters
+    -----------
+    labels - np.ndarray
+        The class label of each example; labels with one column per class are compared by their highest scoring class
+
+    fractions - tuple of floats
+        The fraction of examples in each split; ignored if n_folds is set
+
+    n_folds - int
+        The number of folds, for k-fold splits
+
+    seed - int
+        Seed for the assignment
+
+    Returns
+    -----------
+    np.ndarray of ints - the split (or fold) of each example
+    """
+
+    labels = np.asarray(labels)
+    labels = labels.argmax(axis=1) if labels.ndim > 1 and labels.shape[1] > 1 else labels.ravel()
+
+    if labels.dtype.kind == 'f' and not np.all(np.mod(labels, 1) == 0):
+        raise ValueError('A stratified split needs class labels, but the labels have continuous values; use a random split')
+
+    label_ids = np.unique(labels, return_inverse=True)[1].ravel()
+
+    # sort the examples by label, in a random order within each label
+    order = np.lexsort((np.random.RandomState(seed).random_sample(len(label_ids)), label_ids))
+    splits = np.empty(len(order), dtype=np.int64)
+
+    if n_folds:
+        # dealing the sorted examples round robin keeps both the folds and their labels balanced
+        splits[order] = np.arange(len(order)) % n_folds
+    else:
+        # each example is placed by its rank within its label
+        label_counts = np.bincount(label_ids)
+        label_starts = np.concatenate([[0], np.cumsum(label_counts)[:-1]])
+        ranks = np.arange(len(order)) - label_starts[label_ids[order]]
+        splits[order] = get_split_positions((ranks + 0.5) / label_counts[label_ids[order]], fractions)
+
+    return splits
+
+
+def assign_grouped_splits(groups, fractions=None, n_folds=None, seed=0):
+    """
+    Assigns groups of examples to splits at random, so that all the examples of a group are in the same split; the splits have
+    roughly the given fractions of examples
+
+    Parameters
+    -----------
+    groups - np.ndarray
+        The group of each example, e.g. a user or patient id
+
+    fractions - tuple of floats
+        The fraction of examples in each split; ignored if n_folds is set
+
+    n_folds - int
+        The number of folds, for k-fold splits
+
+    seed - int
+        Seed for the assignment
+
+    Returns
+    -----------
+    np.ndarray of ints - the split (or fold) of each example
+    """
+
+    group_ids = np.unique(np.asarray(groups), return_inverse=True)[1].ravel()
+    group_counts = np.bincount(group_ids)
+
+    # groups are taken in a random order, and placed by the share of examples before their middle
+    order = np.random.RandomState(seed).permutation(len(group_counts))
+    ordered_counts = group_counts[order]
+    positions = (np.cumsum(ordered_counts) - ordered_counts / 2) / max(len(group_ids), 1)
+
+    group_splits = np.empty(len(group_counts), dtype=np.int64)
+
+    if n_folds:
+        group_splits[order] = np.minimum((positions * n_folds).astype(np.int64), n_folds - 1)
+    else:
+        group_splits[order] = get_split_positions(positions, fractions)
+
+    return group_splits[group_ids]
@@ -2,6 +2,7 @@ import numpy as np
 
 from mantraml.data import Dataset, cachedata
 from mantraml.data import ImageDataset
+from mantraml.data import AugmentationPipeline, ColorJitter, RandomCrop, RandomFlip
 
 
 class MyImageDataset(ImageDataset):
@@ -16,6 +17,10 @@ class MyImageDataset(ImageDataset):
     image_dim = (128, 128)
     normalized = True
 
+    # random augmentations applied to each training batch as it is loaded, e.g.
+    # augmentation = AugmentationPipeline([RandomCrop(padding=4), RandomFlip(), ColorJitter(brightness=0.1, contrast=0.1)], seed=0)
+    augmentation = None
+
     @cachedata
     def y(self):
         # return your labels here as an np.ndarray
@@ -270,7 +270,7 @@ class RaGAN(MantraModel):
         # Create Optimizers for Traing
         self.create_optimizers()
 
-    def gradient_update(self, iter):
+    def gradient_update(self, iter, x):
         """
         Updates the parameters with a single gradient update
 
@@ -279,19 +279,22 @@ class RaGAN(MantraModel):
         iter - int
             The iteration number
 
+        x - np.ndarray
+            The batch of real images
+
         Returns
         ----------
         void - updates parameters
         """
 
+        # the noise is sized from the batch, which can be smaller than batch_size if some images could not be decoded
         # Discriminator Update
-        x = self.data.X[iter*self.batch_size:(iter+1)*self.batch_size]
-        z = np.random.normal(0, 1, (self.batch_size, 1, 1, self.z_shape))
+        z = np.random.normal(0, 1, (len(x), 1, 1, self.z_shape))
 
         discriminator_loss, _ = self.session.run([self.d_loss, self.d_optimizer], {self.x_real: x, self.z: z, self.training: True})
 
         # Generator Update
-        z = np.random.normal(0, 1, (self.batch_size, 1, 1, self.z_shape))
+        z = np.random.normal(0, 1, (len(x), 1, 1, self.z_shape))
         summary, generator_loss, _ = self.session.run([self.summary, self.g_loss, self.g_optimizer], {self.z: z, self.x_real: x, self.training: True})
 
         self.writer.add_summary(summary, iter)
@@ -326,23 +329,21 @@ class RaGAN(MantraModel):
                 
         self.init_model()
 
-        # Ready data
-        self.batches_per_epoch = len(self.data) // self.batch_size
-            
         # Results Dict
         np.random.seed(int(time.time())) # random seed for training
         
         for epoch in range(self.epochs):
             self.epoch_start_time = time.time()
 
-            for iter in range(self.batches_per_epoch):
-                self.gradient_update(iter)
+            # batches are read as we go, so training starts without loading the whole dataset
+            for iter, (x, _) in enumerate(self.data.batches(self.batch_size, drop_last=True)):
+                self.gradient_update(iter, x)
 
             self.end_of_epoch_update(epoch)
 
-            ModelCheckpoint(mantra_model=self, session=self.session)
+            ModelCheckpoint(mantra_model=self, session=self.session, epoch=epoch)
             if self.task:
-                EvaluateTask(mantra_model=self)
+                EvaluateTask(mantra_model=self, epoch=epoch)
             StoreTrial(mantra_model=self, epoch=epoch)
 
             self.end_of_epoch_message(epoch=epoch, message=str(time.time() - self.epoch_start_time))
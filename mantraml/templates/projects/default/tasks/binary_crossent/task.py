@@ -16,13 +16,12 @@ class BinaryCrossEntropy(Task):
     secondary_metrics = ['accuracy']
 
     def evaluate(self, model):
-        predictions = model.predict(self.X_val)
+        predictions = self.predict(model)
         return -np.nansum(self.y_val*np.log(predictions) + (1-self.y_val)*np.log(1-predictions)) / predictions.shape[0]
 
     def accuracy(self, model):
-        predictions = model.predict(self.X_val)
-        predictions[predictions > 0.5] = 1
-        predictions[predictions <= 0.5] = 0
+        # the predictions are shared with evaluate, so we threshold a copy rather than in place
+        predictions = (self.predict(model) > 0.5).astype(int)
         return accuracy_score(self.y_val, predictions)
 
 
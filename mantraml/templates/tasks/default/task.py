@@ -7,7 +7,8 @@ class MyTask(Task):
     training_split = (0.5, 0.25, 0.25)
 
     def evaluate(self, model):
-        # Return an evaluation metric scalar here. For example, categorical cross entropy on the validation set:
-        # predictions = model.predict(self.X_val)
+        # Return an evaluation metric scalar here. self.predict(model) returns the model's predictions on the validation set,
+        # shared with any secondary metrics. For example, categorical cross entropy on the validation set:
+        # predictions = self.predict(model)
         # return -np.nansum(self.y_val*np.log(predictions) + (1-self.y_val)*np.log(1-predictions)) / predictions.shape[0]
         return
\ No newline at end of file
@@ -1,8 +1,10 @@
+import io
 import os
 import numpy as np
 import pandas as pd
 
-from mantraml.data import Dataset, cachedata
+from mantraml.data import Dataset, ImageDataset, cachedata
+from mantraml.data.archive import build_tar_index, read_archive_member
 
 import pytest
 
@@ -11,6 +13,29 @@ class MyDataset(Dataset):
 
     files = []
 
+class MyImageDataset(ImageDataset):
+
+    files = []
+
+    @classmethod
+    def get_image(cls, path, resize_height=64, resize_width=64, crop=True, grayscale=False, normalize=True):
+        value = int(os.path.basename(path).split('.')[0])
+        if value < 0:
+            raise IOError('Corrupt image')
+        elif value == 0:
+            return np.zeros((resize_height + 1, resize_width, 3))
+        return np.full((resize_height, resize_width, 3), value, dtype=np.float64)
+
+class MyArchiveImageDataset(ImageDataset):
+
+    files = []
+    read_from_archive = True
+
+    @classmethod
+    def get_image(cls, path, resize_height=64, resize_width=64, crop=True, grayscale=False, normalize=True):
+        value = int(bytes(read_archive_member(path)).decode())
+        return np.full((resize_height, resize_width, 3), value, dtype=np.float64)
+
 class MySecondDataset(Dataset):
 
     files = []
@@ -118,4 +143,903 @@ def test_dataset_len():
 
     my_data = MySecondDataset()
 
-    assert(len(my_data) == 5) # the array size of the example dataset
\ No newline at end of file
+    assert(len(my_data) == 5) # the array size of the example dataset
+
+def make_image_dataset(tmpdir, values, **kwargs):
+
+    for value in values:
+        open(os.path.join(str(tmpdir), '%s.jpg' % value), 'w').close()
+
+    my_data = MyImageDataset()
+    my_data.extracted_data_path = str(tmpdir)
+    my_data.file_format = '.jpg'
+    my_data.image_shape = (4, 4, 3)
+
+    for key, value in kwargs.items():
+        setattr(my_data, key, value)
+
+    return my_data
+
+@pytest.mark.parametrize('decode_workers', [1, 2])
+def test_image_dataset_decode(tmpdir, decode_workers):
+
+    my_data = make_image_dataset(tmpdir, [1, 2, 3, 0, -1, 4, 5], decode_workers=decode_workers, decode_chunk_size=2)
+
+    X = my_data.X
+
+    assert(X.shape == (5, 4, 4, 3))
+    assert(sorted(my_data.image_file_names) == ['1.jpg', '2.jpg', '3.jpg', '4.jpg', '5.jpg'])
+    assert(len(my_data.unprocessed_images) == 2)
+
+    # results come back in order, so each row matches its file name
+    for row, file_name in zip(X, my_data.image_file_names):
+        assert(np.all(row == int(file_name.split('.')[0])))
+
+@pytest.mark.parametrize('image_dtype', ['float32', 'float16', 'uint8'])
+def test_image_dataset_dtype(tmpdir, image_dtype):
+
+    my_data = make_image_dataset(tmpdir, [1, 2, 3], image_dtype=image_dtype, normalize=False)
+
+    X = my_data.X
+
+    assert(X.dtype == np.dtype(image_dtype))
+    assert(X.flags['C_CONTIGUOUS'])
+    assert(X.shape == (3, 4, 4, 3))
+
+def test_image_dataset_dtype_invalid(tmpdir):
+
+    my_data = make_image_dataset(tmpdir, [1], image_dtype='int64')
+
+    with pytest.raises(ValueError):
+        my_data.X
+
+def test_image_dataset_uint8_normalized(tmpdir):
+
+    from mantraml.tasks import Task
+
+    my_data = make_image_dataset(tmpdir, [0, 51, 255], image_dtype='uint8', normalize=True)
+
+    # X stores the pixels, and batches are normalized as they are served
+    assert(my_data.X.dtype == np.uint8)
+    assert(np.array_equal(my_data.X[:, 0, 0, 0], np.array([255, 51])))
+
+    batch_X, batch_y = my_data.get_batch(np.array([0, 1]))
+
+    assert(batch_X.dtype == np.float32)
+    assert(np.allclose(batch_X[:, 0, 0, 0], np.array([1., 51 / 127.5 - 1])))
+
+    class MockModel:
+
+        def predict(self, X):
+            assert(X.dtype == np.float32)
+            return X[:, 0, 0, 0]
+
+    my_task = Task(data=my_data)
+    my_task.training_split = (0, 1, 0)
+    my_task.evaluation_batch_size = 1
+
+    # the splits are served normalized, one batch at a time as they are indexed, rather than copied whole
+    assert(my_task.X_val.dtype == np.float32)
+    assert(np.allclose(np.asarray(my_task.X_val)[:, 0, 0, 0], np.array([1., 51 / 127.5 - 1])))
+    assert(np.allclose(my_task.X_val[1:, 0, 0, 0], 51 / 127.5 - 1))
+    assert(np.allclose(my_task.predict(MockModel()), np.array([1., 51 / 127.5 - 1])))
+
+    # denormalize_image understands both representations
+    assert(np.allclose(my_data.denormalize_image(batch_X[1]), 51))
+    assert(np.array_equal(my_data.denormalize_image(my_data.X[0]), my_data.X[0]))
+
+def test_image_dataset_cache(tmpdir):
+
+    image_dir = tmpdir.mkdir('images')
+    cache_dir = tmpdir.mkdir('cache')
+
+    my_data = make_image_dataset(image_dir, [1, 2, -1], data_hash='hash_1', cache_data_path=str(cache_dir))
+    X = my_data.X
+
+    assert(X.shape == (2, 4, 4, 3))
+    assert(isinstance(X, np.memmap))
+    assert(len(cache_dir.listdir()) == 2)
+
+    # a second dataset loads the cache without decoding
+    for image_path in image_dir.listdir():
+        image_path.remove()
+
+    my_data = make_image_dataset(image_dir, [], data_hash='hash_1', cache_data_path=str(cache_dir))
+    cached_X = my_data.X
+
+    assert(np.all(cached_X == X))
+    assert(sorted(my_data.image_file_names) == ['1.jpg', '2.jpg'])
+    assert(len(my_data.unprocessed_images) == 1)
+
+    # a new key rebuilds the cache and removes the old one
+    my_data = make_image_dataset(image_dir, [3], data_hash='hash_2', cache_data_path=str(cache_dir))
+
+    assert(my_data.X.shape == (1, 4, 4, 3))
+    assert(len(cache_dir.listdir()) == 2)
+    assert(my_data.get_image_cache_path(my_data.get_image_cache_key()) + '.npy' in [str(path) for path in cache_dir.listdir()])
+
+def test_image_dataset_cache_incremental(tmpdir):
+
+    image_dir = tmpdir.mkdir('images')
+    cache_dir = tmpdir.mkdir('cache')
+
+    my_data = make_image_dataset(image_dir, [1, 2, 3, -1], data_hash='hash_1', cache_data_path=str(cache_dir))
+    my_data.X
+
+    assert(my_data.n_decoded_images == 4)
+
+    # we add an image, change an image and delete an image: only the added and changed images are decoded
+    image_dir.join('1.jpg').remove()
+    image_dir.join('2.jpg').write('changed')
+
+    my_data = make_image_dataset(image_dir, [4], data_hash='hash_2', cache_data_path=str(cache_dir))
+    X = my_data.X
+
+    assert(my_data.n_decoded_images == 2)
+    assert(my_data.image_file_names == ['2.jpg', '3.jpg', '4.jpg'])
+    assert(np.all(X[:, 0, 0, 0] == np.array([2, 3, 4])))
+    assert(len(my_data.unprocessed_images) == 1)
+    assert(len(cache_dir.listdir()) == 2)
+
+    # a cache with other decoding options is not reused
+    my_data = make_image_dataset(image_dir, [], data_hash='hash_3', cache_data_path=str(cache_dir), image_dtype='float32')
+    my_data.X
+
+    assert(my_data.n_decoded_images == 4)
+
+class MyDefaultImageDataset(ImageDataset):
+
+    files = []
+
+def test_transform_batch():
+
+    images = np.random.RandomState(0).randint(0, 256, size=(3, 12, 8, 3)).astype(np.uint8)
+
+    X = ImageDataset.transform_batch(images, 4, 4, crop=True, normalize=True, dtype=np.float32)
+
+    assert(X.shape == (3, 4, 4, 3))
+    assert(X.dtype == np.float32)
+    assert(X.min() >= -1 and X.max() <= 1)
+
+    # the batch is transformed as each image would be on its own
+    for image, transformed_image in zip(images, X):
+        assert(np.allclose(ImageDataset.transform(image, 4, 4, crop=True, normalize=True), transformed_image, atol=1e-5))
+
+    # constant images stay constant, and resizing to the same size keeps the pixels
+    constant_images = np.full((2, 9, 9, 3), 200, dtype=np.uint8)
+    assert(np.all(ImageDataset.transform_batch(constant_images, 4, 5, normalize=False, dtype=np.uint8) == 200))
+    assert(np.array_equal(ImageDataset.transform_batch(images[:, :8], 8, 8, normalize=False, dtype=np.uint8), images[:, :8]))
+
+    out = np.empty((3, 4, 4, 3), dtype=np.float64)
+    assert(ImageDataset.transform_batch(images, 4, 4, out=out) is out)
+
+    with pytest.raises(ValueError):
+        ImageDataset.transform_batch(images, 4, 4, normalize=True, dtype=np.uint8)
+
+def test_image_dataset_decode_batches(tmpdir):
+
+    from PIL import Image
+
+    for value, size in [(10, (8, 8)), (20, (8, 8)), (30, (12, 6))]:
+        Image.new('RGB', size, (value, value, value)).save(str(tmpdir.join('%s.png' % value)))
+
+    tmpdir.join('40.png').write('corrupt')
+
+    my_data = MyDefaultImageDataset()
+    my_data.extracted_data_path = str(tmpdir)
+    my_data.file_format = '.png'
+    my_data.image_shape = (4, 4, 3)
+    my_data.normalize = False
+    my_data.image_dtype = 'uint8'
+
+    X = my_data.X
+
+    assert(X.dtype == np.uint8)
+    assert(np.array_equal(X[:, 0, 0, 0], np.array([10, 20, 30])))
+    assert(len(my_data.unprocessed_images) == 1)
+
+class MyAugmentedDataset(ImageDataset):
+
+    files = []
+    image_dtype = 'uint8'
+
+    @cachedata
+    def X(self):
+        return np.random.RandomState(0).randint(0, 256, size=(10, 8, 8, 3)).astype(np.uint8)
+
+def make_augmentation(seed=0):
+
+    from mantraml.data import AugmentationPipeline, ColorJitter, RandomCrop, RandomFlip
+
+    return AugmentationPipeline([RandomCrop(padding=2), RandomFlip(vertical=True), ColorJitter(0.3, 0.3, 0.3)], seed=seed)
+
+def test_augmentations():
+
+    from mantraml.data import AugmentationPipeline, ColorJitter, RandomCrop, RandomFlip
+
+    images = np.random.RandomState(0).randint(0, 256, size=(4, 6, 6, 3)).astype(np.uint8)
+    random_state = np.random.RandomState(0)
+
+    assert(np.array_equal(RandomFlip(p=1)(images.copy(), random_state, (0, 255)), images[:, :, ::-1]))
+    assert(np.array_equal(RandomCrop(padding=0)(images.copy(), random_state, (0, 255)), images))
+
+    # translated images keep their shape, and take their pixels from the image or its edges
+    cropped = RandomCrop(padding=2)(images.copy(), random_state, (0, 255))
+    assert(cropped.shape == images.shape)
+    assert(set(np.unique(cropped[0])) <= set(np.unique(images[0])))
+
+    jittered = ColorJitter(brightness=2.)(images.astype(np.float32) / 127.5 - 1, random_state, (-1, 1))
+    assert(jittered.min() >= -1 and jittered.max() <= 1)
+
+    # a batch read as a slice is augmented the same way as its indices
+    pipeline = AugmentationPipeline([RandomFlip()], seed=0)
+    assert(np.array_equal(pipeline.get_random_state(slice(1, 8, 3)).random_sample(4), 
+        pipeline.get_random_state(np.array([1, 4, 7])).random_sample(4)))
+
+def test_image_dataset_augmentation():
+
+    my_data = MyAugmentedDataset(augmentation=make_augmentation())
+    X = np.array(my_data.X)
+
+    batches = list(my_data.batches(batch_size=4))
+
+    # uint8 images are augmented as pixels, then normalized; X itself is unchanged
+    assert(all([batch_X.dtype == np.float32 and batch_X.shape[1:] == (8, 8, 3) for batch_X, batch_y in batches]))
+    assert(all([batch_X.min() >= -1 and batch_X.max() <= 1 for batch_X, batch_y in batches]))
+    assert(np.array_equal(my_data.X, X))
+    assert(not np.allclose(batches[0][0], my_data.prepare_batch(X[:4])))
+
+    # a seeded pipeline is reproducible, whichever worker loads a batch, and differs between epochs
+    other_data = MyAugmentedDataset(augmentation=make_augmentation())
+    prefetched = list(other_data.batches(batch_size=4, prefetch=2, prefetch_workers=2, prefetch_mode='process'))
+
+    assert(all([np.array_equal(batch[0], prefetched_batch[0]) for batch, prefetched_batch in zip(batches, prefetched)]))
+    assert(not np.array_equal(next(iter(my_data.batches(batch_size=4)))[0], batches[0][0]))
+
+class MyMemmapDataset(Dataset):
+
+    files = []
+    n_loads = 0
+
+    @cachedata
+    def X(self):
+        MyMemmapDataset.n_loads += 1
+        return np.arange(20, dtype=np.float32).reshape(10, 2)
+
+    @cachedata
+    def y(self):
+        return np.arange(10)
+
+class MySlowDataset(Dataset):
+
+    files = []
+    n_loads = 0
+
+    @cachedata
+    def X(self):
+        import time
+        time.sleep(0.05)
+        self.n_loads += 1
+        return np.zeros((100, 10))
+
+def test_cachedata_single_flight():
+
+    import threading
+
+    my_data = MySlowDataset()
+    threads = [threading.Thread(target=lambda: my_data.X) for thread_no in range(4)]
+
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert(my_data.n_loads == 1)
+    assert(my_data.get_cached_nbytes()['X'] == 8000)
+
+    my_data.invalidate('X')
+
+    assert(my_data.get_cached_nbytes()['X'] == 0)
+    assert(my_data.X.shape == (100, 10))
+    assert(my_data.n_loads == 2)
+
+def test_cachedata_budget():
+
+    from mantraml.data import set_cache_budget
+
+    set_cache_budget(12000)
+
+    try:
+        first_data, second_data = MySlowDataset(), MySlowDataset()
+        first_data.X
+        second_data.X
+
+        # the least recently used array is evicted, and loaded again on next access
+        assert(first_data._X is None)
+        assert(second_data._X is not None)
+
+        first_data.X
+
+        assert(first_data.n_loads == 2)
+        assert(second_data._X is None)
+    finally:
+        set_cache_budget(None)
+
+def load_shared_dataset(data_hash):
+
+    MyMemmapDataset.n_loads = 0
+
+    my_data = MyMemmapDataset(storage='shared')
+    my_data.data_hash = data_hash
+
+    return float(my_data.X.sum()), MyMemmapDataset.n_loads
+
+def test_dataset_shared_storage():
+
+    import uuid
+    from concurrent.futures import ProcessPoolExecutor
+
+    MyMemmapDataset.n_loads = 0
+    data_hash = uuid.uuid4().hex
+
+    my_data = MyMemmapDataset(storage='shared')
+    my_data.data_hash = data_hash
+
+    try:
+        X = my_data.X
+
+        assert(MyMemmapDataset.n_loads == 1)
+        assert(not X.flags['WRITEABLE'])
+        assert(my_data.get_cached_nbytes()['X'] == 0)
+
+        # a second dataset, in this process or another, attaches rather than loading
+        other_data = MyMemmapDataset(storage='shared')
+        other_data.data_hash = data_hash
+
+        assert(np.array_equal(other_data.X, X))
+        assert(MyMemmapDataset.n_loads == 1)
+
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            assert(executor.submit(load_shared_dataset, data_hash).result() == (float(X.sum()), 0))
+    finally:
+        my_data.unpublish()
+
+    # once unpublished, a new dataset loads the data again
+    MyMemmapDataset.n_loads = 0
+    my_data = MyMemmapDataset(storage='shared')
+    my_data.data_hash = data_hash
+
+    try:
+        assert(np.array_equal(my_data.X, X))
+        assert(MyMemmapDataset.n_loads == 1)
+    finally:
+        my_data.unpublish()
+
+def test_dataset_memmap_storage(tmpdir):
+
+    MyMemmapDataset.n_loads = 0
+
+    my_data = MyMemmapDataset(storage='memmap')
+    my_data.data_hash = 'hash_1'
+    my_data.cache_data_path = str(tmpdir)
+
+    assert(isinstance(my_data.X, np.memmap))
+    assert(isinstance(my_data.y, np.memmap))
+    assert(len(my_data) == 10)
+    assert(np.all(my_data[2:4][0] == np.array([[4, 5], [6, 7]])))
+    assert(isinstance(my_data[2:4][0], np.memmap))
+
+    # a second instance reads the file rather than loading the data again
+    my_data = MyMemmapDataset(storage='memmap')
+    my_data.data_hash = 'hash_1'
+    my_data.cache_data_path = str(tmpdir)
+
+    assert(np.all(my_data.X == np.arange(20).reshape(10, 2)))
+    assert(MyMemmapDataset.n_loads == 1)
+
+    with pytest.raises(ValueError):
+        MyMemmapDataset(storage='disk')
+
+def test_dataset_shard():
+
+    my_data = MyMemmapDataset()
+    shards = [my_data.shard(3, index) for index in range(3)]
+
+    assert([len(shard) for shard in shards] == [4, 3, 3])
+    assert(np.all(np.concatenate([shard.X for shard in shards]) == my_data.X))
+    assert(np.all(np.concatenate([shard.y for shard in shards]) == np.arange(10)))
+
+    # the shard is a copy, and the shards of another dataset are the same
+    assert(my_data.shard_spec is None)
+    assert(np.all(MyMemmapDataset().shard(3, 1).y == shards[1].y))
+
+    with pytest.raises(ValueError):
+        my_data.shard(0, 0)
+
+def test_dataset_shard_state():
+
+    my_data = MyAugmentedDataset(augmentation=make_augmentation())
+    list(my_data.batches(batch_size=4, prefetch=2))
+    shard = my_data.shard(2, 0)
+
+    # the shard counts its own prefetched batches, and advancing its augmentation epoch leaves the dataset unchanged
+    assert(shard.prefetch_stats is None)
+    list(shard.batches(batch_size=4, prefetch=2))
+    list(shard.batches(batch_size=4, prefetch=2))
+
+    assert(my_data.prefetch_stats['batches'] == 3)
+    assert(shard.prefetch_stats['batches'] == 4)
+    assert(shard.augmentation is not my_data.augmentation)
+    assert(shard.augmentation.epoch == my_data.augmentation.epoch + 2)
+
+def test_image_dataset_shard(tmpdir):
+
+    image_dir = tmpdir.mkdir('images')
+    cache_dir = tmpdir.mkdir('cache')
+
+    my_data = make_image_dataset(image_dir, [1, 2, 3, 4, 5], data_hash='hash_1', cache_data_path=str(cache_dir))
+    shards = [my_data.shard(2, index) for index in range(2)]
+
+    # each shard decodes only its own images, and keeps its own cache
+    assert(np.all(shards[0].X[:, 0, 0, 0] == np.array([1, 2, 3])))
+    assert(np.all(shards[1].X[:, 0, 0, 0] == np.array([4, 5])))
+    assert(shards[0].n_decoded_images == 3)
+    assert(shards[1].n_decoded_images == 2)
+    assert(my_data.X.shape == (5, 4, 4, 3))
+    assert(len(cache_dir.listdir()) == 6)
+
+def test_dataset_batches():
+
+    my_data = MyMemmapDataset()
+
+    batches = list(my_data.batches(batch_size=4))
+
+    assert([batch_X.shape[0] for batch_X, batch_y in batches] == [4, 4, 2])
+    assert(np.all(batches[1][0] == my_data.X[4:8]))
+    assert(np.all(batches[1][1] == my_data.y[4:8]))
+    assert(np.shares_memory(batches[1][0], my_data.X))
+
+    batches = list(my_data.batches(batch_size=4, drop_last=True))
+    assert(len(batches) == 2)
+
+    shuffled = list(my_data.batches(batch_size=4, shuffle=True, seed=10))
+    shuffled_again = list(my_data.batches(batch_size=4, shuffle=True, seed=10))
+    assert(all([np.all(batch[1] == batch_again[1]) for batch, batch_again in zip(shuffled, shuffled_again)]))
+    assert(sorted(np.concatenate([batch_y for batch_X, batch_y in shuffled])) == list(range(10)))
+
+def test_image_dataset_lazy_batches(tmpdir):
+
+    my_data = make_image_dataset(tmpdir, [1, 2, 3, -1, 4])
+
+    batches = list(my_data.batches(batch_size=2))
+
+    assert(my_data._X is None)
+    # files are sorted, so the corrupt -1.jpg is left out of the first batch
+    assert([batch_X.shape[0] for batch_X, batch_y in batches] == [1, 2, 1])
+    assert(np.all(batches[0][0][0] == 1))
+    assert(np.all(batches[1][0][1] == 3))
+    assert(batches[0][1] is None)
+    assert(len(my_data.unprocessed_images) == 1)
+
+def test_image_dataset_lazy_batches_labels(tmpdir):
+
+    class MyLabelledImageDataset(MyImageDataset):
+
+        has_labels = True
+
+        @cachedata
+        def y(self):
+            # one label per decoded image, i.e. per row of X
+            return np.array([int(file_name.split('.')[0]) for file_name in self.image_file_names])
+
+    for value in [1, 2, -1, 3, 4]:
+        open(os.path.join(str(tmpdir), '%s.jpg' % value), 'w').close()
+
+    my_data = MyLabelledImageDataset()
+    my_data.extracted_data_path = str(tmpdir)
+    my_data.file_format = '.jpg'
+    my_data.image_shape = (4, 4, 3)
+
+    # the labels are aligned with the decoded images, so labelled batches are read from X and match their images
+    assert(not my_data.is_decoded_lazily())
+
+    for batch_X, batch_y in my_data.batches(batch_size=2):
+        assert(np.array_equal(batch_X[:, 0, 0, 0], batch_y))
+
+def test_image_dataset_lazy_batches_decode_once(tmpdir, monkeypatch):
+
+    import sys
+
+    image_dataset_module = sys.modules['mantraml.data.ImageDataset']
+
+    decoded_paths = []
+    decode_image_chunk = image_dataset_module.decode_image_chunk
+
+    def counting_decode_image_chunk(dataset_class, paths, *args, **kwargs):
+        decoded_paths.extend(paths)
+        return decode_image_chunk(dataset_class, paths, *args, **kwargs)
+
+    monkeypatch.setattr(image_dataset_module, 'decode_image_chunk', counting_decode_image_chunk)
+
+    image_dir = tmpdir.mkdir('images')
+    cache_dir = tmpdir.mkdir('cache')
+
+    # without a cache, only the batch is held, so each epoch decodes its images
+    my_data = make_image_dataset(image_dir, [1, 2, 3, -1, 4])
+
+    first_epoch = list(my_data.batches(batch_size=2, shuffle=True, seed=0))
+    second_epoch = list(my_data.batches(batch_size=2, shuffle=True, seed=0))
+
+    assert(len(decoded_paths) == 10)
+    assert(all([np.all(batch[0] == batch_again[0]) for batch, batch_again in zip(first_epoch, second_epoch)]))
+    assert(len(my_data.unprocessed_images) == 1)
+    assert(getattr(my_data, '_lazy_images', None) is None)
+
+    # with a cache, the first epoch decodes into a memory map of the cache, and the next epoch reads from X
+    decoded_paths[:] = []
+    my_data = make_image_dataset(image_dir, [1, 2, 3, -1, 4], data_hash='hash_1', cache_data_path=str(cache_dir))
+
+    batches = my_data.batches(batch_size=2, shuffle=True, seed=0)
+    next(batches)
+
+    assert(isinstance(my_data._lazy_images, np.memmap))
+
+    first_epoch = list(batches)
+
+    assert(len(decoded_paths) == 5)
+    assert(my_data.get_image_cache_path(my_data.get_image_cache_key()) + '.npy' in [str(path) for path in cache_dir.listdir()])
+    assert(not [path for path in cache_dir.listdir() if path.ext == '.tmp'])
+
+    second_epoch = list(my_data.batches(batch_size=2))
+
+    assert(len(decoded_paths) == 5)
+    assert(not my_data.is_decoded_lazily())
+    assert([batch_X.shape[0] for batch_X, batch_y in second_epoch] == [2, 2])
+    assert(np.all(np.concatenate([batch_X for batch_X, batch_y in second_epoch])[:, 0, 0, 0] == [1, 2, 3, 4]))
+    assert(sorted(my_data.image_file_names) == ['1.jpg', '2.jpg', '3.jpg', '4.jpg'])
+
+@pytest.mark.parametrize('prefetch_mode, shared_memory', [('thread', False), ('process', False), ('process', True)])
+def test_dataset_prefetch(prefetch_mode, shared_memory):
+
+    my_data = MyMemmapDataset()
+
+    batches = list(my_data.batches(batch_size=3, shuffle=True, seed=1))
+    prefetched = list(my_data.batches(batch_size=3, shuffle=True, seed=1, prefetch=2, prefetch_workers=2, 
+        prefetch_mode=prefetch_mode, shared_memory=shared_memory))
+
+    assert(len(prefetched) == len(batches))
+    assert(all([np.all(batch[0] == prefetched_batch[0]) for batch, prefetched_batch in zip(batches, prefetched)]))
+    assert(all([np.all(batch[1] == prefetched_batch[1]) for batch, prefetched_batch in zip(batches, prefetched)]))
+
+    assert(my_data.prefetch_stats['batches'] == 4)
+    assert(my_data.prefetch_stats['queue_wait_time'] >= 0)
+    assert(my_data.prefetch_stats['producer_time'] >= 0)
+
+def test_dataset_prefetch_early_stop():
+
+    my_data = MyMemmapDataset()
+
+    for batch_X, batch_y in my_data.batches(batch_size=2, prefetch=3, prefetch_mode='process', shared_memory=True):
+        break
+
+    assert(my_data.prefetch_stats['batches'] == 1)
+
+class MyLazyDataset(Dataset):
+
+    files = ['data.csv']
+
+    @cachedata
+    def X(self):
+        return np.loadtxt('%s/data.csv' % self.extracted_data_path, delimiter=',')
+
+def test_dataset_lazy(tmpdir, monkeypatch):
+
+    monkeypatch.chdir(str(tmpdir))
+    raw_dir = tmpdir.mkdir('data').mkdir('tests').mkdir('raw')
+    raw_dir.join('data.csv').write('1,2\n3,4\n5,6\n')
+
+    # nothing is hashed or extracted until we touch the data
+    my_data = MyLazyDataset(lazy=True)
+
+    assert(my_data.files_data_pending)
+    assert(not raw_dir.join('.extract').exists())
+
+    assert(len(my_data) == 3)
+    assert(not my_data.files_data_pending)
+    assert(raw_dir.join('hash').exists())
+    assert(my_data.data_hash is not None)
+
+    my_data = MyLazyDataset(lazy=True)
+    batch_X, batch_y = my_data.get_batch(np.array([1]))
+
+    assert(np.array_equal(batch_X, np.array([[3., 4.]])))
+
+def test_dataset_lazy_threads(tmpdir, monkeypatch):
+
+    import threading
+    import time
+
+    monkeypatch.chdir(str(tmpdir))
+    raw_dir = tmpdir.mkdir('data').mkdir('tests').mkdir('raw')
+    raw_dir.join('data.csv').write('1,2\n3,4\n5,6\n')
+
+    my_data = MyLazyDataset(lazy=True)
+    extract_file_data = my_data.extract_file_data
+    n_extracts = []
+
+    def slow_extract_file_data():
+        time.sleep(0.05)
+        n_extracts.append(1)
+        extract_file_data()
+
+    my_data.extract_file_data = slow_extract_file_data
+
+    # threads touching the data of a lazy dataset together extract the files once
+    threads = [threading.Thread(target=my_data.load_files_data) for thread_no in range(4)]
+
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert(len(n_extracts) == 1)
+    assert(not my_data.files_data_pending)
+    assert(len(my_data) == 3)
+
+def make_tar_file(tar_path, members):
+
+    import tarfile
+
+    with tarfile.open(tar_path, 'w:gz') as tar:
+        for name, content in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            info.mtime = 1500000000
+            tar.addfile(info, io.BytesIO(content))
+
+def make_extract_dataset(tmpdir):
+
+    my_data = MyDataset()
+    my_data.raw_data_path = str(tmpdir)
+    my_data.extracted_data_path = str(tmpdir.mkdir('.extract'))
+
+    return my_data
+
+@pytest.mark.parametrize('members, extracted', [
+    ([('images/a.jpg', b'a'), ('images/sub/b.jpg', b'bb')], ['a.jpg', 'sub/b.jpg']),
+    ([('a.jpg', b'a'), ('sub/b.jpg', b'bb')], ['a.jpg', 'sub/b.jpg']),
+    ([('images/a.jpg', b'a'), ('other/b.jpg', b'bb')], ['images/a.jpg', 'other/b.jpg']),
+    ([('images/a.jpg', b'a'), ('b.jpg', b'bb'), ('../c.jpg', b'c')], ['images/a.jpg', 'b.jpg'])])
+def test_extract_tar_file(tmpdir, members, extracted):
+
+    from mantraml.core.hashing.MantraHashed import MantraHashed
+
+    tar_path = str(tmpdir.join('images.tar.gz'))
+    make_tar_file(tar_path, members)
+
+    my_data = make_extract_dataset(tmpdir)
+    tar_hash = my_data.extract_tar_file(tar_path)
+
+    assert(tar_hash == MantraHashed.get_256_hash_from_file(tar_path))
+
+    extracted_files = []
+    for path, dirs, files in os.walk(my_data.extracted_data_path):
+        extracted_files += [os.path.relpath(os.path.join(path, file), my_data.extracted_data_path) for file in files]
+
+    assert(sorted(extracted_files) == sorted(extracted))
+
+def test_extract_tar_file_skips_unchanged(tmpdir):
+
+    tar_path = str(tmpdir.join('images.tar.gz'))
+    make_tar_file(tar_path, [('images/a.jpg', b'a'), ('images/b.jpg', b'bb')])
+
+    my_data = make_extract_dataset(tmpdir)
+    my_data.extract_tar_file(tar_path)
+
+    # an unchanged member is not written again; a changed one is
+    marker_path = os.path.join(my_data.extracted_data_path, 'a.jpg')
+    os.utime(marker_path, (1500000000, 1500000000))
+    os.chmod(marker_path, 0o444)
+
+    make_tar_file(tar_path, [('images/a.jpg', b'a'), ('images/b.jpg', b'ccc')])
+    my_data.extract_tar_file(tar_path)
+
+    assert(oct(os.stat(marker_path).st_mode)[-3:] == '444')
+    assert(open(os.path.join(my_data.extracted_data_path, 'b.jpg'), 'rb').read() == b'ccc')
+
+def test_extract_removes_deleted_members(tmpdir):
+
+    make_tar_file(str(tmpdir.join('images.tar.gz')), [('images/a.jpg', b'a'), ('images/sub/b.jpg', b'bb')])
+    tmpdir.join('data.csv').write('a,b\n1,2\n')
+
+    my_data = make_extract_dataset(tmpdir)
+    my_data.cache_data_path = str(tmpdir.mkdir('.cache'))
+    my_data.files = ['images.tar.gz', 'data.csv']
+    my_data.extract_file_dict = {'images.tar.gz': True, 'data.csv': False}
+
+    my_data.get_data_dependency_hashes()
+    my_data.remove_deleted_members(my_data.load_manifest())
+    my_data.save_manifest()
+
+    assert(my_data.file_members['images.tar.gz'] == {'a.jpg': [1, 1500000000], 'sub/b.jpg': [2, 1500000000]})
+
+    # a member deleted from the tar file, and a file removed from Dataset.files, are removed from the .extract folder
+    make_tar_file(str(tmpdir.join('images.tar.gz')), [('images/a.jpg', b'a'), ('images/c.jpg', b'c')])
+    my_data.files = ['images.tar.gz']
+
+    old_manifest = my_data.load_manifest()
+    my_data.get_data_dependency_hashes()
+    my_data.remove_deleted_members(old_manifest)
+
+    assert(sorted(os.listdir(my_data.extracted_data_path)) == ['a.jpg', 'c.jpg'])
+
+def test_extract_skips_unchanged_tar_file(tmpdir):
+
+    make_tar_file(str(tmpdir.join('images.tar.gz')), [('images/a.jpg', b'a')])
+
+    my_data = make_extract_dataset(tmpdir)
+    my_data.cache_data_path = str(tmpdir.mkdir('.cache'))
+    my_data.files = ['images.tar.gz']
+    my_data.extract_file_dict = {'images.tar.gz': True}
+
+    file_hashes = my_data.get_data_dependency_hashes()
+    my_data.save_manifest()
+
+    extracted_tar_files = []
+    my_data.extract_tar_file = lambda file, members=None: extracted_tar_files.append(file)
+
+    # the tar file is unchanged and still extracted, so we do not read it
+    assert(my_data.get_data_dependency_hashes() == file_hashes)
+    assert(extracted_tar_files == [])
+    assert(my_data.file_members['images.tar.gz'] == {'a.jpg': [1, 1500000000]})
+
+    # unless we verify the hashes, or the extracted files are missing
+    my_data.verify_hashes = True
+    my_data.get_data_dependency_hashes()
+    my_data.verify_hashes = False
+
+    os.remove(os.path.join(my_data.extracted_data_path, 'a.jpg'))
+    my_data.get_data_dependency_hashes()
+
+    assert(len(extracted_tar_files) == 2)
+
+def test_adjust_color_channels(tmpdir):
+
+    from PIL import Image
+
+    extract_dir = tmpdir.mkdir('raw').mkdir('.extract')
+    tmpdir.join('raw').mkdir('.cache')
+
+    for image_no in range(5):
+        Image.new('RGBA' if image_no < 3 else 'RGB', (4, 4)).save(str(extract_dir.join('%s.png' % image_no)))
+
+    my_data = make_extract_dataset(tmpdir)
+    my_data.data_dir = '%s/' % tmpdir
+    my_data.extracted_data_path = str(extract_dir)
+    my_data.data_hash = 'hash_1'
+    my_data.file_format = '.png'
+    my_data.image_shape = (4, 4, 3)
+
+    my_data.adjust_color_channels()
+
+    assert(my_data.image_shape == (4, 4, 4))
+    assert(my_data.load_image_probe()['n_color_channels'] == 4)
+
+    # the probe is stored with the dependency hash, so we only read the images again if the hash changes
+    for image_path in extract_dir.listdir():
+        image_path.remove()
+
+    my_data.adjust_color_channels()
+    assert(my_data.n_color_channels == 4)
+
+    Image.new('L', (4, 4)).save(str(extract_dir.join('0.png')))
+    my_data.data_hash = 'hash_2'
+    my_data.adjust_color_channels()
+
+    assert(my_data.image_shape == (4, 4, 1))
+
+def test_find_image_file_format(tmpdir):
+
+    from mantraml.core.hashing.MantraHashed import MantraHashed
+
+    raw_dir = tmpdir.mkdir('raw')
+    cache_dir = raw_dir.mkdir('.cache')
+    make_tar_file(str(raw_dir.join('images.tar.gz')), [('images/a.jpg', b'a'), ('images/b.jpg', b'b'), ('images/c.txt', b'c')])
+
+    my_data = MyDataset()
+    my_data.data_dir = '%s/' % tmpdir
+    my_data.image_dataset = 'images.tar.gz'
+
+    my_data.find_image_file_format()
+
+    assert(my_data.file_format == '.jpg')
+    assert(my_data.n_color_channels == 3)
+
+    # a stored probe for the unchanged tar file is used instead of the tar file
+    hash_manifest = {}
+    MantraHashed.get_256_hash_from_file_with_manifest(str(raw_dir.join('images.tar.gz')), hash_manifest)
+    MantraHashed.save_hash_manifest(str(cache_dir.join('hashes.json')), hash_manifest)
+
+    my_data.save_image_probe({'data_hash': 'hash_1', 'file_format': '.png', 'n_color_channels': 1, 
+        'image_dataset_hash': MantraHashed.get_256_hash_from_file(str(raw_dir.join('images.tar.gz')))})
+
+    my_data.find_image_file_format()
+
+    assert(my_data.file_format == '.png')
+    assert(my_data.n_color_channels == 1)
+
+def test_link_data_file(tmpdir):
+
+    data_path = tmpdir.join('data.csv')
+    data_path.write('a,b\n1,2\n')
+
+    my_data = make_extract_dataset(tmpdir)
+    my_data.link_data_file(str(data_path))
+    my_data.link_data_file(str(data_path))
+
+    assert(os.path.samefile(str(data_path), os.path.join(my_data.extracted_data_path, 'data.csv')))
+
+@pytest.mark.parametrize('tar_name', ['images.tar.gz', 'images.tar'])
+def test_image_dataset_read_from_archive(tmpdir, tar_name):
+
+    members = [('images/%s.jpg' % value, str(value).encode()) for value in [3, 1, 2]] + [('images/labels.txt', b'x')]
+
+    if tar_name.endswith('.gz'):
+        make_tar_file(str(tmpdir.join(tar_name)), members)
+    else:
+        make_tar_file(str(tmpdir.join('compressed.tar.gz')), members)
+        import gzip
+        with gzip.open(str(tmpdir.join('compressed.tar.gz')), 'rb') as compressed_file:
+            tmpdir.join(tar_name).write_binary(compressed_file.read())
+
+    my_data = MyArchiveImageDataset()
+    my_data.image_dataset = tar_name
+    my_data.files = [tar_name]
+    my_data.extract_file_dict = {tar_name: True}
+    my_data.raw_data_path = str(tmpdir)
+    my_data.extracted_data_path = str(tmpdir.mkdir('.extract'))
+    my_data.cache_data_path = str(tmpdir.mkdir('.cache'))
+    my_data.file_format = '.jpg'
+    my_data.image_shape = (2, 2, 3)
+
+    my_data.get_data_dependency_hashes()
+
+    # nothing is extracted, and batches and X are decoded from the archive
+    assert(os.listdir(my_data.extracted_data_path) == [])
+    assert([image.name for image in my_data.image_files] == ['images/1.jpg', 'images/2.jpg', 'images/3.jpg'])
+
+    batch_X, batch_y = my_data.get_batch(np.array([2]))
+    assert(np.all(batch_X == 3))
+
+    assert(np.all(my_data.X[:, 0, 0, 0] == np.array([1, 2, 3])))
+    assert(my_data.image_file_names == ['images/1.jpg', 'images/2.jpg', 'images/3.jpg'])
+
+def test_build_tar_index(tmpdir):
+
+    tar_path = str(tmpdir.join('images.tar.gz'))
+    make_tar_file(tar_path, [('b.jpg', b'bb'), ('a.jpg', b'a')])
+
+    import gzip
+    with gzip.open(tar_path, 'rb') as compressed_file:
+        tmpdir.join('images.tar').write_binary(compressed_file.read())
+
+    index = build_tar_index(str(tmpdir.join('images.tar')))
+    tar_bytes = tmpdir.join('images.tar').read_binary()
+
+    assert([name for name, offset, size, mtime in index] == ['a.jpg', 'b.jpg'])
+    assert([tar_bytes[offset:offset + size] for name, offset, size, mtime in index] == [b'a', b'bb'])
+    assert([mtime for name, offset, size, mtime in index] == [1500000000, 1500000000])
+
+def test_read_archive_member_changed_archive(tmpdir):
+
+    from mantraml.data.archive import ArchiveMember
+
+    archive_path = tmpdir.join('archive.tar')
+    archive_path.write_binary(b'abcd')
+
+    assert(bytes(read_archive_member(ArchiveMember(str(archive_path), 'a', 1, 2))) == b'bc')
+
+    # a rewritten archive is mapped again rather than read through the old map
+    archive_path.write_binary(b'wxyz!')
+
+    assert(bytes(read_archive_member(ArchiveMember(str(archive_path), 'a', 3, 2))) == b'z!')
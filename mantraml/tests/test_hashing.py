@@ -51,4 +51,26 @@ def test_get_tree_contents():
     assert(tree_lines[3] == '700 file hash5 file2 ')
     assert(tree_lines[4] == '700 file hash6 file3 ')
 
-    assert(tree_hash == 'b258eeaf5c932c3b57a0e1f955f11331df5b66f6a1dfb470686397f6c3726c4c')
\ No newline at end of file
+    assert(tree_hash == 'b258eeaf5c932c3b57a0e1f955f11331df5b66f6a1dfb470686397f6c3726c4c')
+
+def test_get_256_hash_from_file_with_manifest(tmpdir):
+
+    data_file = tmpdir.join('data.csv')
+    data_file.write('a,b\n1,2\n')
+
+    manifest = {}
+    file_hash = MantraHashed.get_256_hash_from_file_with_manifest(str(data_file), manifest)
+
+    assert(file_hash == MantraHashed.get_256_hash_from_file(str(data_file)))
+
+    # an unchanged file takes its hash from the manifest, unless we verify
+    MantraHashed.record_manifest_hash(str(data_file), manifest, 'stored_hash')
+
+    assert(MantraHashed.get_256_hash_from_file_with_manifest(str(data_file), manifest) == 'stored_hash')
+    assert(MantraHashed.get_256_hash_from_file_with_manifest(str(data_file), manifest, verify=True) == file_hash)
+
+    # a changed file is hashed again
+    MantraHashed.record_manifest_hash(str(data_file), manifest, 'stored_hash')
+    data_file.write('a,b\n1,2\n3,4\n')
+
+    assert(MantraHashed.get_256_hash_from_file_with_manifest(str(data_file), manifest) == MantraHashed.get_256_hash_from_file(str(data_file)))
@@ -42,27 +42,27 @@ def test_update_trial_metadata():
     model.task = None
 
     new_yaml_content = model.update_trial_metadata({}, 99)
-    assert(yaml.load(new_yaml_content)['training_finished'] is True)
+    assert(yaml.safe_load(new_yaml_content)['training_finished'] is True)
 
     new_yaml_content = model.update_trial_metadata({}, 98)
-    assert(yaml.load(new_yaml_content)['training_finished'] is False)
+    assert(yaml.safe_load(new_yaml_content)['training_finished'] is False)
 
     new_yaml_content = model.update_trial_metadata({}, 48)
-    assert(yaml.load(new_yaml_content)['current_epoch'] == 49)
+    assert(yaml.safe_load(new_yaml_content)['current_epoch'] == 49)
 
     model.task = MockTask()
 
     model.save_best_only = False
     new_yaml_content = model.update_trial_metadata({}, 98)
-    assert(yaml.load(new_yaml_content)['validation_loss'] == model.task.latest_loss)
-    assert(yaml.load(new_yaml_content)['secondary_metrics']['accuracy'] == 0.60)
-    assert(yaml.load(new_yaml_content)['secondary_metrics']['rmse'] == 1.543)
+    assert(yaml.safe_load(new_yaml_content)['validation_loss'] == model.task.latest_loss)
+    assert(yaml.safe_load(new_yaml_content)['secondary_metrics']['accuracy'] == 0.60)
+    assert(yaml.safe_load(new_yaml_content)['secondary_metrics']['rmse'] == 1.543)
 
     model.save_best_only = True
     new_yaml_content = model.update_trial_metadata({}, 98)
-    assert(yaml.load(new_yaml_content)['validation_loss'] == model.task.best_loss)
-    assert(yaml.load(new_yaml_content)['secondary_metrics']['accuracy'] == 0.80)
-    assert(yaml.load(new_yaml_content)['secondary_metrics']['rmse'] == 1.032)
+    assert(yaml.safe_load(new_yaml_content)['validation_loss'] == model.task.best_loss)
+    assert(yaml.safe_load(new_yaml_content)['secondary_metrics']['accuracy'] == 0.80)
+    assert(yaml.safe_load(new_yaml_content)['secondary_metrics']['rmse'] == 1.032)
 
 
 
@@ -70,3 +70,61 @@ def test_update_trial_metadata():
 
 
 
+
+def test_update_trial_metadata_prefetch_stats():
+
+    class MockData:
+
+        def __init__(self):
+            self.prefetch_stats = {'batches': 10, 'queue_wait_time': 0.5, 'producer_time': 2.5}
+
+    model = MantraModel()
+    model.epochs = 100
+    model.task = None
+    model.data = MockData()
+
+    new_yaml_content = yaml.safe_load(model.update_trial_metadata({}, 10))
+
+    assert(new_yaml_content['data_prefetch']['batches'] == 10)
+    assert(new_yaml_content['data_prefetch']['queue_wait_time'] == 0.5)
+    assert(new_yaml_content['data_prefetch']['producer_time'] == 2.5)
+
+def test_update_trial_metadata_subsampled_loss():
+
+    class MockTask:
+
+        def __init__(self):
+            self.latest_loss = 60
+            self.latest_loss_subsampled = True
+
+    model = MantraModel()
+    model.epochs = 100
+    model.task = MockTask()
+    model.save_best_only = False
+
+    # earlier losses without a flag were evaluated on the full validation data
+    yaml_content = yaml.safe_load(model.update_trial_metadata({'validation_loss_history': [70.0]}, 10))
+
+    assert(yaml_content['validation_loss_subsampled'] is True)
+    assert(yaml_content['validation_loss_subsampled_history'] == [False, True])
+
+    model.task.latest_loss_subsampled = False
+    yaml_content = yaml.safe_load(model.update_trial_metadata(yaml_content, 11))
+
+    assert(yaml_content['validation_loss_subsampled'] is False)
+    assert(yaml_content['validation_loss_subsampled_history'] == [False, True, False])
+
+    # with save_best_only, the reported loss is the best full evaluation once there is one
+    model.save_best_only = True
+    model.task.best_loss = None
+    model.task.latest_loss_subsampled = True
+    yaml_content = yaml.safe_load(model.update_trial_metadata(yaml_content, 12))
+
+    assert(yaml_content['validation_loss'] == 60)
+    assert(yaml_content['validation_loss_subsampled'] is True)
+
+    model.task.best_loss = 65
+    yaml_content = yaml.safe_load(model.update_trial_metadata(yaml_content, 13))
+
+    assert(yaml_content['validation_loss'] == 65)
+    assert(yaml_content['validation_loss_subsampled'] is False)
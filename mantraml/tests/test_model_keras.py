@@ -29,4 +29,28 @@ def test_evaluate_task():
     evaluate_task = EvaluateTask(mantra_model=mantra_model)
     evaluate_task.on_epoch_end(5)
     assert(mantra_model.task.latest_loss == 5.0)
-    assert(mantra_model.task.secondary_metrics_values['at_a_loss'] == 10.0)
\ No newline at end of file
+    assert(mantra_model.task.secondary_metrics_values['at_a_loss'] == 10.0)
+def test_dataset_sequence_augmentation_epochs():
+
+    from mantraml.data import AugmentationPipeline, ImageDataset, RandomCrop, RandomFlip, cachedata
+    from mantraml.models.keras.data import DatasetSequence
+
+    class MyAugmentedDataset(ImageDataset):
+
+        files = []
+        image_dtype = 'uint8'
+
+        @cachedata
+        def X(self):
+            return np.random.RandomState(0).randint(0, 256, size=(10, 8, 8, 3)).astype(np.uint8)
+
+    my_data = MyAugmentedDataset(augmentation=AugmentationPipeline([RandomCrop(padding=2), RandomFlip(vertical=True)], seed=0))
+    sequence = DatasetSequence(my_data, batch_size=5)
+
+    # a seeded pipeline augments each epoch differently
+    first_epoch = [sequence[index] for index in range(len(sequence))]
+    sequence.on_epoch_end()
+    second_epoch = [sequence[index] for index in range(len(sequence))]
+
+    assert(my_data.augmentation.epoch == 1)
+    assert(not all([np.array_equal(batch, batch_again) for batch, batch_again in zip(first_epoch, second_epoch)]))
@@ -28,4 +28,30 @@ def test_evaluate_task():
 
     evaluate_task = EvaluateTask(mantra_model=mantra_model)
     assert(mantra_model.task.latest_loss == 5.0)
-    assert(mantra_model.task.secondary_metrics_values['at_a_loss'] == 10.0)
\ No newline at end of file
+    assert(mantra_model.task.secondary_metrics_values['at_a_loss'] == 10.0)
+def test_dataset_iterable_augmentation_epochs():
+
+    from mantraml.data import AugmentationPipeline, ImageDataset, RandomCrop, RandomFlip, cachedata
+    from mantraml.models.pytorch.data import DatasetIterable
+
+    class MyAugmentedDataset(ImageDataset):
+
+        files = []
+        image_dtype = 'uint8'
+
+        @cachedata
+        def X(self):
+            return np.random.RandomState(0).randint(0, 256, size=(10, 8, 8, 3)).astype(np.uint8)
+
+    my_data = MyAugmentedDataset(augmentation=AugmentationPipeline([RandomCrop(padding=2), RandomFlip(vertical=True)], seed=0))
+    iterable = DatasetIterable(my_data, batch_size=5)
+
+    # each pass advances the epoch, and set_epoch sets it, so a seeded pipeline augments each epoch differently
+    first_epoch = [batch.numpy() for batch in iterable]
+    second_epoch = [batch.numpy() for batch in iterable]
+
+    assert(not all([np.array_equal(batch, batch_again) for batch, batch_again in zip(first_epoch, second_epoch)]))
+
+    iterable.set_epoch(0)
+
+    assert(all([np.array_equal(batch.numpy(), batch_again) for batch, batch_again in zip(iterable, first_epoch)]))
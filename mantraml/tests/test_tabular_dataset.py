@@ -0,0 +1,191 @@
+import os
+import numpy as np
+import pandas as pd
+
+from mantraml.data import TabularDataset
+
+import pytest
+
+
+def make_tabular_dataset(tmpdir, n_rows=25, **attributes):
+
+    extract_dir = tmpdir.mkdir('raw').mkdir('.extract')
+
+    df = pd.DataFrame({
+        'feature_1': np.arange(n_rows, dtype=np.float64) / 2,
+        'feature_2': np.arange(n_rows),
+        'unused': ['text'] * n_rows,
+        'home_win': np.arange(n_rows) % 2})
+    df.to_csv(str(extract_dir.join('data.csv')), index=False)
+
+    attributes = dict({'files': [], 'data_file': 'data.csv', 'data_dir': '%s/' % tmpdir}, **attributes)
+    dataset_class = type('MyTabularDataset', (TabularDataset,), attributes)
+
+    return dataset_class(), df
+
+@pytest.mark.parametrize('convert_csv', [True, False])
+def test_tabular_dataset_usecols(tmpdir, convert_csv):
+
+    my_data, df = make_tabular_dataset(tmpdir, features=['feature_1', 'feature_2'], target='home_win', convert_csv=convert_csv)
+
+    assert(list(my_data.df.columns) == ['feature_1', 'feature_2', 'home_win'])
+    assert(my_data.df['feature_1'].dtype == np.float32)
+    assert(my_data.df['feature_2'].dtype.itemsize == 1)
+
+    assert(np.allclose(my_data.X, df[['feature_1', 'feature_2']].values))
+    assert(np.all(my_data.y == df['home_win'].values))
+
+def test_tabular_dataset_feature_indices(tmpdir):
+
+    my_data, df = make_tabular_dataset(tmpdir, feature_indices=['0', '1'], target_index=3, dtypes={'feature_2': np.int64})
+
+    assert(my_data.df['feature_2'].dtype == np.int64)
+    assert(np.allclose(my_data.X, df[['feature_1', 'feature_2']].values))
+    assert(np.all(my_data.y == df['home_win'].values))
+
+def test_tabular_dataset_dtypes_whole_column(tmpdir):
+
+    # a value larger than the sampled rows hold, late in the file, keeps a dtype that fits it
+    my_data, df = make_tabular_dataset(tmpdir, n_rows=20000, features=['feature_2'], target='home_win', convert_csv=False)
+    df.loc[19999, 'feature_2'] = 100000
+    df.to_csv(my_data.data_file_path, index=False)
+
+    assert(my_data.X[-1, 0] == 100000)
+    assert(np.array_equal(my_data.X[:, 0], df['feature_2'].values))
+
+    my_data, df = make_tabular_dataset(tmpdir.mkdir('explicit'), features=['feature_2'], target='home_win', convert_csv=False,
+        dtypes={'feature_2': np.int8})
+    df.loc[24, 'feature_2'] = 1000
+    df.to_csv(my_data.data_file_path, index=False)
+
+    with pytest.raises(OverflowError):
+        my_data.X
+
+@pytest.mark.parametrize('target', ['home_win', ['home_win']])
+def test_tabular_dataset_chunked(tmpdir, target):
+
+    my_data, df = make_tabular_dataset(tmpdir, features=['feature_1', 'feature_2'], target=target, chunk_size=7)
+
+    assert(my_data.X.dtype == np.float32)
+    assert(my_data.X.shape == (25, 2))
+    assert(my_data.y.shape == df[target].values.shape)
+    assert(np.allclose(my_data.X, df[['feature_1', 'feature_2']].values))
+    assert(np.all(my_data.y == df[target].values))
+    assert(getattr(my_data, '_df', None) is None)
+
+def test_tabular_dataset_chunked_storage(tmpdir):
+
+    cache_dir = tmpdir.mkdir('cache')
+    my_data, df = make_tabular_dataset(tmpdir, features=['feature_1', 'feature_2'], target='home_win', chunk_size=7)
+    my_data.storage = 'memmap'
+    my_data.data_hash = 'hash_1'
+    my_data.cache_data_path = str(cache_dir)
+
+    # y is read in the same pass as X, and is stored like X rather than assigned directly
+    X = my_data.X
+
+    assert(isinstance(X, np.memmap))
+    assert(isinstance(my_data._y, np.memmap))
+    assert(np.all(my_data.y == df['home_win'].values))
+    assert(sorted(set([path.basename[0] for path in cache_dir.listdir()])) == ['X', 'y'])
+
+def test_tabular_dataset_file_type(tmpdir):
+
+    with pytest.raises(TypeError):
+        make_tabular_dataset(tmpdir, data_file='data.xls')
+
+def test_tabular_dataset_csv_conversion(tmpdir):
+
+    pytest.importorskip('pyarrow')
+
+    my_data, df = make_tabular_dataset(tmpdir, features=['feature_1', 'feature_2'], target='home_win', convert_csv=True)
+
+    data_file_path, file_type = my_data.get_read_location()
+
+    assert(file_type == 'parquet')
+    assert(os.path.basename(data_file_path).startswith('data.csv.'))
+    assert(np.allclose(my_data.X, df[['feature_1', 'feature_2']].values))
+
+    # the conversion is reused until the csv file changes
+    assert(my_data.get_read_location()[0] == data_file_path)
+
+    df.iloc[:10].to_csv(my_data.data_file_path, index=False)
+    new_data_file_path, file_type = my_data.get_read_location()
+
+    assert(new_data_file_path != data_file_path)
+    assert(not os.path.isfile(data_file_path))
+
+def test_tabular_dataset_csv_conversion_fallback(tmpdir):
+
+    pytest.importorskip('pyarrow.csv')
+
+    # an integer column that turns fractional after the first block cannot be streamed to parquet, so we read the csv file
+    n_rows = 200000
+    my_data, df = make_tabular_dataset(tmpdir, n_rows=n_rows, features=['feature_1', 'feature_2'], target='home_win', convert_csv=True)
+    df['feature_2'] = df['feature_2'].astype(object)
+    df.loc[n_rows - 1, 'feature_2'] = 1.5
+    df.to_csv(my_data.data_file_path, index=False)
+
+    data_file_path, file_type = my_data.get_read_location()
+
+    assert(file_type == 'csv')
+    assert(not any(file_name.endswith('.tmp') for file_name in os.listdir(os.path.dirname(my_data.data_file_path))))
+    assert(np.isclose(my_data.X[-1, 1], 1.5))
+
+@pytest.mark.parametrize('file_type', ['parquet', 'feather', 'npz'])
+@pytest.mark.parametrize('chunk_size', [None, 10])
+def test_tabular_dataset_columnar_files(tmpdir, file_type, chunk_size):
+
+    if file_type != 'npz':
+        pytest.importorskip('pyarrow')
+
+    my_data, df = make_tabular_dataset(tmpdir, feature_indices=[0, 1], target_index=3, chunk_size=chunk_size)
+    data_file_path = str(tmpdir.join('raw', '.extract', 'data.%s' % file_type))
+
+    if file_type == 'parquet':
+        df.to_parquet(data_file_path)
+    elif file_type == 'feather':
+        df.to_feather(data_file_path)
+    else:
+        np.savez(data_file_path, **{column: df[column].values for column in df.columns})
+
+    my_data.data_file = 'data.%s' % file_type
+    my_data.data_file_path = data_file_path
+
+    assert(np.allclose(my_data.X, df[['feature_1', 'feature_2']].values))
+    assert(np.all(my_data.y == df['home_win'].values))
+
+@pytest.mark.parametrize('file_type', ['csv', 'parquet', 'feather', 'npz'])
+@pytest.mark.parametrize('chunk_size', [None, 3])
+def test_tabular_dataset_shard(tmpdir, file_type, chunk_size):
+
+    if file_type != 'npz':
+        pytest.importorskip('pyarrow')
+
+    my_data, df = make_tabular_dataset(tmpdir, features=['feature_1', 'feature_2'], target='home_win', chunk_size=chunk_size)
+
+    if file_type != 'csv':
+        data_file_path = str(tmpdir.join('raw', '.extract', 'data.%s' % file_type))
+
+        if file_type == 'parquet':
+            df.to_parquet(data_file_path, row_group_size=4)
+        elif file_type == 'feather':
+            df.to_feather(data_file_path)
+        else:
+            np.savez(data_file_path, **{column: df[column].values for column in df.columns})
+
+        my_data.data_file = 'data.%s' % file_type
+        my_data.data_file_path = data_file_path
+
+    shards = [my_data.shard(4, index) for index in range(4)]
+
+    assert([len(shard.X) for shard in shards] == [7, 6, 6, 6])
+    assert(np.allclose(np.concatenate([shard.X for shard in shards]), df[['feature_1', 'feature_2']].values))
+    assert(np.all(np.concatenate([shard.y for shard in shards]) == df['home_win'].values))
+    assert(getattr(my_data, '_X', None) is None)
+
+    with pytest.raises(ValueError):
+        my_data.shard(4, 4)
+
+    with pytest.raises(ValueError):
+        shards[0].shard(2, 0)
@@ -128,4 +128,350 @@ def test_indices_attribute():
     X_val = my_task.X_val
    
     assert(X_val.shape == (3, 2))
-    assert(np.all(X_val == np.array([[7, 8], [8, 9], [9, 10]])))
\ No newline at end of file
+    assert(np.all(X_val == np.array([[7, 8], [8, 9], [9, 10]])))
+
+def test_indices_views():
+
+    my_task = Task(data=MockData())
+    my_task.training_indices = np.arange(0, 4)
+    my_task.validation_indices = [4, 6, 8]
+    my_task.test_indices = [5, 1, 7]
+
+    # ranges, including ranges with a step, are views of the data rather than copies
+    assert(np.shares_memory(my_task.X_train, MockData.X))
+    assert(np.shares_memory(my_task.X_val, MockData.X))
+    assert(np.all(my_task.y_val == np.array([14, 16, 18])))
+
+    assert(not np.shares_memory(my_task.X_test, MockData.X))
+    assert(np.all(my_task.X_test[:, 0] == np.array([6, 2, 8])))
+
+def test_lazy_splits():
+
+    from mantraml.tasks import IndexedSplit
+
+    my_task = Task(data=MockData())
+    my_task.lazy_splits = True
+    my_task.training_indices = [5, 1, 7, 3]
+
+    X_train = my_task.X_train
+
+    assert(isinstance(X_train, IndexedSplit))
+    assert(X_train.shape == (4, 2))
+    assert(len(X_train) == 4)
+    assert(np.all(my_task.y_train == np.array([15, 11, 17, 13])))
+
+    # rows are gathered only when indexed
+    assert(np.all(X_train[0] == np.array([6, 7])))
+    assert(np.all(X_train[1:3] == np.array([[2, 3], [8, 9]])))
+    assert(np.all(X_train[:, 1] == np.array([7, 3, 9, 5])))
+    assert(np.all(np.asarray(X_train) == MockData.X[[5, 1, 7, 3]]))
+    assert([len(batch) for batch in X_train.batches(3)] == [3, 1])
+
+def test_run_evaluation_shares_predictions():
+
+    from mantraml.tasks import run_evaluation
+
+    class MockModel:
+
+        n_predictions = 0
+
+        def predict(self, X):
+            MockModel.n_predictions += 1
+            return X[:, 0] / 10
+
+    class MyTask(Task):
+
+        evaluation_name = 'Mean Prediction'
+        training_split = (0.33, 0.33, 0.34)
+        secondary_metrics = ['max_prediction', 'min_prediction']
+
+        def evaluate(self, model):
+            return self.predict(model).mean()
+
+        def max_prediction(self, model):
+            return self.predict(model).max()
+
+        def min_prediction(self, model):
+            return self.predict(model).min()
+
+    mantra_model = MockModel()
+    mantra_model.task = MyTask(data=MockData())
+
+    # one prediction pass for the evaluation and the secondary metrics, and none for a second evaluation in the same epoch
+    assert(np.isclose(run_evaluation(mantra_model, epoch=0, verbose=False), 0.4))
+    assert(np.isclose(run_evaluation(mantra_model, epoch=0, verbose=False), 0.4))
+    assert(mantra_model.task.secondary_metrics_values == {'max_prediction': 0.5, 'min_prediction': 0.3})
+    assert(MockModel.n_predictions == 1)
+
+    # a new epoch or model version evaluates again, and the predictions are not kept between evaluations
+    run_evaluation(mantra_model, epoch=1, verbose=False)
+    mantra_model.model_version = 2
+    run_evaluation(mantra_model, epoch=1, verbose=False)
+
+    assert(MockModel.n_predictions == 3)
+    assert(mantra_model.task._predictions is None)
+
+    mantra_model.task.predict(mantra_model)
+    assert(MockModel.n_predictions == 4)
+
+def test_run_evaluation_reused_task():
+
+    from mantraml.models import MantraModel
+    from mantraml.tasks import run_evaluation
+
+    class MockModel(MantraModel):
+
+        def __init__(self, weight):
+            self.weight = weight
+
+        def predict(self, X):
+            return X[:, 0] * self.weight
+
+    class MyTask(Task):
+
+        evaluation_name = 'Mean Prediction'
+        training_split = (0.33, 0.33, 0.34)
+
+        def evaluate(self, model):
+            return self.predict(model).mean()
+
+    task = MyTask(data=MockData())
+
+    # a task reused for a second training evaluates the new weights, not the cached loss of the first training
+    first_model = MockModel(weight=1)
+    first_model.task = task
+    first_model.start_training()
+    assert(np.isclose(run_evaluation(first_model, epoch=0, verbose=False), 4))
+
+    first_model.weight = 2
+    first_model.start_training()
+    assert(np.isclose(run_evaluation(first_model, epoch=0, verbose=False), 8))
+
+    second_model = MockModel(weight=3)
+    second_model.task = task
+    assert(np.isclose(run_evaluation(second_model, epoch=0, verbose=False), 12))
+
+def test_metrics():
+
+    from mantraml.tasks import Accuracy, BinaryCrossEntropy, ConfusionMatrix, Mean, merge_metrics
+
+    y_true = np.array([1, 0, 1, 1, 0, 0])
+    y_pred = np.array([0.9, 0.2, 0.4, 0.8, 0.6, 0.1])
+
+    # metrics updated batch by batch, or merged across batches, agree with the metric of all the data
+    metrics = {'loss': BinaryCrossEntropy(), 'accuracy': Accuracy(), 'confusion': ConfusionMatrix(n_classes=2)}
+    batch_metrics = []
+
+    for start in [0, 4]:
+        for metric in metrics.values():
+            metric.update(y_true[start:start + 4], y_pred[start:start + 4])
+
+        batch_metric = {'loss': BinaryCrossEntropy(), 'accuracy': Accuracy(), 'confusion': ConfusionMatrix(n_classes=2)}
+
+        for metric in batch_metric.values():
+            metric.update(y_true[start:start + 4], y_pred[start:start + 4])
+
+        batch_metrics.append(batch_metric)
+
+    loss = -np.mean(y_true*np.log(y_pred) + (1 - y_true)*np.log(1 - y_pred))
+
+    for results in [metrics, merge_metrics(batch_metrics)]:
+        assert(np.isclose(results['loss'].result(), loss))
+        assert(np.isclose(results['accuracy'].result(), 4 / 6))
+        assert(np.array_equal(results['confusion'].result(), np.array([[2, 1], [1, 2]])))
+
+    assert(np.isnan(Accuracy().result()))
+
+    with pytest.raises(ValueError):
+        Accuracy().merge(Mean())
+
+    # one hot labels and a column of probabilities are converted to classes
+    confusion = ConfusionMatrix(n_classes=2)
+    confusion.update(np.eye(2)[y_true], y_pred.reshape(-1, 1))
+
+    assert(np.array_equal(confusion.result(), np.array([[2, 1], [1, 2]])))
+
+def test_evaluate_batches():
+
+    from mantraml.tasks import Accuracy, ConfusionMatrix, Mean, run_evaluation
+
+    class MockModel:
+
+        batch_sizes = []
+
+        def predict(self, X):
+            MockModel.batch_sizes.append(len(X))
+            return (X[:, 0] % 2).astype(float)
+
+    class MyTask(Task):
+
+        evaluation_name = 'Mean Error'
+        training_split = (0, 1, 0)
+        evaluation_batch_size = 4
+        metrics = {'error': Mean(lambda y_true, y_pred: np.abs(y_true % 2 - y_pred)), 'accuracy': Accuracy()}
+
+    mantra_model = MockModel()
+    mantra_model.task = MyTask(data=MockData())
+
+    # the model predicts on one batch at a time, and the metrics share the pass
+    assert(run_evaluation(mantra_model, epoch=0, verbose=False) == 1.0)
+    assert(MockModel.batch_sizes == [4, 4, 1])
+    assert(mantra_model.task.secondary_metrics_values == {'accuracy': 0.0})
+
+    assert(mantra_model.task.evaluate(mantra_model) == 1.0)
+    assert(mantra_model.task.evaluate_batches(mantra_model, batch_size=9) == {'error': 1.0, 'accuracy': 0.0})
+
+    # the evaluation metric must be a scalar, and there must be validation data
+    mantra_model.task.metrics = {'confusion': ConfusionMatrix(n_classes=2), 'accuracy': Accuracy()}
+
+    with pytest.raises(ValueError):
+        mantra_model.task.evaluate(mantra_model)
+
+    mantra_model.task = MyTask(data=MockData())
+    mantra_model.task.training_split = (1, 0, 0)
+
+    with pytest.raises(ValueError):
+        run_evaluation(mantra_model, verbose=False)
+
+def test_subsampled_validation():
+
+    from mantraml.tasks import run_evaluation
+
+    class MockModel:
+
+        epochs = 4
+
+        def predict(self, X):
+            return X[:, 0]
+
+    class MyTask(Task):
+
+        evaluation_name = 'Example Count'
+        training_split = (0, 1, 0)
+        validation_subsample = 3
+        full_validation_every = 2
+
+        def evaluate(self, model):
+            assert(len(self.predict(model)) == len(self.y_val))
+            return len(self.X_val)
+
+    mantra_model = MockModel()
+    mantra_model.task = MyTask(data=MockData())
+
+    # epochs 1 and 3 (zero indexed 0 and 2) are subsampled; every second epoch and the last are full
+    losses = [run_evaluation(mantra_model, epoch=epoch, verbose=False) for epoch in range(4)]
+    subsample = mantra_model.task.get_validation_subsample()
+
+    assert(losses == [3, 9, 3, 9])
+    assert(mantra_model.task.latest_loss_subsampled is False)
+    assert(len(mantra_model.task.X_val) == 9)
+
+    # the subsample is the same seeded choice in every evaluation and for every task
+    assert(np.array_equal(subsample[0], MyTask(data=MockData()).get_validation_subsample()[0]))
+    assert(np.array_equal(subsample[0][:, 0] + 9, subsample[1]))
+
+    mantra_model.task.validation_subsample = 0.5
+    assert(len(mantra_model.task.get_validation_subsample_indices(9)) == 4)
+
+class MockSplitData:
+
+    def __init__(self, n_examples=1000, **attributes):
+        self.X = np.arange(n_examples).reshape(-1, 1)
+        self.y = np.arange(n_examples) % 10 < 2
+        self.user_id = np.arange(n_examples) // 7
+
+        for key, value in attributes.items():
+            setattr(self, key, value)
+
+    def __len__(self):
+        return len(self.y)
+
+@pytest.mark.parametrize('split_method', ['random', 'stratified', 'grouped'])
+def test_split_methods(split_method):
+
+    class MyTask(Task):
+        training_split = (0.6, 0.2, 0.2)
+        group_column = 'user_id'
+
+    data = MockSplitData()
+    my_task = MyTask(data=data)
+    my_task.split_method = split_method
+
+    indices = [my_task.X_train[:, 0], my_task.X_val[:, 0], my_task.X_test[:, 0]]
+
+    # the splits are disjoint, cover the data, and have close to the fractions of the data
+    assert(np.array_equal(np.sort(np.concatenate(indices)), np.arange(1000)))
+    assert(all([abs(len(split_indices) - 1000*fraction) <= 10 for split_indices, fraction in zip(indices, (0.6, 0.2, 0.2))]))
+
+    if split_method == 'stratified':
+        assert([int(data.y[split_indices].sum()) for split_indices in indices] == [120, 40, 40])
+
+    if split_method == 'grouped':
+        groups = [set(data.user_id[split_indices]) for split_indices in indices]
+        assert(not (groups[0] & groups[1]) and not (groups[0] & groups[2]) and not (groups[1] & groups[2]))
+
+def test_split_kfold():
+
+    class MyTask(Task):
+        split_method = 'stratified'
+        n_folds = 5
+
+    data = MockSplitData()
+    validation_indices = []
+
+    for fold in range(5):
+        my_task = MyTask(data=data)
+        my_task.fold = fold
+
+        assert(len(my_task.X_train) == 800)
+        assert(int(my_task.y_val.sum()) == 40)
+        validation_indices.append(my_task.validation_indices)
+
+    assert(np.array_equal(np.sort(np.concatenate(validation_indices)), np.arange(1000)))
+
+    with pytest.raises(ValueError):
+        my_task = Task(data=data)
+        my_task.split_method = 'sorted'
+        my_task.X_train
+
+    # continuous labels cannot be stratified
+    with pytest.raises(ValueError):
+        my_task = MyTask(data=MockSplitData(y=np.linspace(0, 1, 1000)))
+        my_task.X_train
+
+def test_split_cache(tmpdir):
+
+    class MyTask(Task):
+        split_method = 'random'
+        training_split = (0.5, 0.25, 0.25)
+
+    data = MockSplitData(data_hash='hash_1', cache_data_path=str(tmpdir))
+    my_task = MyTask(data=data)
+    training_indices = my_task.X_train[:, 0]
+
+    assert(len(tmpdir.listdir()) == 1)
+
+    # a later task reloads the split rather than generating it
+    cached_task = MyTask(data=data)
+    cached_task.get_split_assignments = None
+
+    assert(np.array_equal(cached_task.X_train[:, 0], training_indices))
+
+    # another split specification has its own cache, and a new version of the data replaces the caches of the old one
+    other_task = MyTask(data=data)
+    other_task.split_seed = 1
+    other_task.X_train
+
+    assert(len(tmpdir.listdir()) == 2)
+
+    MyTask(data=MockSplitData(data_hash='hash_2', cache_data_path=str(tmpdir))).X_train
+
+    assert(len(tmpdir.listdir()) == 1)
+
+    # the cache is keyed on the number of labels, so keying it does not load X
+    class MyLabelledData(MockSplitData):
+
+        def __len__(self):
+            raise AssertionError('len(data) loads X')
+
+    assert(MyTask(data=MyLabelledData(data_hash='hash_2', cache_data_path=str(tmpdir))).get_split_cache_path() is not None)
@@ -97,7 +97,7 @@ def test_configure_trial_metadata():
     assert(log_contents[9] == trial.task_hash + '\n') # Task hash
     assert(log_contents[1] == '%s_%s_%s_%s' % (log_contents[0], args.model_name, args.dataset, log_contents[2][:6]))
 
-    yaml_contents = yaml.load(yaml_contents)
+    yaml_contents = yaml.safe_load(yaml_contents)
 
     assert(yaml_contents['model_hash'] == trial.model_hash)
     assert(yaml_contents['task_hash'] == trial.task_hash)
@@ -131,7 +131,7 @@ def test_configure_trial_metadata():
     assert(log_contents[9] == 'none\n') # Task hash
     assert(log_contents[1] == '%s_%s_%s_%s' % (log_contents[0], args.model_name, args.dataset, log_contents[2][:6]))
 
-    yaml_contents = yaml.load(yaml_contents)
+    yaml_contents = yaml.safe_load(yaml_contents)
 
     assert(yaml_contents['model_hash'] == trial.model_hash)
     assert(yaml_contents['task_hash'] == 'none')